@@ -0,0 +1,244 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter: "no" answers are certain, "yes" answers are
+    wrong with roughly the configured false-positive rate.
+    """
+
+    def __init__(self, capacity, false_positive_rate=0.01, max_bytes=None):
+        capacity = max(1, capacity)
+        bits = math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2))
+        if max_bytes:
+            bits = min(bits, max_bytes * 8)
+        self.num_bits = max(8, bits)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def expected_false_positive_rate(self):
+        """False-positive rate for the number of keys added so far."""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def save(self, path, meta=None):
+        """Write the filter to path (JSON header line, then the bit array)."""
+        header = {"num_bits": self.num_bits, "num_hashes": self.num_hashes,
+                  "capacity": self.capacity, "count": self.count, "meta": meta or {}}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a filter written by save.
+
+        Returns:
+            tuple: (BloomFilter, dict) the filter and the meta saved with it.
+        """
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            bits = bytearray(f.read())
+        bloom = cls.__new__(cls)
+        bloom.num_bits = header["num_bits"]
+        bloom.num_hashes = header["num_hashes"]
+        bloom.capacity = header["capacity"]
+        bloom.count = header["count"]
+        if len(bits) != (bloom.num_bits + 7) // 8:
+            raise ValueError(f"Truncated Bloom filter snapshot: {path}")
+        bloom.bits = bits
+        return bloom, header["meta"]
+
+class MembershipFilter:
+    """
+    Bloom filter over the sizes and hashes recorded in file_hashes, kept in sync with the database.
+
+    The filter is loaded from a snapshot next to the database when the
+    snapshot still matches it, and rebuilt from the table otherwise. Rows
+    committed by other processes are picked up (new rows by rowid, hashes
+    set on existing rows from the hash_updates log) at most every
+    refresh_interval seconds, so another process's writes may be missed
+    for up to that long.
+    """
+
+    def __init__(self, db_path, connect, false_positive_rate=0.01, max_bytes=64 * 1024 * 1024,
+                 refresh_interval=1.0):
+        self.db_path = db_path
+        self.snapshot_path = db_path + ".bloom"
+        self.connect = connect
+        self.false_positive_rate = false_positive_rate
+        self.max_bytes = max_bytes
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.stats = {"lookups": 0, "skipped": 0, "false_positives": 0}
+        self.last_rowid = 0
+        self.last_update_seq = 0
+        self.checked_at = 0.0
+        self.bloom = None
+        self._load_or_build()
+
+    @staticmethod
+    def _row_keys(size, file_hash):
+        keys = []
+        if size is not None:
+            keys.append(f"size:{size}")
+        if file_hash:
+            keys.append(f"hash:{file_hash}")
+        return keys
+
+    def _db_state(self, cursor):
+        row_count, max_rowid = cursor.execute("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM file_hashes").fetchone()
+        return row_count, max_rowid, self._update_seq(cursor)
+
+    @staticmethod
+    def _update_seq(cursor):
+        """Last entry of the hash_updates log (0 if the database predates it)."""
+        if not cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'hash_updates'").fetchone():
+            return 0
+        return cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM hash_updates").fetchone()[0]
+
+    def _load_or_build(self):
+        try:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                row_count, max_rowid, update_seq = self._db_state(cursor)
+
+                if os.path.exists(self.snapshot_path):
+                    try:
+                        bloom, meta = BloomFilter.load(self.snapshot_path)
+                        if (meta.get("row_count") == row_count and meta.get("max_rowid") == max_rowid
+                                and meta.get("update_seq", 0) <= update_seq):
+                            self.bloom = bloom
+                            self.last_rowid = max_rowid
+                            # Hashes set since the snapshot are merged by the next refresh
+                            self.last_update_seq = meta.get("update_seq", 0)
+                            self.checked_at = 0.0
+                            logger.info(f"Loaded Bloom filter snapshot {self.snapshot_path} ({bloom.count} keys)")
+                            return
+                        logger.info("Bloom filter snapshot is out of date, rebuilding")
+                    except (OSError, ValueError) as e:
+                        logger.warning(f"Ignoring unreadable Bloom filter snapshot: {str(e)}")
+
+                started = time.perf_counter()
+                # Two keys per row, with room to grow before the filter needs rebuilding
+                self.bloom = BloomFilter(max(2 * row_count * 2, 100000), self.false_positive_rate, self.max_bytes)
+                for rowid, size, file_hash in cursor.execute("SELECT rowid, size, hash FROM file_hashes"):
+                    for key in self._row_keys(size, file_hash):
+                        self.bloom.add(key)
+                    self.last_rowid = max(self.last_rowid, rowid)
+                self.last_update_seq = update_seq
+                self.checked_at = time.monotonic()
+                logger.info(
+                    f"Built Bloom filter from {row_count} rows in {time.perf_counter() - started:.2f}s "
+                    f"({len(self.bloom.bits) / (1024 * 1024):.1f} MB, "
+                    f"expected false positives {self.bloom.expected_false_positive_rate():.4f})"
+                )
+        except sqlite3.Error as e:
+            # No table yet: start empty, rows are picked up by refresh
+            logger.warning(f"Building empty Bloom filter: {str(e)}")
+            self.bloom = self.bloom or BloomFilter(100000, self.false_positive_rate, self.max_bytes)
+
+    def _refresh(self):
+        """Add rows and hashes committed by other connections since the last refresh."""
+        now = time.monotonic()
+        if now - self.checked_at < self.refresh_interval:
+            return
+        self.checked_at = now
+        try:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                rows = cursor.execute(
+                    "SELECT rowid, size, hash FROM file_hashes WHERE rowid > ?", (self.last_rowid,)
+                ).fetchall()
+                updates = []
+                if self._update_seq(cursor) > self.last_update_seq:
+                    updates = cursor.execute(
+                        "SELECT seq, hash FROM hash_updates WHERE seq > ?", (self.last_update_seq,)
+                    ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Error refreshing Bloom filter: {str(e)}")
+            return
+        for rowid, size, file_hash in rows:
+            for key in self._row_keys(size, file_hash):
+                self.bloom.add(key)
+            self.last_rowid = max(self.last_rowid, rowid)
+        for seq, file_hash in updates:
+            self.bloom.add(f"hash:{file_hash}")
+            self.last_update_seq = max(self.last_update_seq, seq)
+        if self.bloom.count > self.bloom.capacity:
+            logger.info("Bloom filter is over capacity, rebuilding")
+            self._load_or_build()
+
+    def might_contain(self, key):
+        """
+        Check a key ("size:<bytes>" or "hash:<sha256>").
+
+        Returns:
+            bool: False if the key is certainly not in the database (the lookup can be skipped).
+        """
+        with self.lock:
+            self._refresh()
+            self.stats["lookups"] += 1
+            if key in self.bloom:
+                return True
+            self.stats["skipped"] += 1
+            return False
+
+    def add(self, size=None, file_hash=None):
+        """Record a row written by this process."""
+        with self.lock:
+            for key in self._row_keys(size, file_hash):
+                self.bloom.add(key)
+
+    def record_false_positive(self):
+        """Count a "maybe" answer that the database then answered with "no"."""
+        with self.lock:
+            self.stats["false_positives"] += 1
+
+    def save(self):
+        """Write a snapshot matching the current database contents."""
+        with self.lock:
+            try:
+                with self.connect() as conn:
+                    row_count, max_rowid, update_seq = self._db_state(conn.cursor())
+                # Rows from other processes not yet merged would make the snapshot incomplete
+                self.checked_at = 0.0
+                self._refresh()
+                self.bloom.save(self.snapshot_path, {"row_count": row_count, "max_rowid": max_rowid,
+                                                     "update_seq": update_seq})
+                logger.info(
+                    f"Saved Bloom filter snapshot: {self.stats['lookups']} lookups, "
+                    f"{self.stats['skipped']} database lookups saved, "
+                    f"{self.stats['false_positives']} false positives"
+                )
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Error saving Bloom filter snapshot: {str(e)}")
@@ -1,10 +1,17 @@
 import os
+import json
+import datetime
+import threading
 import tkinter as tk
 from tkinter import messagebox
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from config import (UPLOAD_WORKERS, UPLOAD_CHUNK_SIZE, RESUMABLE_UPLOAD_MIN_SIZE, SHARE_MODE, SHARE_BATCH_SIZE,
+                    MIRROR_FOLDERS, DESTINATION_PATH, BACKUP_SUBFOLDER, REMOTE_DEDUP)
+import drive_index
+import rate_limiter
+import scheduling
+import storage
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log", 
@@ -15,6 +22,169 @@ logger = logging.getLogger(__name__)
 SCOPES = ["https://www.googleapis.com/auth/drive.file"]
 CREDENTIALS_FILE = "credentials.json"
 TOKEN_FILE = "token.json"
+TOKEN_REFRESH_MARGIN = 300  # Seconds before expiry the access token is refreshed in the background
+TOKEN_REFRESH_RETRY = 60  # Seconds before a failed background refresh is tried again
+
+# Process-wide Drive client factory and discovery document (see drive_client_factory)
+_client_factory = None
+_client_factory_lock = threading.Lock()
+_discovery_document = None
+_refresh_timer = None
+
+# Permission granting link access
+ANYONE_READER = {"role": "reader", "type": "anyone"}
+
+def share_link(file_id):
+    """Return the shareable view link of a Google Drive file."""
+    return f"https://drive.google.com/file/d/{file_id}/view?usp=sharing"
+
+def _execute(request, cost=1):
+    """Send an API request through the shared Drive limiter, which paces it and retries throttles."""
+    return rate_limiter.get_drive_limiter().call(request.execute, cost=cost)
+
+def request_stats():
+    """
+    Return the Drive request counters of this process.
+
+    Returns:
+        dict: 'requests', 'throttles' (429 / rate-limit 403 responses), 'retries',
+              'failures' (requests given up after retrying) and 'concurrency'
+              (current limit on requests in flight).
+    """
+    limiter = rate_limiter.get_drive_limiter()
+    with limiter.condition:
+        return dict(limiter.stats)
+
+def _load_credentials():
+    """
+    Load the OAuth credentials from TOKEN_FILE, refreshing them or running the
+    consent flow when needed, and save them back.
+
+    Returns:
+        google.oauth2.credentials.Credentials: Valid credentials.
+    """
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    creds = None
+    if os.path.exists(TOKEN_FILE):
+        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+            creds = flow.run_local_server(port=0)
+        with open(TOKEN_FILE, "w") as token:
+            token.write(creds.to_json())
+    return creds
+
+def _schedule_refresh(creds, delay=None):
+    """
+    Refresh the access token in a daemon thread TOKEN_REFRESH_MARGIN seconds
+    before it expires, and again before each new token expires.
+
+    Upload threads then never stop to refresh an expired token themselves
+    (and never race each other doing it).
+
+    Args:
+        creds: OAuth credentials shared by every Drive client.
+        delay (float): Seconds until the refresh (default: computed from the expiry).
+    """
+    global _refresh_timer
+    if not creds.refresh_token or not creds.expiry:
+        return
+    if delay is None:
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)  # expiry is naive UTC
+        delay = max(0.0, (creds.expiry - now).total_seconds() - TOKEN_REFRESH_MARGIN)
+
+    def refresh():
+        from google.auth.transport.requests import Request
+        try:
+            creds.refresh(Request())
+            with open(TOKEN_FILE, "w") as token:
+                token.write(creds.to_json())
+            logger.info(f"Refreshed Google Drive access token (expires {creds.expiry})")
+            _schedule_refresh(creds)
+        except Exception as e:
+            logger.warning(f"Background token refresh failed: {str(e)}")
+            _schedule_refresh(creds, TOKEN_REFRESH_RETRY)
+
+    _refresh_timer = threading.Timer(delay, refresh)
+    _refresh_timer.daemon = True
+    _refresh_timer.start()
+
+def _drive_discovery():
+    """
+    Return the Drive v3 discovery document bundled with google-api-python-client,
+    parsed once per process, or None if this version doesn't ship it.
+    """
+    global _discovery_document
+    if _discovery_document is None:
+        from googleapiclient.discovery_cache import get_static_doc
+        document = get_static_doc("drive", "v3")
+        _discovery_document = json.loads(document) if document else None
+    return _discovery_document
+
+def set_bandwidth_limit(bytes_per_second):
+    """
+    Cap the upload bandwidth of all upload threads together; takes effect for
+    uploads already running.
+
+    Args:
+        bytes_per_second (int): The cap, or 0 / None for no cap.
+    """
+    rate_limiter.get_bandwidth_limiter().set_rate(bytes_per_second)
+
+def drive_client_factory():
+    """
+    Authenticate with Google Drive API using OAuth 2.0 and return a client factory.
+
+    Every call of the factory builds a new Drive service with its own HTTP
+    transport. httplib2 connections are not thread-safe, so each upload worker
+    needs its own service; the credentials are shared.
+
+    The factory is created once per process: token.json is read (and the token
+    refreshed) only on the first call, after which the token is kept fresh in
+    the background. Services are built from the discovery document bundled
+    with the client library, without fetching it. The Google libraries are
+    imported here rather than at module import, so a run that never uploads
+    doesn't load them.
+
+    Returns:
+        callable: Function returning a new authenticated Drive API service, or None if failed.
+    """
+    global _client_factory
+    with _client_factory_lock:
+        if _client_factory is not None:
+            return _client_factory
+        try:
+            import google_auth_httplib2
+            from googleapiclient.discovery import build, build_from_document
+            from googleapiclient.http import build_http
+
+            creds = _load_credentials()
+            _schedule_refresh(creds)
+
+            def new_client():
+                # build_http keeps httplib2 from following the 308s of resumable uploads
+                http = google_auth_httplib2.AuthorizedHttp(creds, http=build_http())
+                discovery = _drive_discovery()
+                if discovery is None:
+                    return build("drive", "v3", http=http)
+                return build_from_document(discovery, http=http)
+
+            logger.info("Authenticated with Google Drive API")
+            print("Authenticated with Google Drive API")
+            _client_factory = new_client
+            return new_client
+
+        except Exception as e:
+            logger.error(f"Authentication error: {str(e)}")
+            print(f"Authentication error: {str(e)}")
+            return None
 
 def authenticate_drive():
     """
@@ -23,52 +193,49 @@ def authenticate_drive():
     Returns:
         googleapiclient.discovery.Resource: Authenticated Drive API service, or None if failed.
     """
+    client_factory = drive_client_factory()
+    if not client_factory:
+        return None
     try:
-        from google.auth.transport.requests import Request
-        from google.oauth2.credentials import Credentials
-
-        creds = None
-        if os.path.exists(TOKEN_FILE):
-            creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-        
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-                creds = flow.run_local_server(port=0)
-            with open(TOKEN_FILE, "w") as token:
-                token.write(creds.to_json())
-        
-        service = build("drive", "v3", credentials=creds)
-        logger.info("Authenticated with Google Drive API")
-        print("Authenticated with Google Drive API")
-        return service
-    
+        return client_factory()
     except Exception as e:
-        logger.error(f"Authentication error: {str(e)}")
-        print(f"Authentication error: {str(e)}")
+        logger.error(f"Error building Google Drive client: {str(e)}")
+        print(f"Error building Google Drive client: {str(e)}")
         return None
 
-def create_drive_folder(service, folder_name):
+def create_drive_folder(service, folder_name, parent_id=None):
     """
     Create a folder in Google Drive if it doesn't exist.
+
+    Folder IDs are cached in drive_index.db, so a folder found or created once
+    costs no API call on later runs.
     
     Args:
         service: Authenticated Drive API service.
         folder_name (str): Name of the folder (e.g., 'Photos_2025').
+        parent_id (str): Folder to create it in; None looks for the name anywhere
+            in Drive and creates it at the top level.
     
     Returns:
         str: Google Drive folder ID, or None if failed.
     """
+    folder_id = drive_index.cached_folder(parent_id, folder_name)
+    if folder_id:
+        logger.debug(f"Using cached Google Drive folder: {folder_name} (ID: {folder_id})")
+        return folder_id
+
     try:
         # Check if folder exists
-        query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-        results = service.files().list(q=query, spaces="drive", fields="files(id, name)").execute()
+        escaped_name = folder_name.replace("\\", "\\\\").replace("'", "\\'")
+        query = f"name='{escaped_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
+        if parent_id:
+            query += f" and '{parent_id}' in parents"
+        results = _execute(service.files().list(q=query, spaces="drive", fields="files(id, name)"))
         folders = results.get("files", [])
 
         if folders:
             folder_id = folders[0]["id"]
+            drive_index.record_folder(parent_id, folder_name, folder_id)
             logger.info(f"Found existing Google Drive folder: {folder_name} (ID: {folder_id})")
             print(f"Found existing Google Drive folder: {folder_name}")
             return folder_id
@@ -78,8 +245,11 @@ def create_drive_folder(service, folder_name):
             "name": folder_name,
             "mimeType": "application/vnd.google-apps.folder"
         }
-        folder = service.files().create(body=file_metadata, fields="id").execute()
+        if parent_id:
+            file_metadata["parents"] = [parent_id]
+        folder = _execute(service.files().create(body=file_metadata, fields="id"))
         folder_id = folder.get("id")
+        drive_index.record_folder(parent_id, folder_name, folder_id)
         logger.info(f"Created Google Drive folder: {folder_name} (ID: {folder_id})")
         print(f"Created Google Drive folder: {folder_name}")
         return folder_id
@@ -89,6 +259,506 @@ def create_drive_folder(service, folder_name):
         print(f"Error creating folder {folder_name}: {str(e)}")
         return None
 
+def _is_not_found(error):
+    """True for a Drive API 404, e.g. uploading into a folder that was deleted."""
+    return getattr(getattr(error, "resp", None), "status", None) == 404
+
+class DriveFolders:
+    """
+    Drive folders for an upload: a root folder named after the source folder and,
+    with MIRROR_FOLDERS, one subfolder per subdirectory of the backup folder
+    (previews always get their PREVIEW_FOLDER subfolder, see storage.relative_dir).
+
+    Folder IDs come from the drive_index cache first and are only checked
+    lazily: an upload failing with 404 drops the stale ID (invalidate) and the
+    folder is looked up or created again. Each folder is resolved once, even
+    when several upload threads need it at the same time.
+    """
+
+    def __init__(self, root_name, base_folder=None, mirror=None):
+        self.root_name = root_name
+        self.base_folder = base_folder
+        self.mirror = MIRROR_FOLDERS if mirror is None else mirror
+        self.lock = threading.Lock()
+        self.ids = {}  # Relative directory ("" for the root) -> folder ID
+        self.key_locks = {}
+
+    def rel_dir(self, file_path):
+        """Subdirectory of base_folder holding file_path, with "/" separators ("" for the root)."""
+        return storage.relative_dir(file_path, self.base_folder, self.mirror)
+
+    def resolve(self, service, rel_dir=""):
+        """
+        Return the folder ID for a relative directory, creating missing folders (parents first).
+
+        Returns:
+            str: Google Drive folder ID, or None if a folder could not be created.
+        """
+        with self.lock:
+            if rel_dir in self.ids:
+                return self.ids[rel_dir]
+            key_lock = self.key_locks.setdefault(rel_dir, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                if rel_dir in self.ids:
+                    return self.ids[rel_dir]
+            if rel_dir:
+                parent_id = self.resolve(service, rel_dir.rpartition("/")[0])
+                if not parent_id:
+                    return None
+                folder_id = create_drive_folder(service, rel_dir.rpartition("/")[2], parent_id)
+            else:
+                folder_id = create_drive_folder(service, self.root_name)
+            if folder_id:
+                with self.lock:
+                    self.ids[rel_dir] = folder_id
+            return folder_id
+
+    def resolve_all(self, client_factory, rel_dirs, workers=None):
+        """
+        Resolve many directories up front, one depth level at a time, in parallel.
+
+        Args:
+            client_factory (callable): Returns a new authenticated Drive API service.
+            rel_dirs (iterable): Relative directories (see rel_dir).
+            workers (int): Number of threads (default: UPLOAD_WORKERS).
+        """
+        levels = {}
+        for rel_dir in set(rel_dirs):
+            levels.setdefault(rel_dir.count("/") + 1 if rel_dir else 0, set()).add(rel_dir)
+        local = threading.local()
+
+        def resolve_one(rel_dir):
+            if getattr(local, "service", None) is None:
+                local.service = client_factory()
+            return self.resolve(local.service, rel_dir)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers or UPLOAD_WORKERS)) as executor:
+            for depth in sorted(levels):
+                list(executor.map(resolve_one, sorted(levels[depth])))
+
+    def invalidate(self, rel_dir):
+        """Forget a folder ID that turned out to be stale, and the IDs below it."""
+        with self.lock:
+            folder_id = self.ids.get(rel_dir)
+            for known in list(self.ids):
+                if not rel_dir or known == rel_dir or known.startswith(rel_dir + "/"):
+                    del self.ids[known]
+        if folder_id:
+            drive_index.forget_folder(folder_id)
+
+def sync_remote_index(service, folder_id):
+    """
+    List the target folder into the local Drive index before uploading into it.
+
+    Args:
+        service: Authenticated Drive API service.
+        folder_id (str): Google Drive folder ID.
+
+    Returns:
+        bool: True if DriveBackend.find_existing can use the index for this folder, False otherwise.
+    """
+    if not REMOTE_DEDUP:
+        return False
+    count = drive_index.sync_folder(service, folder_id)
+    if count is None:
+        logger.warning("Could not list the Google Drive folder; uploading without remote duplicate check")
+        return False
+    return True
+
+def _query_upload_session(http, session_uri, size):
+    """
+    Ask Drive how much of an interrupted resumable upload it received.
+
+    Returns:
+        tuple: (offset, file)
+            - Bytes received so far, or None if the session expired
+            - The file resource if the upload had in fact completed, else None
+    """
+    resp, content = rate_limiter.get_drive_limiter().call(
+        http.request, session_uri, "PUT", headers={"Content-Range": f"bytes */{size}", "Content-Length": "0"}
+    )
+    if resp.status in (200, 201):
+        return size, json.loads(content)
+    if resp.status == 308:
+        received = resp.get("range")  # e.g. "bytes=0-8388607"; missing if nothing arrived
+        return (int(received.rsplit("-", 1)[1]) + 1 if received else 0), None
+    return None, None
+
+def _resumable_upload(service, file_path, folder_id, file_metadata, stat):
+    """
+    Upload a file in UPLOAD_CHUNK_SIZE chunks, resuming an earlier session if one was saved.
+
+    The session URI and the offset Drive acknowledged are saved after every
+    chunk, so after a crash or network loss the next run continues from there.
+    A chunk failing with a throttle or server error is retried by the Drive
+    limiter; the client then asks Drive where to continue before resending.
+
+    Returns:
+        dict: File resource (id, md5Checksum, size).
+
+    Raises:
+        Exception: Any API or network error; the session is kept for the next attempt.
+    """
+    from googleapiclient.http import MediaFileUpload
+
+    file_name = file_metadata["name"]
+    media = MediaFileUpload(file_path, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+    request = service.files().create(body=file_metadata, media_body=media, fields="id, md5Checksum, size")
+
+    session = drive_index.load_session(file_path, folder_id, stat.st_size, stat.st_mtime_ns)
+    if session:
+        session_uri = session[0]
+        offset, file = _query_upload_session(request.http, session_uri, stat.st_size)
+        if file:
+            drive_index.clear_session(file_path)
+            return file
+        if offset is None:
+            logger.info(f"Upload session of {file_name} expired, starting over")
+            drive_index.clear_session(file_path)
+        else:
+            request.resumable_uri = session_uri
+            request.resumable_progress = offset
+            logger.info(f"Resuming upload of {file_name} at byte {offset} of {stat.st_size}")
+            print(f"Resuming upload of {file_name} ({offset * 100 // max(1, stat.st_size)}% already uploaded)")
+
+    limiter = rate_limiter.get_drive_limiter()
+    bandwidth = rate_limiter.get_bandwidth_limiter()
+    file = None
+    try:
+        while file is None:
+            bandwidth.consume(min(UPLOAD_CHUNK_SIZE, stat.st_size - request.resumable_progress))
+            _, file = limiter.call(request.next_chunk)
+            if file is None:
+                drive_index.save_session(file_path, folder_id, stat.st_size, stat.st_mtime_ns,
+                                         request.resumable_uri, request.resumable_progress)
+    except Exception:
+        if request.resumable_uri:
+            drive_index.save_session(file_path, folder_id, stat.st_size, stat.st_mtime_ns,
+                                     request.resumable_uri, request.resumable_progress)
+        raise
+    drive_index.clear_session(file_path)
+    return file
+
+def _upload_media(service, file_path, folder_id):
+    """
+    Upload a file into a Drive folder without sharing it.
+
+    Files over RESUMABLE_UPLOAD_MIN_SIZE are sent in resumable chunks; an
+    interrupted upload continues where it stopped the next time it is uploaded.
+    Every request or chunk is charged to the shared bandwidth cap first.
+
+    Returns:
+        str: Google Drive file ID.
+
+    Raises:
+        Exception: Any API, network or file error.
+    """
+    from googleapiclient.http import MediaFileUpload
+
+    file_name = os.path.basename(file_path)
+    file_metadata = {
+        "name": file_name,
+        "parents": [folder_id]
+    }
+    stat = os.stat(file_path)
+    if stat.st_size > RESUMABLE_UPLOAD_MIN_SIZE:
+        file = _resumable_upload(service, file_path, folder_id, file_metadata, stat)
+    else:
+        media = MediaFileUpload(file_path)
+        rate_limiter.get_bandwidth_limiter().consume(stat.st_size)
+        file = _execute(service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields="id, md5Checksum, size"
+        ))
+    file_id = file.get("id")
+    drive_index.record_file(folder_id, file_id, file_name, file.get("md5Checksum"),
+                            int(file["size"]) if file.get("size") is not None else None)
+    logger.info(f"Uploaded {file_name} to Google Drive (ID: {file_id})")
+    return file_id
+
+def _upload_stream(service, name, stream, size, folder_id):
+    """
+    Upload size bytes from a seekable stream (e.g. a packer.ArchiveStream) as a new Drive file.
+
+    Large streams go up in UPLOAD_CHUNK_SIZE chunks of a resumable upload, each
+    paced by the Drive limiter and charged to the bandwidth cap; unlike files,
+    the session is not kept across runs.
+
+    Returns:
+        str: Google Drive file ID.
+
+    Raises:
+        Exception: Any API, network or file error.
+    """
+    from googleapiclient.http import MediaIoBaseUpload
+
+    resumable = size > RESUMABLE_UPLOAD_MIN_SIZE
+    media = MediaIoBaseUpload(stream, mimetype="application/x-tar", chunksize=UPLOAD_CHUNK_SIZE, resumable=resumable)
+    request = service.files().create(body={"name": name, "parents": [folder_id]}, media_body=media,
+                                     fields="id, md5Checksum, size")
+    bandwidth = rate_limiter.get_bandwidth_limiter()
+    if resumable:
+        limiter = rate_limiter.get_drive_limiter()
+        file = None
+        while file is None:
+            bandwidth.consume(min(UPLOAD_CHUNK_SIZE, size - request.resumable_progress))
+            _, file = limiter.call(request.next_chunk)
+    else:
+        bandwidth.consume(size)
+        file = _execute(request)
+    file_id = file.get("id")
+    drive_index.record_file(folder_id, file_id, name, file.get("md5Checksum"),
+                            int(file["size"]) if file.get("size") is not None else None)
+    logger.info(f"Uploaded {name} to Google Drive (ID: {file_id})")
+    return file_id
+
+def share_files(service, file_ids):
+    """
+    Make files readable by anyone with the link, with batched permission calls.
+
+    Up to SHARE_BATCH_SIZE permission calls travel in one HTTP request (Drive
+    batch API), which costs as many tokens of the Drive limiter as it holds calls.
+    Calls that fail inside a batch (e.g. throttled) are retried on their own
+    through the limiter.
+
+    Args:
+        service: Authenticated Drive API service.
+        file_ids (list): Google Drive file IDs.
+
+    Returns:
+        set: IDs of the files that could not be shared.
+    """
+    failed = set()
+
+    def on_response(file_id, response, exception):
+        if exception is not None:
+            logger.warning(f"Error sharing file {file_id} in batch: {str(exception)}")
+            if rate_limiter.classify_error(exception)[1]:
+                rate_limiter.get_drive_limiter().throttled()
+            failed.add(file_id)
+
+    for start in range(0, len(file_ids), SHARE_BATCH_SIZE):
+        chunk = file_ids[start:start + SHARE_BATCH_SIZE]
+        batch = service.new_batch_http_request(callback=on_response)
+        for file_id in chunk:
+            batch.add(service.permissions().create(fileId=file_id, body=ANYONE_READER, fields="id"),
+                      request_id=file_id)
+        try:
+            _execute(batch, cost=len(chunk))
+        except Exception as e:
+            logger.error(f"Error sharing a batch of {len(chunk)} files: {str(e)}")
+            failed.update(chunk)
+
+    for file_id in sorted(failed):
+        try:
+            _execute(service.permissions().create(fileId=file_id, body=ANYONE_READER, fields="id"))
+            failed.discard(file_id)
+        except Exception as e:
+            logger.error(f"Error sharing file {file_id}: {str(e)}")
+    logger.info(f"Shared {len(file_ids) - len(failed)} of {len(file_ids)} files")
+    return failed
+
+def share_folder(service, folder_id):
+    """
+    Make a folder (and so every file in it) readable by anyone with the link.
+
+    Args:
+        service: Authenticated Drive API service.
+        folder_id (str): Google Drive folder ID.
+
+    Returns:
+        bool: True if the folder is shared, False otherwise.
+    """
+    try:
+        _execute(service.permissions().create(fileId=folder_id, body=ANYONE_READER, fields="id"))
+        logger.info(f"Shared Google Drive folder {folder_id}")
+        return True
+    except Exception as e:
+        logger.error(f"Error sharing folder {folder_id}: {str(e)}")
+        print(f"Error sharing folder {folder_id}: {str(e)}")
+        return False
+
+def needs_file_sharing(service, folder_id):
+    """
+    Prepare link sharing for an upload into folder_id according to SHARE_MODE.
+
+    Returns:
+        bool: True if each uploaded file must be shared, False if sharing the
+              folder already covers them.
+    """
+    if SHARE_MODE == "folder" and share_folder(service, folder_id):
+        return False
+    return True
+
+def upload_file(service, file_path, folder_id):
+    """
+    Upload a single file to a Google Drive folder and make it shareable.
+    
+    Args:
+        service: Authenticated Drive API service.
+        file_path (str): Path of the file to upload.
+        folder_id (str): Google Drive folder ID to upload into.
+    
+    Returns:
+        tuple: (file_name, shareable_link), or None if failed.
+    """
+    file_name = os.path.basename(file_path)
+    try:
+        file_id = _upload_media(service, file_path, folder_id)
+
+        # Generate shareable link
+        _execute(service.permissions().create(
+            fileId=file_id,
+            body=ANYONE_READER
+        ))
+        link = share_link(file_id)
+        
+        logger.info(f"Shared {file_name} (Link: {link})")
+        print(f"Uploaded {file_name} to Google Drive: {link}")
+        return file_name, link
+
+    except Exception as e:
+        logger.error(f"Error uploading {file_name}: {str(e)}")
+        print(f"Error uploading {file_name}: {str(e)}")
+        return None
+
+class DriveBackend(storage.StorageBackend):
+    """
+    Google Drive as a storage backend (see storage.upload_files).
+
+    Each upload thread builds its own Drive service with client_factory on
+    first use and keeps it for its later uploads. An upload failing with 404
+    because a cached folder was deleted resolves the folder again and is
+    retried once.
+    """
+    name = "Google Drive"
+
+    def __init__(self, folder, client_factory, remote_dedup=False, share=True):
+        """
+        Args:
+            folder (str or DriveFolders): Google Drive folder ID to upload into, or
+                the DriveFolders placing each file in the folder of its subdirectory.
+            client_factory (callable): Returns a new authenticated Drive API service
+                (see drive_client_factory).
+            remote_dedup (bool): Reuse files already in the folder (see drive_index.find_remote_copy);
+                folders other than the one indexed by sync_remote_index are listed on first use.
+            share (bool): Share each uploaded file; False if the folder is shared
+                (see needs_file_sharing).
+        """
+        self.folder = folder
+        self.folders = folder if isinstance(folder, DriveFolders) else None
+        self.client_factory = client_factory
+        self.remote_dedup = remote_dedup
+        self.needs_sharing = share
+        self.local = threading.local()
+        self.listed = set() if self.folders is None else {self.folders.ids.get("")}
+        self.listed_lock = threading.Lock()
+        self.share_service = None
+
+    def service(self):
+        """Drive service of the calling thread."""
+        service = getattr(self.local, "service", None)
+        if service is None:
+            service = self.local.service = self.client_factory()
+        return service
+
+    def folder_key(self, file_path):
+        return self.folders.rel_dir(file_path) if self.folders else ""
+
+    def resolve_folder(self, rel_dir=""):
+        if not self.folders:
+            return self.folder
+        service = self.service()
+        folder_id = self.folders.resolve(service, rel_dir)
+        if folder_id and self.remote_dedup:
+            with self.listed_lock:
+                new_folder = folder_id not in self.listed
+                self.listed.add(folder_id)
+            if new_folder:
+                sync_remote_index(service, folder_id)
+        return folder_id
+
+    def find_existing(self, folder_id, file_path):
+        return drive_index.find_remote_copy(folder_id, file_path) if self.remote_dedup else None
+
+    def upload(self, file_path, folder_id):
+        service = self.service()
+        try:
+            return _upload_media(service, file_path, folder_id)
+        except Exception as e:
+            if not (self.folders and _is_not_found(e)):
+                raise
+            # The cached folder is gone: find or create it again and retry once
+            rel_dir = self.folder_key(file_path)
+            logger.warning(f"Google Drive folder {folder_id} not found, resolving '{rel_dir}' again")
+            self.folders.invalidate(rel_dir)
+            folder_id = self.resolve_folder(rel_dir)
+            if not folder_id:
+                raise RuntimeError(f"Could not create Google Drive folder for '{rel_dir}'")
+            return _upload_media(service, file_path, folder_id)
+
+    def upload_stream(self, name, stream, size, folder_id):
+        return _upload_stream(self.service(), name, stream, size, folder_id)
+
+    def share(self, file_ids):
+        self.share_service = self.share_service or self.client_factory()
+        return share_files(self.share_service, file_ids)
+
+    def link(self, file_id):
+        return share_link(file_id)
+
+def open_drive_backend(folder_name, base_folder=None, client_factory=None):
+    """
+    Authenticate, create (or find) the Drive folder and return a DriveBackend uploading into it.
+
+    The folder is listed for remote duplicates (sync_remote_index) and shared
+    according to SHARE_MODE (needs_file_sharing).
+
+    Args:
+        folder_name (str): Name of the Drive folder.
+        base_folder (str): Backup folder mirrored below it (see DriveFolders).
+        client_factory (callable): Drive client factory (default: drive_client_factory()).
+
+    Returns:
+        DriveBackend: The backend, or None if authentication or the folder failed.
+    """
+    client_factory = client_factory or drive_client_factory()
+    if not client_factory:
+        return None
+    service = client_factory()
+    folders = DriveFolders(folder_name, base_folder)
+    folder_id = folders.resolve(service)
+    if not folder_id:
+        return None
+    remote_dedup = sync_remote_index(service, folder_id)
+    share = needs_file_sharing(service, folder_id)
+    return DriveBackend(folders, client_factory, remote_dedup, share)
+
+def upload_files(file_paths, folder, client_factory, workers=None, remote_dedup=False, share=True):
+    """
+    Upload files concurrently to Google Drive, yielding each result as soon as it is ready.
+
+    Runs storage.upload_files with a DriveBackend: one Drive service per
+    worker thread, files consumed lazily, and uploaded files shared in batches
+    of SHARE_BATCH_SIZE (see share_files) before their result is yielded.
+
+    Args:
+        file_paths (iterable): Paths of the files to upload.
+        folder, client_factory, remote_dedup, share: See DriveBackend.
+        workers (int): Number of upload threads (default: UPLOAD_WORKERS).
+
+    Yields:
+        tuple: (file_path, result, reused)
+            - file_path: The file
+            - result: (file_name, shareable_link), or None if the upload failed
+            - reused: True if the file was already on Google Drive
+    """
+    backend = DriveBackend(folder, client_factory, remote_dedup, share)
+    return storage.upload_files(file_paths, backend, workers, SHARE_BATCH_SIZE)
+
 def upload_to_drive(unique_files, source_folder):
     """
     Upload unique files to Google Drive and generate shareable links.
@@ -107,7 +777,8 @@ def upload_to_drive(unique_files, source_folder):
 
     try:
         # Authenticate
-        service = authenticate_drive()
+        client_factory = drive_client_factory()
+        service = client_factory() if client_factory else None
         if not service:
             messagebox.showerror("Error", "Failed to authenticate with Google Drive. Check credentials.json and try again.")
             root.destroy()
@@ -115,54 +786,44 @@ def upload_to_drive(unique_files, source_folder):
 
         # Extract folder name from source_folder
         folder_name = os.path.basename(os.path.normpath(source_folder))
-        folder_id = create_drive_folder(service, folder_name)
+        folders = DriveFolders(folder_name, os.path.join(DESTINATION_PATH, BACKUP_SUBFOLDER))
+        folder_id = folders.resolve(service)
         if not folder_id:
             messagebox.showerror("Error", f"Failed to create Google Drive folder '{folder_name}'.")
             root.destroy()
             return False, []
 
-        uploaded_files = []
+        remote_dedup = sync_remote_index(service, folder_id)
+        share = needs_file_sharing(service, folder_id)
+
         upload_count = 0
+        existing_count = 0
         total_files = len(unique_files)
 
+        local_files = []
         for file_path in unique_files:
             if not os.path.exists(file_path):
                 logger.warning(f"File not found: {file_path}")
                 print(f"File not found: {file_path}")
                 continue
+            local_files.append(file_path)
+        if folders.mirror:
+            folders.resolve_all(client_factory, {folders.rel_dir(file_path) for file_path in local_files})
+
+        results = {}
+        # Upload in the order of the scheduling policy (e.g. small files first, so links are ready early)
+        for file_path, result, reused in upload_files(scheduling.order_files(local_files), folders, client_factory,
+                                                      remote_dedup=remote_dedup, share=share):
+            if result:
+                results[file_path] = result
+                if reused:
+                    existing_count += 1
+                else:
+                    upload_count += 1
+        # Report links in the order the files were given, not the order uploads finished
+        uploaded_files = [results[file_path] for file_path in local_files if file_path in results]
 
-            file_name = os.path.basename(file_path)
-            try:
-                # Upload file
-                file_metadata = {
-                    "name": file_name,
-                    "parents": [folder_id]
-                }
-                media = MediaFileUpload(file_path)
-                file = service.files().create(
-                    body=file_metadata,
-                    media_body=media,
-                    fields="id"
-                ).execute()
-                file_id = file.get("id")
-
-                # Generate shareable link
-                service.permissions().create(
-                    fileId=file_id,
-                    body={"role": "reader", "type": "anyone"}
-                ).execute()
-                link = f"https://drive.google.com/file/d/{file_id}/view?usp=sharing"
-                
-                uploaded_files.append((file_name, link))
-                upload_count += 1
-                logger.info(f"Uploaded {file_name} to Google Drive (ID: {file_id}, Link: {link})")
-                print(f"Uploaded {file_name} to Google Drive: {link}")
-
-            except Exception as e:
-                logger.error(f"Error uploading {file_name}: {str(e)}")
-                print(f"Error uploading {file_name}: {str(e)}")
-
-        if upload_count == 0 and total_files > 0:
+        if upload_count + existing_count == 0 and total_files > 0:
             logger.error("No files were uploaded")
             print("No files were uploaded")
             messagebox.showerror("Error", "Failed to upload any files. Check files and try again.")
@@ -174,8 +835,12 @@ def upload_to_drive(unique_files, source_folder):
             f"Upload completed:\n"
             f"- Total files processed: {total_files}\n"
             f"- Files uploaded: {upload_count}\n"
-            f"- Files skipped: {total_files - upload_count}"
+            f"- Already on Google Drive: {existing_count}\n"
+            f"- Files skipped: {total_files - upload_count - existing_count}"
         )
+        stats = request_stats()
+        if stats["throttles"] or stats["retries"]:
+            message += f"\n- Drive requests throttled / retried: {stats['throttles']} / {stats['retries']}"
         if uploaded_files:
             message += f"\n- Sample file links:\n"
             for file_name, link in uploaded_files[:3]:  # Show up to 3 links
@@ -14,9 +14,73 @@ EMAIL_CREDENTIALS_FILE = "email_credentials.json"
 # Default configurations
 DESTINATION_PATH = "C:/Media_Backup/"
 SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".cr2", ".nef", ".mp4", ".mov"}
+VIDEO_EXTENSIONS = {".mp4", ".mov"}  # Supported extensions that are videos
+RAW_EXTENSIONS = {".cr2", ".nef"}  # Supported extensions that are camera RAW files
 BACKUP_SUBFOLDER = "Photos_2025"  # Example subfolder, can be overridden
 LOG_FILE = "media_uploader.log"
 
+# Copy engine settings
+COPY_WORKERS = 4  # Concurrent copy threads; 1 copies sequentially
+COPY_BACKEND = "auto"  # "auto" (kernel when available), "kernel" or "copy2"
+COPY_CHUNK_SIZE = 64 * 1024 * 1024  # Bytes handed to the kernel per transfer call
+COPY_HASH_BUFFER_SIZE = 4 * 1024 * 1024  # Read buffer per worker when copying and hashing together
+INCREMENTAL_IMPORT = True  # Skip files already imported from the same source and unchanged since
+MANIFEST_BATCH_SIZE = 100  # Finished copies recorded per manifest write (resume granularity)
+MIRROR_FOLDERS = False  # Keep the card's subfolders in the backup and on Google Drive instead of flattening
+
+# Hashing engine settings
+HASH_WORKERS = 4  # Files hashed concurrently (hashlib releases the GIL)
+HASH_BUFFER_SIZE = 1024 * 1024  # Bytes read per call; larger means fewer syscalls
+HASH_USE_MMAP = False  # Hash memory-mapped files instead of reading into a buffer
+HASH_CACHE_ENABLED = True  # Reuse hashes of files unchanged since they were last hashed
+
+# Pipeline settings
+PIPELINE_QUEUE_SIZE = 8  # Files buffered between copy, dedup and upload stages
+
+# Upload settings
+UPLOAD_WORKERS = 4  # Concurrent Drive uploads, each with its own HTTP client; 1 uploads sequentially
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes per resumable upload request (a multiple of 256 KB)
+RESUMABLE_UPLOAD_MIN_SIZE = 8 * 1024 * 1024  # Larger files upload in resumable chunks, smaller in one request
+SHARE_MODE = "files"  # "files": share each uploaded file; "folder": share the Drive folder once
+SHARE_BATCH_SIZE = 100  # Permission calls per batch request (Drive allows up to 100)
+REMOTE_DEDUP = True  # Reuse files whose content (size + MD5) is already in the target Drive folder
+UPLOAD_IN_BACKGROUND = False  # Only queue uploads; a background worker uploads them after the copy finishes
+UPLOAD_MAX_ATTEMPTS = 5  # Attempts per queued file before it is marked failed
+UPLOAD_RETRY_DELAY = 60  # Seconds before a failed upload is tried again, doubled per attempt
+UPLOAD_SCHEDULING_POLICY = "sjf_aging"  # Upload order: "fifo", "small_first", "sjf_aging" or "photos_first"
+UPLOAD_AGING_BYTES_PER_SECOND = 10 * 1024 * 1024  # sjf_aging: a waiting file counts this much smaller per second
+UPLOAD_MAX_BYTES_PER_SECOND = 0  # Upload bandwidth cap shared by all upload threads; 0 is unlimited
+PACK_SMALL_FILES = False  # Upload small files bundled in .tar archives, one upload per archive instead of per file
+PACK_MAX_FILE_SIZE = 32 * 1024 * 1024  # Larger files, and all videos, are uploaded on their own
+PACK_TARGET_SIZE = 256 * 1024 * 1024  # An archive is closed and uploaded once its files add up to this
+
+# Preview settings
+PREVIEWS_ENABLED = True  # Make web-sized JPEG previews of photos, upload them first and email their links
+PREVIEW_FOLDER = "previews"  # Subfolder of the backup and of the upload folder holding the previews
+PREVIEW_SIZE = 2048  # Longest edge of a preview, in pixels
+THUMBNAIL_SIZE = 320  # Longest edge of a thumbnail (kept with the backup, not uploaded); 0 makes none
+PREVIEW_QUALITY = 85  # JPEG quality of previews and thumbnails
+PREVIEW_WORKERS = None  # Processes making previews; None starts one per CPU core
+
+# Storage backend settings
+STORAGE_BACKEND = "drive"  # "drive" (Google Drive), "local" (a folder, e.g. a NAS share), "s3" (S3-compatible)
+                           # or "fake_drive" (a local stand-in for Drive, for offline benchmarks)
+LOCAL_STORAGE_PATH = "C:/Media_Upload/"  # Folder the "local" backend uploads into
+S3_BUCKET = "media-uploader"  # Bucket the "s3" backend uploads into (created if missing)
+S3_ENDPOINT_URL = None  # e.g. "http://127.0.0.1:9000" for a local MinIO; None for AWS
+S3_REGION = "us-east-1"
+S3_LINK_EXPIRY = 7 * 24 * 3600  # Seconds presigned S3 links stay valid (7 days is the most S3 allows)
+S3_MULTIPART_THRESHOLD = 64 * 1024 * 1024  # Larger files upload to S3 in parallel parts
+FAKE_DRIVE_LATENCY = 0.1  # Seconds each request to the "fake_drive" backend takes, like a round trip to Drive
+
+# Drive request limits, shared by every upload thread
+DRIVE_REQUESTS_PER_SECOND = 10  # Sustained API calls per second (token bucket refill rate)
+DRIVE_BURST = 20  # API calls allowed in a burst above the sustained rate
+DRIVE_MAX_CONCURRENCY = 8  # Most requests in flight; halved on each throttle, regrown one at a time
+DRIVE_MAX_RETRIES = 6  # Retries of a throttled (429, 403 rate limit) or failed (5xx, network) request
+DRIVE_BACKOFF_BASE = 1.0  # Seconds before the first retry, doubled per retry (with random jitter)
+DRIVE_BACKOFF_MAX = 64.0  # Longest wait between retries, unless Retry-After asks for more
+
 def is_valid_email(email):
     """
     Validate email address format.
@@ -0,0 +1,274 @@
+import os
+import sqlite3
+import time
+import logging
+import hash_engine
+import rate_limiter
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Database configuration
+DRIVE_INDEX_DB_PATH = "drive_index.db"
+DRIVE_INDEX_MAX_AGE = 300  # Seconds a folder listing is trusted before it is fetched again
+DRIVE_LIST_PAGE_SIZE = 1000  # Largest page files().list allows
+
+def _connect():
+    """Open the index database, creating its tables on first use."""
+    conn = sqlite3.connect(DRIVE_INDEX_DB_PATH, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS remote_files (
+            folder_id TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            name TEXT,
+            md5 TEXT,
+            size INTEGER,
+            PRIMARY KEY (folder_id, file_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_remote_files_size ON remote_files (folder_id, size)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS listed_folders (
+            folder_id TEXT PRIMARY KEY,
+            listed_at REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS drive_folders (
+            parent_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            folder_id TEXT NOT NULL,
+            PRIMARY KEY (parent_id, name)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            file_path TEXT PRIMARY KEY,
+            folder_id TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            session_uri TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+def sync_folder(service, folder_id, max_age=None):
+    """
+    Refresh the local index of a Drive folder's files with a paginated listing.
+
+    Only id, name, md5Checksum and size are requested, up to DRIVE_LIST_PAGE_SIZE
+    files per call, each page paced and retried by the shared Drive limiter.
+    A listing younger than max_age seconds is reused as is.
+
+    Args:
+        service: Authenticated Drive API service.
+        folder_id (str): Google Drive folder ID.
+        max_age (int): Seconds an earlier listing stays valid (default: DRIVE_INDEX_MAX_AGE).
+
+    Returns:
+        int: Number of files indexed for the folder, or None if the listing failed.
+    """
+    max_age = DRIVE_INDEX_MAX_AGE if max_age is None else max_age
+    try:
+        with _connect() as conn:
+            cursor = conn.cursor()
+            row = cursor.execute("SELECT listed_at FROM listed_folders WHERE folder_id = ?", (folder_id,)).fetchone()
+            if row and time.time() - row[0] < max_age:
+                return cursor.execute(
+                    "SELECT COUNT(*) FROM remote_files WHERE folder_id = ?", (folder_id,)
+                ).fetchone()[0]
+
+        started = time.time()
+        files = []
+        page_token = None
+        while True:
+            request = service.files().list(
+                q=f"'{folder_id}' in parents and trashed=false",
+                spaces="drive",
+                fields="nextPageToken, files(id, name, md5Checksum, size)",
+                pageSize=DRIVE_LIST_PAGE_SIZE,
+                pageToken=page_token
+            )
+            response = rate_limiter.get_drive_limiter().call(request.execute)
+            files.extend(response.get("files", []))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+
+        with _connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM remote_files WHERE folder_id = ?", (folder_id,))
+            cursor.executemany(
+                "INSERT OR REPLACE INTO remote_files (folder_id, file_id, name, md5, size) VALUES (?, ?, ?, ?, ?)",
+                [(folder_id, f["id"], f.get("name"), f.get("md5Checksum"),
+                  int(f["size"]) if f.get("size") is not None else None) for f in files]
+            )
+            cursor.execute("INSERT OR REPLACE INTO listed_folders (folder_id, listed_at) VALUES (?, ?)",
+                           (folder_id, started))
+            conn.commit()
+        logger.info(f"Indexed {len(files)} files in Google Drive folder {folder_id}")
+        return len(files)
+    except Exception as e:
+        logger.error(f"Error listing Google Drive folder {folder_id}: {str(e)}")
+        print(f"Error listing Google Drive folder {folder_id}: {str(e)}")
+        return None
+
+def find_remote_copy(folder_id, file_path):
+    """
+    Look for a file with the same content as file_path in an indexed Drive folder.
+
+    The local file is only read (for its MD5) when a remote file has the same size.
+
+    Args:
+        folder_id (str): Google Drive folder ID, indexed by sync_folder.
+        file_path (str): Path of the local file.
+
+    Returns:
+        str: Google Drive file ID of the remote copy, or None if there is none.
+    """
+    try:
+        size = os.path.getsize(file_path)
+        with _connect() as conn:
+            candidates = conn.execute(
+                "SELECT file_id, md5 FROM remote_files WHERE folder_id = ? AND size = ? AND md5 IS NOT NULL",
+                (folder_id, size)
+            ).fetchall()
+        if not candidates:
+            return None
+        md5 = hash_engine.hash_file(file_path, algorithm="md5")
+        for file_id, remote_md5 in candidates:
+            if remote_md5 == md5:
+                return file_id
+        return None
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Error checking {file_path} against Google Drive: {str(e)}")
+        return None
+
+def record_file(folder_id, file_id, name, md5, size):
+    """
+    Add an uploaded file to the index, so it is found without listing the folder again.
+
+    Args:
+        folder_id (str): Google Drive folder ID.
+        file_id (str): Google Drive file ID.
+        name (str): File name on Drive.
+        md5 (str): md5Checksum reported by Drive.
+        size (int): File size in bytes.
+    """
+    try:
+        with _connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO remote_files (folder_id, file_id, name, md5, size) VALUES (?, ?, ?, ?, ?)",
+                (folder_id, file_id, name, md5, size)
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Error recording {name} in the Google Drive index: {str(e)}")
+
+def load_session(file_path, folder_id, size, mtime_ns):
+    """
+    Return the resumable upload session saved for a file, if it is still usable.
+
+    A session saved for another folder, or before the file changed, is dropped.
+
+    Args:
+        file_path (str): Path of the local file.
+        folder_id (str): Google Drive folder ID being uploaded into.
+        size (int): Current file size in bytes.
+        mtime_ns (int): Current modification time in nanoseconds.
+
+    Returns:
+        tuple: (session_uri, offset) with the last acknowledged byte offset, or None.
+    """
+    try:
+        with _connect() as conn:
+            row = conn.execute(
+                "SELECT folder_id, size, mtime_ns, session_uri, offset FROM upload_sessions WHERE file_path = ?",
+                (file_path,)
+            ).fetchone()
+            if not row:
+                return None
+            if row[:3] != (folder_id, size, mtime_ns):
+                conn.execute("DELETE FROM upload_sessions WHERE file_path = ?", (file_path,))
+                conn.commit()
+                return None
+            return row[3], row[4]
+    except sqlite3.Error as e:
+        logger.error(f"Error loading upload session for {file_path}: {str(e)}")
+        return None
+
+def save_session(file_path, folder_id, size, mtime_ns, session_uri, offset):
+    """
+    Persist a resumable upload session and the byte offset the server acknowledged.
+
+    Args:
+        file_path (str): Path of the local file.
+        folder_id (str): Google Drive folder ID being uploaded into.
+        size (int): File size in bytes.
+        mtime_ns (int): Modification time in nanoseconds.
+        session_uri (str): Resumable session URI returned by Drive.
+        offset (int): Bytes acknowledged by Drive so far.
+    """
+    try:
+        with _connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO upload_sessions "
+                "(file_path, folder_id, size, mtime_ns, session_uri, offset, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_path, folder_id, size, mtime_ns, session_uri, offset, time.time())
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Error saving upload session for {file_path}: {str(e)}")
+
+def clear_session(file_path):
+    """Forget the upload session of a file (finished, or no longer resumable)."""
+    try:
+        with _connect() as conn:
+            conn.execute("DELETE FROM upload_sessions WHERE file_path = ?", (file_path,))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Error clearing upload session for {file_path}: {str(e)}")
+
+def cached_folder(parent_id, name):
+    """
+    Return the cached ID of a Drive folder, without any API call.
+
+    Args:
+        parent_id (str): ID of the parent folder, or None for a top-level folder.
+        name (str): Folder name.
+
+    Returns:
+        str: Google Drive folder ID, or None if not cached.
+    """
+    try:
+        with _connect() as conn:
+            row = conn.execute("SELECT folder_id FROM drive_folders WHERE parent_id = ? AND name = ?",
+                               (parent_id or "", name)).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Error reading folder cache for {name}: {str(e)}")
+        return None
+
+def record_folder(parent_id, name, folder_id):
+    """Cache the ID of a Drive folder found or created by name."""
+    try:
+        with _connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO drive_folders (parent_id, name, folder_id) VALUES (?, ?, ?)",
+                         (parent_id or "", name, folder_id))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Error caching folder {name}: {str(e)}")
+
+def forget_folder(folder_id):
+    """Drop a cached folder ID that turned out to be stale (e.g. the folder was deleted), and its children."""
+    try:
+        with _connect() as conn:
+            conn.execute("DELETE FROM drive_folders WHERE folder_id = ? OR parent_id = ?", (folder_id, folder_id))
+            conn.commit()
+        logger.info(f"Dropped stale Google Drive folder {folder_id} from the cache")
+    except sqlite3.Error as e:
+        logger.error(f"Error dropping folder {folder_id} from the cache: {str(e)}")
@@ -1,9 +1,14 @@
 import hashlib
 import sqlite3
 import os
+import threading
 import tkinter as tk
 from tkinter import messagebox
 import logging
+import hash_engine
+import hash_cache
+import perceptual
+import bloom_filter
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log", 
@@ -12,6 +17,93 @@ logger = logging.getLogger(__name__)
 
 # Database configuration
 DB_PATH = "file_hashes.db"
+DB_BUSY_TIMEOUT = 30  # Seconds to wait for another process holding the write lock
+DB_BATCH_SIZE = 500  # New rows written per transaction
+
+# Duplicate detection strategy: "tiered" only reads whole files when the size and
+# signature of a stored file collide; "full" hashes every file
+DEDUP_STRATEGY = "tiered"
+PARTIAL_HASH_BLOCK_SIZE = 64 * 1024  # Bytes hashed from the start and from the end of a file
+
+# Large files (long videos) get a sampled signature instead of the head/tail one,
+# and are not fully hashed up front even with the "full" strategy
+FAST_FINGERPRINT_MIN_SIZE = 1024 * 1024 * 1024
+FAST_FINGERPRINT_CHUNKS = 16  # Evenly spaced chunks, including the first and the last
+FAST_FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+
+# Optional perceptual (look-alike) detection for JPEG/PNG, requires Pillow
+PERCEPTUAL_DEDUP = False  # Treat re-saved copies and burst shots as duplicates
+PERCEPTUAL_MAX_DISTANCE = 6  # Differing bits (of 64) still counted as the same picture
+
+# In-memory Bloom filter answering "certainly not in the database" without a query
+BLOOM_FILTER_ENABLED = True
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+BLOOM_MAX_BYTES = 64 * 1024 * 1024  # Memory cap; the false-positive rate rises if it is hit
+
+_membership_filter = None
+_membership_filter_lock = threading.Lock()
+
+def _sha256_file(file_path):
+    """Return the SHA-256 hex digest of a file; raises OSError if it can't be read."""
+    return hash_engine.hash_file_cached(file_path)[0]
+
+def _cached_hash(file_path):
+    """
+    Return the full SHA-256 of a file if it is known without reading the file
+    (e.g. hashed while it was copied), else None.
+    """
+    if not hash_cache.HASH_CACHE_ENABLED:
+        return None
+    return hash_cache.lookup(file_path)
+
+def _partial_hash_file(file_path, size):
+    """Return the SHA-256 hex digest of a file's size, first block and last block."""
+    sha256 = hashlib.sha256(str(size).encode())
+    with open(file_path, "rb") as f:
+        sha256.update(f.read(PARTIAL_HASH_BLOCK_SIZE))
+        if size > PARTIAL_HASH_BLOCK_SIZE:
+            f.seek(max(PARTIAL_HASH_BLOCK_SIZE, size - PARTIAL_HASH_BLOCK_SIZE))
+            sha256.update(f.read(PARTIAL_HASH_BLOCK_SIZE))
+    return sha256.hexdigest()
+
+def _signature_mode(size):
+    """Name the signature used for files of this size, including its parameters."""
+    if size >= FAST_FINGERPRINT_MIN_SIZE:
+        return f"sampled:{FAST_FINGERPRINT_CHUNKS}x{FAST_FINGERPRINT_CHUNK_SIZE}"
+    return f"headtail:{PARTIAL_HASH_BLOCK_SIZE}"
+
+def _signature_file(file_path, size):
+    """
+    Return (signature, mode) for a file: a sampled fingerprint for large files,
+    the head/tail partial hash otherwise. Signatures are only comparable when
+    their modes are equal.
+    """
+    if size >= FAST_FINGERPRINT_MIN_SIZE:
+        signature = hash_engine.fingerprint_file(file_path, FAST_FINGERPRINT_CHUNKS, FAST_FINGERPRINT_CHUNK_SIZE)
+    else:
+        signature = _partial_hash_file(file_path, size)
+    return signature, _signature_mode(size)
+
+def compute_partial_hash(file_path):
+    """
+    Compute a cheap signature of a file from its size and a few blocks.
+
+    Files up to FAST_FINGERPRINT_MIN_SIZE use their first and last blocks;
+    larger files use FAST_FINGERPRINT_CHUNKS evenly spaced chunks. Files with
+    different signatures can't be identical; files with the same signature
+    still need a full hash to be sure.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        str: Partial SHA-256 signature of the file, or None if error.
+    """
+    try:
+        return _signature_file(file_path, os.path.getsize(file_path))[0]
+    except Exception as e:
+        logger.error(f"Error computing partial hash for {file_path}: {str(e)}")
+        return None
 
 def compute_file_hash(file_path):
     """
@@ -24,11 +116,7 @@ def compute_file_hash(file_path):
         str: SHA-256 hash of the file, or None if error.
     """
     try:
-        sha256 = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256.update(chunk)
-        file_hash = sha256.hexdigest()
+        file_hash = _sha256_file(file_path)
         logger.debug(f"Computed hash for {file_path}: {file_hash}")
         return file_hash
     except Exception as e:
@@ -36,81 +124,728 @@ def compute_file_hash(file_path):
         print(f"Error computing hash for {file_path}: {str(e)}")
         return None
 
+def connect_database():
+    """
+    Open a connection to the hash database, ready for use by several processes.
+
+    WAL journaling lets readers (e.g., hash_exists from copy threads or a second
+    ingest process) work while another connection writes; the busy timeout makes
+    writers wait for each other instead of failing with "database is locked".
+
+    Returns:
+        sqlite3.Connection: Open database connection.
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _migrate_v1(cursor):
+    """Add size/mtime columns (backfilled from files still on disk) and index the hash column."""
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(file_hashes)")}
+    if "size" not in columns:
+        cursor.execute("ALTER TABLE file_hashes ADD COLUMN size INTEGER")
+    if "mtime_ns" not in columns:
+        cursor.execute("ALTER TABLE file_hashes ADD COLUMN mtime_ns INTEGER")
+
+    rows = cursor.execute("SELECT file_path FROM file_hashes WHERE size IS NULL").fetchall()
+    updates = []
+    for (file_path,) in rows:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        updates.append((stat.st_size, stat.st_mtime_ns, file_path))
+    cursor.executemany("UPDATE file_hashes SET size = ?, mtime_ns = ? WHERE file_path = ?", updates)
+    if rows:
+        logger.info(f"Backfilled size/mtime for {len(updates)} of {len(rows)} existing rows")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_file_hashes_hash ON file_hashes (hash)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_file_hashes_size ON file_hashes (size)")
+
+def _migrate_v2(cursor):
+    """Make the full hash optional and add the partial signature used by the tiered prefilter."""
+    # SQLite can't drop NOT NULL from a column, so the table is rebuilt
+    cursor.execute("""
+        CREATE TABLE file_hashes_new (
+            file_path TEXT PRIMARY KEY,
+            hash TEXT,
+            size INTEGER,
+            mtime_ns INTEGER,
+            partial_hash TEXT
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO file_hashes_new (file_path, hash, size, mtime_ns)
+        SELECT file_path, hash, size, mtime_ns FROM file_hashes
+    """)
+    cursor.execute("DROP TABLE file_hashes")
+    cursor.execute("ALTER TABLE file_hashes_new RENAME TO file_hashes")
+    cursor.execute("CREATE INDEX idx_file_hashes_hash ON file_hashes (hash)")
+    cursor.execute("CREATE INDEX idx_file_hashes_size ON file_hashes (size, partial_hash)")
+
+def _migrate_v3(cursor):
+    """Add the table of 64-bit perceptual fingerprints (stored as signed integers)."""
+    cursor.execute("""
+        CREATE TABLE perceptual_hashes (
+            file_path TEXT PRIMARY KEY,
+            fingerprint INTEGER NOT NULL
+        )
+    """)
+
+def _migrate_v4(cursor):
+    """Record which signature produced partial_hash; older rows all used the head/tail one."""
+    cursor.execute("ALTER TABLE file_hashes ADD COLUMN signature_mode TEXT")
+    cursor.execute(
+        "UPDATE file_hashes SET signature_mode = ? WHERE partial_hash IS NOT NULL",
+        (f"headtail:{PARTIAL_HASH_BLOCK_SIZE}",)
+    )
+
+def _migrate_v5(cursor):
+    """Log full hashes set on existing rows, so other processes' Bloom filters learn about them."""
+    cursor.execute("""
+        CREATE TABLE hash_updates (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            hash TEXT NOT NULL
+        )
+    """)
+    # A trigger covers every writer, including other processes and older code paths
+    cursor.execute("""
+        CREATE TRIGGER log_hash_updates AFTER UPDATE OF hash ON file_hashes
+        WHEN NEW.hash IS NOT NULL AND NEW.hash IS NOT OLD.hash
+        BEGIN
+            INSERT INTO hash_updates (hash) VALUES (NEW.hash);
+        END
+    """)
+
+def _migrate_v6(cursor):
+    """Mark signature-only rows whose backup file is gone or changed, which can never get a full hash."""
+    cursor.execute("ALTER TABLE file_hashes ADD COLUMN unverifiable INTEGER NOT NULL DEFAULT 0")
+
+# Schema migrations, applied in order; PRAGMA user_version holds the number applied
+_MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6]
+
 def init_database():
     """
     Initialize SQLite database with a table for file hashes.
+
+    Databases created by older versions are migrated to the current schema
+    automatically. The migration runs in an IMMEDIATE transaction, so two
+    processes starting at once never migrate the same database twice.
     """
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with connect_database() as conn:
             cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS file_hashes (
                     file_path TEXT PRIMARY KEY,
                     hash TEXT NOT NULL
                 )
             """)
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            for number, migration in enumerate(_MIGRATIONS[version:], start=version + 1):
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {number}")
+                logger.info(f"Migrated {DB_PATH} to schema version {number}")
             conn.commit()
             logger.info("Initialized database: file_hashes.db")
     except sqlite3.Error as e:
         logger.error(f"Error initializing database: {str(e)}")
         print(f"Error initializing database: {str(e)}")
 
-def check_duplicates(media_files):
+def get_membership_filter():
     """
-    Check for duplicate files using a SQLite database.
-    
+    Return the process-wide Bloom filter for DB_PATH, building or loading it on first use.
+
+    The filter holds a "size:<bytes>" and a "hash:<sha256>" key per row, is
+    loaded from a snapshot next to the database (DB_PATH + '.bloom') when that
+    is up to date, and is kept current as rows are written.
+
+    Returns:
+        bloom_filter.MembershipFilter: The filter, or None if BLOOM_FILTER_ENABLED is off.
+    """
+    global _membership_filter
+    if not BLOOM_FILTER_ENABLED:
+        return None
+    with _membership_filter_lock:
+        if _membership_filter is None or _membership_filter.db_path != DB_PATH:
+            _membership_filter = bloom_filter.MembershipFilter(
+                DB_PATH, connect_database, BLOOM_FALSE_POSITIVE_RATE, BLOOM_MAX_BYTES
+            )
+        return _membership_filter
+
+def _may_exist(key):
+    """False only if the key is certainly not in the database."""
+    membership = get_membership_filter()
+    return membership is None or membership.might_contain(key)
+
+def _record_false_positive():
+    membership = get_membership_filter()
+    if membership:
+        membership.record_false_positive()
+
+def _record_row(size, file_hash):
+    membership = get_membership_filter()
+    if membership:
+        membership.add(size, file_hash)
+
+def _save_membership_filter():
+    membership = get_membership_filter()
+    if membership:
+        membership.save()
+
+def hash_exists(file_hash):
+    """
+    Check if a hash is already recorded in the database.
+
+    Safe to call from worker threads (each call uses its own connection), so it
+    can be passed to file_manager.copy_and_hash_files as skip_known. Files that
+    the tiered strategy recorded without a full hash are not found here; the
+    duplicate check itself still catches them.
+
     Args:
-        media_files (list): List of file paths to check (e.g., ['C:/Media_Backup/Photos_2025/image1.cr2']).
-    
+        file_hash (str): SHA-256 hash to look up.
+
     Returns:
-        tuple: (bool, list, list)
-            - Success flag (True if successful, False otherwise)
-            - List of unique file paths for upload
-            - List of duplicate file paths (for reporting)
+        bool: True if the hash is already known, False otherwise.
     """
-    root = tk.Tk()
-    root.withdraw()  # Hide main window
+    if not _may_exist(f"hash:{file_hash}"):
+        return False
+    try:
+        with connect_database() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM file_hashes WHERE hash = ? LIMIT 1", (file_hash,))
+            found = cursor.fetchone() is not None
+            if not found:
+                _record_false_positive()
+            return found
+    except sqlite3.OperationalError as e:
+        if "no such table" in str(e):
+            return False  # Nothing recorded yet (init_database not run on a fresh install)
+        logger.error(f"Error looking up hash {file_hash}: {str(e)}")
+        return False
+    except sqlite3.Error as e:
+        logger.error(f"Error looking up hash {file_hash}: {str(e)}")
+        return False
+
+def _resolve_stored_hash(cursor, file_path, size, mtime_ns):
+    """
+    Compute and store the full hash of a recorded file that only has a partial signature.
 
+    Returns:
+        str: SHA-256 hash, or None if the file is gone or changed since it was recorded.
+    """
     try:
-        # Initialize database
-        init_database()
+        stat = os.stat(file_path)
+        if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+            logger.warning(f"Can't confirm a match with {file_path}: changed since it was recorded")
+            return None
+        file_hash = _sha256_file(file_path)
+    except OSError:
+        logger.warning(f"Can't confirm a match with {file_path}: no longer readable")
+        return None
+    cursor.execute("UPDATE file_hashes SET hash = ? WHERE file_path = ?", (file_hash, file_path))
+    _record_row(None, file_hash)
+    return file_hash
 
-        unique_files = []
-        duplicate_files = []
+def _find_match(cursor, file_path, size, file_hash):
+    """
+    Look for a recorded file with the same content as file_path.
 
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
+    With the tiered strategy, whole files are read only when a stored file has
+    the same size and the same signature (or no comparable signature). Files
+    of FAST_FINGERPRINT_MIN_SIZE or more go through the same tiers with the
+    "full" strategy too, so a large video is only read in full on a collision.
+
+    A full hash known without reading the file (from the hash cache) is
+    always used, and so is one computed on a collision: the row recorded for
+    a unique file then has it, so later checks never depend on the file still
+    being in the backup folder.
+
+    Returns:
+        tuple: (matched_path or None, file_hash, partial_hash); the hashes are
+               whatever had to be computed on the way (None if not needed).
+
+    Raises:
+        OSError: If file_path can't be read.
+    """
+    file_hash = file_hash or _cached_hash(file_path)
+    if DEDUP_STRATEGY == "full" and (file_hash or size < FAST_FINGERPRINT_MIN_SIZE):
+        file_hash = file_hash or _sha256_file(file_path)
+        row = None
+        if _may_exist(f"hash:{file_hash}"):
+            row = cursor.execute("SELECT file_path FROM file_hashes WHERE hash = ? LIMIT 1", (file_hash,)).fetchone()
+            if not row:
+                _record_false_positive()
+        return (row[0] if row else None), file_hash, None
+
+    # Tier 1: only stored files of exactly the same size can match
+    partial_hash = None
+    candidates = []
+    if _may_exist(f"size:{size}"):
+        candidates = cursor.execute(
+            "SELECT file_path, partial_hash, signature_mode, hash, mtime_ns FROM file_hashes WHERE size = ?", (size,)
+        ).fetchall()
+        if not candidates:
+            _record_false_positive()
+
+    # Tier 2: signature (pointless if the full hash is already known); signatures
+    # of another mode can't rule a stored file out
+    if candidates and not file_hash:
+        partial_hash, mode = _signature_file(file_path, size)
+        candidates = [c for c in candidates if c[1] is None or c[2] != mode or c[1] == partial_hash]
+
+    # Tier 3: full hash, computed only on a collision
+    if candidates:
+        file_hash = file_hash or _sha256_file(file_path)
+        for stored_path, _, _, stored_hash, stored_mtime_ns in candidates:
+            if stored_hash is None:
+                stored_hash = _resolve_stored_hash(cursor, stored_path, size, stored_mtime_ns)
+            if stored_hash == file_hash:
+                return stored_path, file_hash, partial_hash
+
+    # Rows recorded before sizes were kept can only be matched by full hash
+    if file_hash and _may_exist(f"hash:{file_hash}"):
+        row = cursor.execute(
+            "SELECT file_path FROM file_hashes WHERE hash = ? AND size IS NULL LIMIT 1", (file_hash,)
+        ).fetchone()
+        if row:
+            return row[0], file_hash, partial_hash
+
+    # Keep a signature so later runs can prefilter against this file
+    if file_hash is None and partial_hash is None:
+        partial_hash = _signature_file(file_path, size)[0]
+    return None, file_hash, partial_hash
 
-            for file_path in media_files:
-                if not os.path.exists(file_path):
+def iter_check_duplicates(items, commit_every=None):
+    """
+    Check files for duplicates one at a time, recording new hashes in the database.
+
+    Consumes items lazily, so it can sit between a copy stage and an upload
+    stage. The database connection is owned by the thread running the
+    generator. With the "full" strategy files are hashed in parallel by
+    hash_engine and checked in the order their hashes complete (except files
+    of FAST_FINGERPRINT_MIN_SIZE or more, which are only read in full on a
+    signature collision).
+
+    Args:
+        items (iterable): File paths, or tuples (file_path, file_hash) with a
+            precomputed SHA-256 hash (None to compute it).
+        commit_every (int): Number of new rows written per transaction (default: DB_BATCH_SIZE).
+
+    Yields:
+        tuple: (file_path, is_duplicate) for each file that could be checked.
+    """
+    commit_every = commit_every or DB_BATCH_SIZE
+    init_database()
+
+    if DEDUP_STRATEGY == "full":
+        # Every file needs a full hash anyway: compute them in parallel, in completion order
+        items = hash_engine.hash_files(items, max_size=FAST_FINGERPRINT_MIN_SIZE - 1)
+
+    with connect_database() as conn:
+        cursor = conn.cursor()
+        uncommitted = 0
+        try:
+            for item in items:
+                file_path, file_hash = item if isinstance(item, tuple) else (item, None)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
                     logger.warning(f"File not found: {file_path}")
                     print(f"File not found: {file_path}")
                     continue
-
-                file_hash = compute_file_hash(file_path)
-                if not file_hash:
+                try:
+                    match, file_hash, partial_hash = _find_match(cursor, file_path, stat.st_size, file_hash)
+                except OSError as e:
+                    logger.error(f"Error computing hash for {file_path}: {str(e)}")
                     logger.warning(f"Skipping {file_path} due to hash computation error")
                     print(f"Skipping {file_path} due to hash computation error")
                     continue
 
-                # Check if hash exists in database
-                cursor.execute("SELECT file_path FROM file_hashes WHERE hash = ?", (file_hash,))
-                result = cursor.fetchone()
-
-                if result:
-                    logger.info(f"Duplicate found: {file_path} (matches {result[0]})")
+                if match:
+                    logger.info(f"Duplicate found: {file_path} (matches {match})")
                     print(f"Duplicate found: {file_path}")
-                    duplicate_files.append(file_path)
+                    yield file_path, True
+                    continue
+
+                # Add to database and unique files
+                cursor.execute(
+                    "INSERT OR REPLACE INTO file_hashes (file_path, hash, size, mtime_ns, partial_hash, signature_mode) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (file_path, file_hash, stat.st_size, stat.st_mtime_ns, partial_hash,
+                     _signature_mode(stat.st_size) if partial_hash else None)
+                )
+                _record_row(stat.st_size, file_hash)
+                uncommitted += 1
+                if uncommitted >= commit_every:
+                    conn.commit()
+                    uncommitted = 0
+                logger.info(f"Added unique file: {file_path}")
+                print(f"Added unique file: {file_path}")
+                yield file_path, False
+        finally:
+            conn.commit()
+            _save_membership_filter()
+
+def _check_batch(cursor, batch, file_hashes):
+    """
+    Check one batch of files with a few set-based queries against a temp table.
+
+    Args:
+        cursor: Cursor of a connection holding the batch_files temp table.
+        batch (list): File paths to check.
+        file_hashes (dict): Precomputed SHA-256 hashes keyed by file path.
+
+    Returns:
+        tuple: (list, list) unique and duplicate file paths, in input order.
+    """
+    rows = []
+    for position, file_path in enumerate(batch):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            logger.warning(f"File not found: {file_path}")
+            print(f"File not found: {file_path}")
+            continue
+        file_hash = file_hashes.get(file_path) or _cached_hash(file_path)
+        partial_hash = mode = None
+        if not file_hash and (DEDUP_STRATEGY != "full" or stat.st_size >= FAST_FINGERPRINT_MIN_SIZE):
+            try:
+                partial_hash, mode = _signature_file(file_path, stat.st_size)
+            except OSError as e:
+                logger.error(f"Error computing partial hash for {file_path}: {str(e)}")
+                logger.warning(f"Skipping {file_path} due to hash computation error")
+                print(f"Skipping {file_path} due to hash computation error")
+                continue
+        rows.append((position, file_path, stat.st_size, stat.st_mtime_ns, partial_hash, mode, file_hash))
+
+    cursor.execute("DELETE FROM batch_files")
+    cursor.executemany(
+        "INSERT INTO batch_files (position, file_path, size, mtime_ns, partial_hash, signature_mode, hash) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+    # Files with neither a hash nor a signature ("full" strategy) are hashed outright
+    need_full = [row[1] for row in rows if not row[6] and row[4] is None]
+
+    # Tiers 1 and 2 for the whole batch: only files whose size and signature
+    # collide with a stored file or another file in the batch need a full hash
+    need_full += [file_path for (file_path,) in cursor.execute("""
+        SELECT b.file_path FROM batch_files b
+        WHERE b.hash IS NULL AND b.partial_hash IS NOT NULL AND (
+            EXISTS (SELECT 1 FROM file_hashes f WHERE f.size = b.size
+                    AND (f.partial_hash IS NULL OR f.signature_mode IS NOT b.signature_mode
+                         OR f.partial_hash = b.partial_hash))
+            OR EXISTS (SELECT 1 FROM batch_files o WHERE o.position != b.position AND o.size = b.size
+                       AND (o.partial_hash IS NULL OR o.partial_hash = b.partial_hash))
+        )
+    """).fetchall()]
+
+    # Stored files that collide but were recorded without a full hash
+    stored = cursor.execute("""
+        SELECT f.file_path, f.size, f.mtime_ns FROM file_hashes f
+        WHERE f.hash IS NULL AND EXISTS (
+            SELECT 1 FROM batch_files b WHERE b.size = f.size
+            AND (f.partial_hash IS NULL OR b.partial_hash IS NULL
+                 OR f.signature_mode IS NOT b.signature_mode OR f.partial_hash = b.partial_hash)
+        )
+    """).fetchall()
+    for stored_path, size, mtime_ns in stored:
+        _resolve_stored_hash(cursor, stored_path, size, mtime_ns)
+
+    # Tier 3 in parallel
+    computed = []
+    failed = set()
+    for file_path, file_hash in hash_engine.hash_files(need_full):
+        if file_hash:
+            computed.append((file_hash, file_path))
+        else:
+            failed.add(file_path)
+    cursor.executemany("UPDATE batch_files SET hash = ? WHERE file_path = ?", computed)
+    if failed:
+        cursor.executemany("DELETE FROM batch_files WHERE file_path = ?", [(path,) for path in failed])
+
+    # One join resolves every file with a full hash against the database
+    matches = dict(cursor.execute("""
+        SELECT b.position, MIN(f.file_path) FROM batch_files b
+        JOIN file_hashes f ON f.hash = b.hash
+        GROUP BY b.position
+    """).fetchall())
+
+    unique_files = []
+    duplicate_files = []
+    inserts = []
+    seen = {}
+    for position, file_path, size, mtime_ns, partial_hash, mode, file_hash in cursor.execute(
+            "SELECT position, file_path, size, mtime_ns, partial_hash, signature_mode, hash "
+            "FROM batch_files ORDER BY position"
+    ).fetchall():
+        match = matches.get(position) or seen.get(file_hash)
+        if match:
+            logger.info(f"Duplicate found: {file_path} (matches {match})")
+            print(f"Duplicate found: {file_path}")
+            duplicate_files.append(file_path)
+            continue
+        if file_hash:
+            seen[file_hash] = file_path
+        inserts.append((file_path, file_hash, size, mtime_ns, partial_hash, mode))
+        unique_files.append(file_path)
+        logger.info(f"Added unique file: {file_path}")
+        print(f"Added unique file: {file_path}")
+
+    for file_path in failed:
+        logger.warning(f"Skipping {file_path} due to hash computation error")
+        print(f"Skipping {file_path} due to hash computation error")
+
+    cursor.executemany(
+        "INSERT OR REPLACE INTO file_hashes (file_path, hash, size, mtime_ns, partial_hash, signature_mode) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        inserts
+    )
+    for _, file_hash, size, _, _, _ in inserts:
+        _record_row(size, file_hash)
+    return unique_files, duplicate_files
+
+def find_duplicates(media_files, file_hashes=None, batch_size=None):
+    """
+    Split files into unique and duplicate files, recording new hashes in the database.
+
+    Files are checked in batches: each batch is loaded into a temp table and
+    resolved with a handful of set-based queries and one executemany insert,
+    so database round trips grow with the number of batches, not files.
+
+    Args:
+        media_files (list): List of file paths to check.
+        file_hashes (dict): Optional precomputed SHA-256 hashes keyed by file path
+            (e.g., from file_manager.copy_and_hash_files); these files are not re-read.
+        batch_size (int): Files per batch and transaction (default: DB_BATCH_SIZE).
+
+    Returns:
+        tuple: (list, list)
+            - List of unique file paths for upload
+            - List of duplicate file paths (for reporting)
+    """
+    file_hashes = file_hashes or {}
+    batch_size = batch_size or DB_BATCH_SIZE
+    init_database()
+
+    unique_files = []
+    duplicate_files = []
+    with connect_database() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS batch_files (
+                position INTEGER PRIMARY KEY,
+                file_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                partial_hash TEXT,
+                signature_mode TEXT,
+                hash TEXT
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS temp.idx_batch_files_size ON batch_files (size)")
+
+        for start in range(0, len(media_files), batch_size):
+            batch_unique, batch_duplicates = _check_batch(cursor, media_files[start:start + batch_size], file_hashes)
+            unique_files.extend(batch_unique)
+            duplicate_files.extend(batch_duplicates)
+            conn.commit()
+
+    _save_membership_filter()
+    return unique_files, duplicate_files
+
+def count_unverified():
+    """
+    Count recorded files that only have a signature and can still get a full hash (see verify_full_hashes).
+
+    Returns:
+        int: Number of rows verify_full_hashes may upgrade (0 if the database can't be read).
+    """
+    if not os.path.exists(DB_PATH):
+        return 0
+    init_database()
+    try:
+        with connect_database() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM file_hashes WHERE hash IS NULL AND unverifiable = 0"
+            ).fetchone()[0]
+    except sqlite3.Error as e:
+        logger.warning(f"Error counting unverified hashes: {str(e)}")
+        return 0
+
+def verify_full_hashes(limit=None, workers=None):
+    """
+    Fill in the full SHA-256 of recorded files that only have a signature.
+
+    Run by the background upload worker once it has nothing due to upload
+    (upload_queue.run_worker): it uses its own connection and commits per batch, so
+    duplicate checks can run at the same time. Files that are gone or changed
+    since they were recorded are marked unverifiable and not tried again
+    (unless their whole folder is missing, e.g. on an unplugged drive).
+
+    Args:
+        limit (int): Maximum number of files to hash (default: all, largest first).
+        workers (int): Number of hashing threads (default: HASH_WORKERS).
+
+    Returns:
+        int: Number of rows that got their full hash.
+    """
+    init_database()
+    verified = 0
+    try:
+        with connect_database() as conn:
+            cursor = conn.cursor()
+            rows = cursor.execute(
+                "SELECT file_path, size, mtime_ns FROM file_hashes WHERE hash IS NULL AND unverifiable = 0 "
+                "ORDER BY size DESC LIMIT ?",
+                (-1 if limit is None else limit,)
+            ).fetchall()
+            recorded = {}
+            lost = []
+            for file_path, size, mtime_ns in rows:
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    # Pruned from a backup folder that is still there; an unplugged drive is tried again later
+                    if os.path.isdir(os.path.dirname(file_path)):
+                        lost.append((file_path, size, mtime_ns))
+                    continue
+                except OSError:
+                    continue
+                if stat.st_size == size and stat.st_mtime_ns == mtime_ns:
+                    recorded[file_path] = (size, mtime_ns)
                 else:
-                    # Add to database and unique files
-                    cursor.execute("INSERT INTO file_hashes (file_path, hash) VALUES (?, ?)", 
-                                 (file_path, file_hash))
-                    unique_files.append(file_path)
-                    logger.info(f"Added unique file: {file_path}")
-                    print(f"Added unique file: {file_path}")
+                    lost.append((file_path, size, mtime_ns))
+            cursor.executemany(
+                "UPDATE file_hashes SET unverifiable = 1 WHERE file_path = ? AND size = ? AND mtime_ns = ?", lost
+            )
+            conn.commit()
+            if lost:
+                logger.info(f"{len(lost)} recorded files are gone or changed and can't get a full hash")
+
+            updates = []
+            for file_path, file_hash in hash_engine.hash_files(recorded, workers=workers):
+                if file_hash:
+                    # Skip rows another check replaced with a newer version of the file meanwhile
+                    updates.append((file_hash, file_path, *recorded[file_path]))
+                    _record_row(None, file_hash)
+                if len(updates) >= DB_BATCH_SIZE:
+                    cursor.executemany(
+                        "UPDATE file_hashes SET hash = ? WHERE file_path = ? AND size = ? AND mtime_ns = ?", updates
+                    )
+                    conn.commit()
+                    verified += len(updates)
+                    updates = []
+            cursor.executemany(
+                "UPDATE file_hashes SET hash = ? WHERE file_path = ? AND size = ? AND mtime_ns = ?", updates
+            )
+            conn.commit()
+            verified += len(updates)
+    except sqlite3.Error as e:
+        logger.error(f"Error verifying full hashes: {str(e)}")
+    _save_membership_filter()
+    logger.info(f"Verified full hashes of {verified} recorded files")
+    return verified
+
+def find_near_duplicates(media_files, max_distance=None):
+    """
+    Find images that look like an already archived image, or like an earlier image in media_files.
+
+    Args:
+        media_files (list): List of file paths to check (typically the unique files).
+        max_distance (int): Maximum Hamming distance between fingerprints
+            (default: PERCEPTUAL_MAX_DISTANCE).
+
+    Returns:
+        tuple: (list, list, list)
+            - File paths kept
+            - Tuples (file_path, matched_path, distance) for near duplicates
+            - Clusters of look-alike file paths
+    """
+    init_database()
+    with connect_database() as conn:
+        cursor = conn.cursor()
+        result = perceptual.check_near_duplicates(
+            cursor, media_files, PERCEPTUAL_MAX_DISTANCE if max_distance is None else max_distance
+        )
+        conn.commit()
+    return result
+
+def iter_near_duplicates(results, max_distance=None):
+    """
+    Turn unique images that look like an archived or earlier image into duplicates.
+
+    Streaming counterpart of find_near_duplicates for the pipeline: takes the
+    results of iter_check_duplicates and passes them on, with near duplicates
+    among the unique files marked as duplicates. Fingerprints of kept images
+    are written every DB_BATCH_SIZE files and when the results end.
+
+    Args:
+        results (iterable): Tuples (file_path, is_duplicate).
+        max_distance (int): Maximum Hamming distance between fingerprints
+            (default: PERCEPTUAL_MAX_DISTANCE).
+
+    Yields:
+        tuple: (file_path, is_duplicate) for each result.
+    """
+    max_distance = PERCEPTUAL_MAX_DISTANCE if max_distance is None else max_distance
+    init_database()
+    with connect_database() as conn:
+        tree = perceptual.load_tree(conn.cursor())
 
+    def record(inserts):
+        # Short write transactions: the exact check writes to the same database meanwhile
+        with connect_database() as conn:
+            perceptual.record_fingerprints(conn.cursor(), inserts)
             conn.commit()
 
+    inserts = []
+    try:
+        for file_path, is_duplicate in results:
+            if not is_duplicate:
+                matched_path, _, fingerprint = perceptual.match_image(tree, file_path, max_distance)
+                is_duplicate = matched_path is not None
+                if fingerprint is not None:
+                    inserts.append((file_path, perceptual.to_signed(fingerprint)))
+                if len(inserts) >= DB_BATCH_SIZE:
+                    record(inserts)
+                    inserts = []
+            yield file_path, is_duplicate
+    finally:
+        try:
+            record(inserts)
+        except sqlite3.Error as e:
+            logger.error(f"Error recording perceptual fingerprints: {str(e)}")
+
+def check_duplicates(media_files, file_hashes=None):
+    """
+    Check for duplicate files using a SQLite database.
+    
+    Args:
+        media_files (list): List of file paths to check (e.g., ['C:/Media_Backup/Photos_2025/image1.cr2']).
+        file_hashes (dict): Optional precomputed SHA-256 hashes keyed by file path.
+    
+    Returns:
+        tuple: (bool, list, list)
+            - Success flag (True if successful, False otherwise)
+            - List of unique file paths for upload
+            - List of duplicate file paths, including near duplicates when
+              PERCEPTUAL_DEDUP is on (for reporting)
+    """
+    root = tk.Tk()
+    root.withdraw()  # Hide main window
+
+    try:
+        unique_files, duplicate_files = find_duplicates(media_files, file_hashes)
+        clusters = []
+        if PERCEPTUAL_DEDUP:
+            unique_files, near_duplicates, clusters = find_near_duplicates(unique_files)
+            duplicate_files += [file_path for file_path, _, _ in near_duplicates]
+
         # Display summary
         total_files = len(media_files)
         unique_count = len(unique_files)
@@ -131,6 +866,10 @@ def check_duplicates(media_files):
         )
         if duplicate_files:
             message += f"\n- Sample duplicates: {', '.join([os.path.basename(f) for f in duplicate_files[:5]])}{'...' if duplicate_count > 5 else ''}"
+        if clusters:
+            message += f"\n- Look-alike groups: {len(clusters)}"
+            for cluster in clusters[:3]:
+                message += f"\n  {', '.join(os.path.basename(f) for f in cluster[:5])}{'...' if len(cluster) > 5 else ''}"
         logger.info(message)
         print(message)
         messagebox.showinfo("Duplicate Check", message)
@@ -1,3 +1,4 @@
+import os
 import tkinter as tk
 from tkinter import messagebox, simpledialog
 import smtplib
@@ -73,13 +74,89 @@ def prompt_recipient_email():
         root.destroy()
         return None
 
-def send_email(uploaded_files, source_folder):
+def compose_email(uploaded_files, source_folder):
+    """
+    Write the subject and body of the email listing the links of uploaded files.
+
+    Photos with a preview are listed with the link to their web-sized preview
+    first, which opens fast, then the link to the full-size original.
+
+    Args:
+        uploaded_files (list): List of tuples (file_name, shareable_link) from cloud_uploader,
+            or (file_name, shareable_link, preview_link) from main.run_pipeline.
+        source_folder (str): Source folder path (e.g., 'F:\\TestCard\\Photos_2025\\') for context.
+
+    Returns:
+        tuple: (subject, body)
+    """
+    folder_name = os.path.basename(os.path.normpath(source_folder))
+    subject = f"Media Upload: Shareable Links for {folder_name}"
+    body = (
+        f"Dear Recipient,\n\n"
+        f"The following files from {folder_name} have been uploaded to Google Drive:\n\n"
+    )
+    for file_name, link, *preview in uploaded_files:
+        if preview and preview[0]:
+            body += f"- {file_name}: {preview[0]} (full size: {link})\n"
+        else:
+            body += f"- {file_name}: {link}\n"
+    body += (
+        "\nClick the links to access the files.\n\n"
+        "Note: If you cannot receive this email, it may be due to an invalid email address.\n"
+        "Best regards,\nMediaCardUploader"
+    )
+    return subject, body
+
+def _deliver(sender_email, app_password, recipient_email, subject, body):
+    """Send one email through Gmail SMTP; raises smtplib.SMTPException or OSError on failure."""
+    msg = MIMEText(body)
+    msg['Subject'] = subject
+    msg['From'] = sender_email
+    msg['To'] = recipient_email
+    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
+        server.login(sender_email, app_password)
+        server.send_message(msg)
+
+def send_links(uploaded_files, source_folder, recipient_email):
+    """
+    Email the links of uploaded files without any dialog, e.g. from the
+    background upload worker (upload_queue.send_requested_emails).
+
+    Args:
+        uploaded_files (list): Tuples as for send_email.
+        source_folder (str): Source folder path, for context.
+        recipient_email (str): Address chosen when the files were queued.
+
+    Returns:
+        tuple: (bool, str)
+            - Success flag (True if email sent, False otherwise)
+            - Message summarizing the result
+    """
+    sender_email, app_password = load_email_credentials()
+    if not sender_email or not app_password:
+        logger.warning("Email sending cancelled due to invalid or missing credentials")
+        return False, "Invalid or missing credentials"
+    subject, body = compose_email(uploaded_files, source_folder)
+    try:
+        _deliver(sender_email, app_password, recipient_email, subject, body)
+    except (smtplib.SMTPException, OSError) as e:
+        logger.error(f"SMTP error: {str(e)}")
+        return False, f"SMTP error: {str(e)}"
+    logger.info(f"Email sent to {recipient_email} with {len(uploaded_files)} links")
+    return True, f"Email sent to {recipient_email} with {len(uploaded_files)} links"
+
+def send_email(uploaded_files, source_folder, recipient_email=None):
     """
     Send an email with shareable Google Drive links to the recipient.
+
+    Photos with a preview are listed with the link to their web-sized preview
+    first, which opens fast, then the link to the full-size original.
     
     Args:
-        uploaded_files (list): List of tuples (file_name, shareable_link) from cloud_uploader.
+        uploaded_files (list): List of tuples (file_name, shareable_link) from cloud_uploader,
+            or (file_name, shareable_link, preview_link) from main.run_pipeline.
         source_folder (str): Source folder path (e.g., 'F:\\TestCard\\Photos_2025\\') for context.
+        recipient_email (str): Recipient, if already chosen; otherwise the user is asked.
     
     Returns:
         tuple: (bool, str)
@@ -105,7 +182,7 @@ def send_email(uploaded_files, source_folder):
             return False, "Invalid or missing credentials"
 
         # Prompt for recipient email
-        recipient_email = prompt_recipient_email()
+        recipient_email = recipient_email or prompt_recipient_email()
         if not recipient_email:
             logger.warning("Email sending cancelled due to missing or invalid recipient email")
             messagebox.showwarning("Warning", "Email sending cancelled.")
@@ -113,32 +190,13 @@ def send_email(uploaded_files, source_folder):
             return False, "Email sending cancelled"
 
         # Prepare email content
-        folder_name = os.path.basename(os.path.normpath(source_folder))
-        subject = f"Media Upload: Shareable Links for {folder_name}"
-        body = (
-            f"Dear Recipient,\n\n"
-            f"The following files from {folder_name} have been uploaded to Google Drive:\n\n"
-        )
-        for file_name, link in uploaded_files:
-            body += f"- {file_name}: {link}\n"
-        body += (
-            "\nClick the links to access the files.\n\n"
-            "Note: If you cannot receive this email, it may be due to an invalid email address.\n"
-            "Best regards,\nMediaCardUploader"
-        )
-
-        msg = MIMEText(body)
-        msg['Subject'] = subject
-        msg['From'] = sender_email
-        msg['To'] = recipient_email
+        subject, body = compose_email(uploaded_files, source_folder)
 
         # Send email via Gmail SMTP
         try:
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-                server.login(sender_email, app_password)
-                server.send_message(msg)
-                logger.info(f"Email sent to {recipient_email} with {len(uploaded_files)} links")
-                print(f"Email sent to {recipient_email}")
+            _deliver(sender_email, app_password, recipient_email, subject, body)
+            logger.info(f"Email sent to {recipient_email} with {len(uploaded_files)} links")
+            print(f"Email sent to {recipient_email}")
 
             # Display summary
             message = (
@@ -147,8 +205,8 @@ def send_email(uploaded_files, source_folder):
                 f"- Files: {len(uploaded_files)}\n"
                 f"- Sample links:\n"
             )
-            for file_name, link in uploaded_files[:3]:
-                message += f"  {file_name}: {link}\n"
+            for file_name, link, *preview in uploaded_files[:3]:
+                message += f"  {file_name}: {preview[0] if preview and preview[0] else link}\n"
             if len(uploaded_files) > 3:
                 message += "...\n"
             message += "Note: If the recipient email does not exist, you may receive a bounce-back notification."
@@ -0,0 +1,166 @@
+import json
+import time
+import hashlib
+import threading
+import email.parser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+from config import FAKE_DRIVE_LATENCY
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+_server = None
+_server_lock = threading.Lock()
+_discovery_document = None
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    """
+    Answers the Drive v3 calls the Drive backend makes (folders, simple and
+    resumable uploads, permissions and batches), each after the server's
+    latency, without storing file contents.
+    """
+
+    def _reply(self, status, response=None, headers=None):
+        payload = json.dumps(response).encode() if response is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _new_id(self, kind):
+        with self.server.lock:
+            self.server.next_id += 1
+            return f"fake-{kind}-{self.server.next_id}"
+
+    def do_GET(self):
+        """files().list: the fake Drive starts empty and lists no files or folders."""
+        time.sleep(self.server.latency)
+        self._reply(200, {"files": []})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        if self.path.startswith("/batch/"):
+            self._reply_batch(body)
+        elif "uploadType=resumable" in self.path:
+            session_id = self._new_id("session")
+            with self.server.lock:
+                self.server.sessions[session_id] = {"total": int(self.headers["X-Upload-Content-Length"]),
+                                                    "received": 0, "md5": hashlib.md5()}
+            self._reply(200, headers={"Location": f"http://127.0.0.1:{self.server.server_port}/upload/session/{session_id}"})
+        elif self.path.startswith("/upload/drive/v3/files?"):
+            # multipart/related: the file's metadata, then its content
+            message = email.parser.BytesParser().parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+            content = message.get_payload()[1].get_payload(decode=True) or b""
+            self._reply(200, {"id": self._new_id("file"), "md5Checksum": hashlib.md5(content).hexdigest(),
+                              "size": str(len(content))})
+        elif "/permissions" in self.path:
+            self._reply(200, {"id": "anyoneWithLink"})
+        elif self.path.startswith("/drive/v3/files?"):
+            self._reply(200, {"id": self._new_id("folder")})
+        else:
+            self._reply(404, {"error": {"code": 404, "message": "Not found"}})
+
+    def _reply_batch(self, body):
+        """Answer every call of a multipart/mixed batch (permissions) with success."""
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        parts = [
+            f"--batch_boundary\r\nContent-Type: application/http\r\n"
+            f"Content-ID: <response-{part['Content-ID'].strip('<>')}>\r\n\r\n"
+            f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{json.dumps({'id': 'anyoneWithLink'})}\r\n"
+            for part in message.get_payload()
+        ]
+        payload = ("".join(parts) + "--batch_boundary--\r\n").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/mixed; boundary=batch_boundary")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_PUT(self):
+        """Chunks and status queries of a resumable upload session."""
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        session = self.server.sessions.get(self.path.rsplit("/", 1)[1])
+        if session is None:
+            self._reply(404, {"error": {"code": 404, "message": "Upload session not found"}})
+            return
+        content_range = self.headers.get("Content-Range", "")
+        if not content_range.startswith("bytes */"):
+            start = int(content_range.split()[1].split("-")[0])
+            if start == session["received"]:
+                session["md5"].update(body)
+                session["received"] += len(body)
+        if session["received"] == session["total"]:
+            self._reply(200, {"id": self._new_id("file"), "md5Checksum": session["md5"].hexdigest(),
+                              "size": str(session["total"])})
+        elif session["received"]:
+            self._reply(308, headers={"Range": f"bytes=0-{session['received'] - 1}"})
+        else:
+            self._reply(308)
+
+    def log_message(self, *args):
+        pass
+
+def start_server(latency=None):
+    """
+    Start a fake Drive endpoint on a free local port, served by a daemon thread.
+
+    Args:
+        latency (float): Seconds each request takes (default: FAKE_DRIVE_LATENCY).
+
+    Returns:
+        ThreadingHTTPServer: The running server; call shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeDriveHandler)
+    server.daemon_threads = True
+    server.latency = FAKE_DRIVE_LATENCY if latency is None else latency
+    server.lock = threading.Lock()
+    server.next_id = 0
+    server.sessions = {}
+    threading.Thread(target=server.serve_forever, name="fake-drive", daemon=True).start()
+    logger.info(f"Fake Google Drive listening on port {server.server_port} (latency {server.latency}s)")
+    return server
+
+def get_server():
+    """Return the process-wide fake Drive endpoint, starting it on first use."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = start_server()
+        return _server
+
+def client_factory(server=None):
+    """
+    Return a client factory like cloud_uploader.drive_client_factory, whose
+    services talk to a fake Drive endpoint instead of Google (no credentials needed).
+
+    Args:
+        server (ThreadingHTTPServer): Endpoint from start_server (default: get_server()).
+
+    Returns:
+        callable: Function returning a new Drive API service.
+    """
+    global _discovery_document
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+    from googleapiclient.http import build_http
+
+    server = server or get_server()
+    if _discovery_document is None:
+        _discovery_document = get_static_doc("drive", "v3")
+    discovery = json.loads(_discovery_document)
+    discovery["rootUrl"] = f"http://127.0.0.1:{server.server_port}/"
+
+    def new_client():
+        # build_http keeps httplib2 from following the 308s of resumable uploads
+        return build_from_document(discovery, http=build_http())
+    return new_client
@@ -1,20 +1,352 @@
 import os
+import errno
 import shutil
+import hashlib
 import logging
-from config import DESTINATION_PATH, SUPPORTED_EXTENSIONS, BACKUP_SUBFOLDER
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import (DESTINATION_PATH, SUPPORTED_EXTENSIONS, BACKUP_SUBFOLDER, COPY_WORKERS,
+                    COPY_BACKEND, COPY_CHUNK_SIZE, COPY_HASH_BUFFER_SIZE,
+                    INCREMENTAL_IMPORT, MANIFEST_BATCH_SIZE, MIRROR_FOLDERS)
+import import_manifest
+import hash_cache
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log", 
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
                     format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-def copy_files(source_folder):
+def backup_folder():
+    """Return the folder backups are copied into (DESTINATION_PATH/BACKUP_SUBFOLDER)."""
+    return os.path.join(DESTINATION_PATH, BACKUP_SUBFOLDER)
+
+def collect_media_files(source_folder, dest_folder):
+    """
+    Walk source_folder and plan the copy of every supported media file.
+
+    Args:
+        source_folder (str): Source folder path (e.g., 'F:\\TestCard\\Photos_2025\\').
+        dest_folder (str): Destination folder the files are copied into.
+
+    Returns:
+        list: Tuples (src_path, dest_path, size, mtime_ns), largest files first.
+    """
+    # Unless MIRROR_FOLDERS is set, files are flattened into dest_folder, so a later
+    # file with the same name replaces an earlier one (same result as copying them
+    # one after another)
+    planned = {}
+    for root, _, files in os.walk(source_folder):
+        for file in files:
+            if os.path.splitext(file)[1].lower() in SUPPORTED_EXTENSIONS:
+                src_path = os.path.join(root, file)
+                if MIRROR_FOLDERS:
+                    dest_path = os.path.join(dest_folder, os.path.relpath(src_path, source_folder))
+                else:
+                    dest_path = os.path.join(dest_folder, file)
+                try:
+                    stat = os.stat(src_path)
+                except OSError as e:
+                    logger.error(f"Error reading size of {src_path}: {str(e)}")
+                    continue
+                planned.pop(dest_path, None)
+                planned[dest_path] = (src_path, dest_path, stat.st_size, stat.st_mtime_ns)
+
+    # Start the big videos first so they don't end up as the last, lone copy
+    return sorted(planned.values(), key=lambda item: item[2], reverse=True)
+
+# Errors meaning "this filesystem/kernel can't do that transfer", not a real I/O failure
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTSUP,
+                       errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSOCK}
+
+def kernel_copy_available():
+    """
+    Check if the OS offers kernel-side file transfer (copy_file_range or sendfile).
+
+    Returns:
+        bool: True if a kernel transfer call exists, False otherwise (e.g., Windows).
+    """
+    return hasattr(os, "copy_file_range") or hasattr(os, "sendfile")
+
+def _write_all(fd, data):
+    """
+    Write all of data to a file descriptor.
+
+    A single write() may write less than asked (e.g. to SMB/NAS shares), so
+    it is repeated until every byte is written.
+    """
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        if not written:
+            raise OSError(errno.EIO, "No progress writing the destination file")
+        view = view[written:]
+
+def _transfer_data(fsrc, fdst, chunk_size):
+    """
+    Move all remaining data from fsrc to fdst, preferring in-kernel transfers.
+
+    Tries os.copy_file_range (may reflink on Btrfs/XFS), then os.sendfile, then
+    a plain userspace loop. Every method continues from the current file
+    positions, so a fallback in the middle of a file picks up where the
+    previous method stopped.
+    """
+    in_fd = fsrc.fileno()
+    out_fd = fdst.fileno()
+
+    for name in ("copy_file_range", "sendfile"):
+        transfer = getattr(os, name, None)
+        if transfer is None:
+            continue
+        try:
+            while True:
+                if name == "copy_file_range":
+                    sent = transfer(in_fd, out_fd, chunk_size)
+                else:
+                    sent = transfer(out_fd, in_fd, None, chunk_size)
+                if sent == 0:
+                    return name
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            logger.debug(f"{name} not supported for {fsrc.name}, falling back: {str(e)}")
+
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        read = fsrc.readinto(buffer)
+        if not read:
+            return "userspace"
+        _write_all(out_fd, view[:read])
+
+def copy_file(src_path, dest_path, chunk_size=None):
+    """
+    Copy a single file, preserving its metadata like shutil.copy2.
+
+    Args:
+        src_path (str): File to copy.
+        dest_path (str): Destination file path.
+        chunk_size (int): Bytes per kernel transfer call (default: COPY_CHUNK_SIZE).
+
+    Returns:
+        str: Destination file path.
+    """
+    use_kernel = COPY_BACKEND == "kernel" or (COPY_BACKEND == "auto" and kernel_copy_available())
+    if not use_kernel:
+        shutil.copy2(src_path, dest_path)
+        return dest_path
+
+    with open(src_path, "rb", buffering=0) as fsrc, open(dest_path, "wb", buffering=0) as fdst:
+        method = _transfer_data(fsrc, fdst, chunk_size or COPY_CHUNK_SIZE)
+        copied, expected = os.fstat(fdst.fileno()).st_size, os.fstat(fsrc.fileno()).st_size
+        if copied != expected:
+            raise OSError(errno.EIO, f"Copied {copied} of {expected} bytes of {src_path}")
+    shutil.copystat(src_path, dest_path)
+    logger.debug(f"Copied {src_path} using {method}")
+    return dest_path
+
+def copy_file_with_hash(src_path, dest_path, skip_known=None, buffer_size=None):
+    """
+    Copy a single file and compute its SHA-256 in the same pass.
+
+    Data is streamed into a temporary '.part' file next to dest_path and only
+    renamed into place once the digest is known, so content rejected by
+    skip_known never shows up in the backup folder.
+
+    Args:
+        src_path (str): File to copy.
+        dest_path (str): Destination file path.
+        skip_known (callable): Optional check taking the SHA-256 hex digest; if it
+            returns True the copy is discarded.
+        buffer_size (int): Read buffer size (default: COPY_HASH_BUFFER_SIZE).
+
+    Returns:
+        tuple: (str, bool)
+            - SHA-256 hex digest of the file
+            - True if the file was kept, False if discarded by skip_known
+    """
+    part_path = dest_path + ".part"
+    sha256 = hashlib.sha256()
+    buffer = bytearray(buffer_size or COPY_HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    copied = 0
+    try:
+        with open(src_path, "rb", buffering=0) as fsrc, open(part_path, "wb", buffering=0) as fdst:
+            while True:
+                read = fsrc.readinto(buffer)
+                if not read:
+                    break
+                sha256.update(view[:read])
+                _write_all(fdst.fileno(), view[:read])
+                copied += read
+            written = os.fstat(fdst.fileno()).st_size
+        if written != copied:
+            raise OSError(errno.EIO, f"Wrote {written} of {copied} bytes of {src_path}")
+        file_hash = sha256.hexdigest()
+
+        if skip_known and skip_known(file_hash):
+            os.remove(part_path)
+            return file_hash, False
+
+        shutil.copystat(src_path, part_path)
+        os.replace(part_path, dest_path)
+        # Later verification runs of the backup copy are answered without reading it
+        hash_cache.store(dest_path, file_hash)
+        return file_hash, True
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+def iter_planned_copies(source_folder, copy_one, workers=None, incremental=None, stats=None,
+                        defer_imports=False):
+    """
+    Run copy_one(src_path, dest_path) for every media file in source_folder,
+    yielding results as copies finish.
+
+    At most two copies per worker are queued ahead of the consumer, so a slow
+    consumer (e.g., an upload stage) holds the copy stage back instead of
+    letting it run arbitrarily far ahead.
+
+    With incremental set, files recorded in the import manifest with the same
+    size and mtime are skipped without being opened, and finished copies are
+    recorded in batches so an interrupted import resumes where it stopped.
+    With defer_imports, kept files are not recorded here: their manifest
+    entries wait in stats['imports'] until the consumer has handed them on
+    safely (e.g. queued their upload) and calls record_handoffs, so a file
+    lost downstream is imported again by the next run.
+
+    Args:
+        source_folder (str): Source folder path.
+        copy_one (callable): Copies one file; returns (value, kept).
+        workers (int): Number of concurrent copy threads (default: COPY_WORKERS).
+        incremental (bool): Use the import manifest (default: INCREMENTAL_IMPORT).
+        stats (dict): Optional dict filled with 'dest_folder', 'skipped' (files
+            discarded by copy_one), 'unchanged' (files skipped via the manifest)
+            and 'imports' (entries waiting for record_handoffs, by dest_path).
+        defer_imports (bool): Leave recording kept files to record_handoffs.
+
+    Yields:
+        tuple: (dest_path, value) for each file kept by copy_one.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(skipped=0, unchanged=0, imports={})
+
+    # Create destination folder
+    dest_folder = backup_folder()
+    os.makedirs(dest_folder, exist_ok=True)
+    stats["dest_folder"] = dest_folder
+    logger.info(f"Destination folder: {dest_folder}")
+
+    planned = collect_media_files(source_folder, dest_folder)
+    for subfolder in {os.path.dirname(item[1]) for item in planned}:
+        os.makedirs(subfolder, exist_ok=True)
+    if incremental is None:
+        incremental = INCREMENTAL_IMPORT
+
+    if incremental:
+        manifest = import_manifest.load_manifest(source_folder)
+        to_copy = []
+        for item in planned:
+            src_path, _, size, mtime_ns = item
+            if import_manifest.is_unchanged(manifest, os.path.relpath(src_path, source_folder), size, mtime_ns):
+                stats["unchanged"] += 1
+            else:
+                to_copy.append(item)
+        planned = to_copy
+        logger.info(f"{stats['unchanged']} files unchanged since last import")
+
+    workers = max(1, workers or COPY_WORKERS)
+    logger.info(f"Copying {len(planned)} files with {workers} worker(s)")
+
+    finished = []
+    todo = iter(planned)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while True:
+                for src_path, dest_path, size, mtime_ns in todo:
+                    future = executor.submit(copy_one, src_path, dest_path)
+                    pending[future] = (src_path, dest_path, size, mtime_ns)
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    src_path, dest_path, size, mtime_ns = pending.pop(future)
+                    try:
+                        value, kept = future.result()
+                    except Exception as e:
+                        logger.error(f"Error copying {src_path}: {str(e)}")
+                        continue
+
+                    if incremental:
+                        entry = (os.path.relpath(src_path, source_folder), size, mtime_ns,
+                                 dest_path if kept else None)
+                        if kept and defer_imports:
+                            stats["imports"][dest_path] = entry
+                        else:
+                            finished.append(entry)
+                        if len(finished) >= MANIFEST_BATCH_SIZE:
+                            import_manifest.record_imports(source_folder, finished)
+                            finished = []
+
+                    if kept:
+                        logger.info(f"Copied {src_path} to {dest_path}")
+                        yield dest_path, value
+                    else:
+                        stats["skipped"] += 1
+                        logger.info(f"Skipped {src_path}: content already backed up")
+        finally:
+            # Also runs when the consumer stops early, so finished copies are never lost
+            for future in pending:
+                future.cancel()
+            if incremental:
+                import_manifest.record_imports(source_folder, finished)
+
+def record_handoffs(source_folder, stats, dest_paths):
+    """
+    Record in the import manifest files that iter_planned_copies kept with
+    defer_imports, now that they are safely handed on.
+
+    Args:
+        source_folder (str): Source folder path.
+        stats (dict): The stats dict passed to iter_planned_copies.
+        dest_paths (iterable): Destination paths of the files handed on; paths
+            with no waiting entry (e.g. previews) are ignored.
+
+    Returns:
+        bool: True if recorded, False otherwise.
+    """
+    imports = stats.get("imports", {})
+    entries = [imports.pop(dest_path) for dest_path in dest_paths if dest_path in imports]
+    return import_manifest.record_imports(source_folder, entries)
+
+def _copy_planned_files(source_folder, workers, copy_one, incremental):
+    """
+    Run iter_planned_copies to completion.
+
+    Returns:
+        tuple: (str, dict, int, int)
+            - Destination folder
+            - Dict mapping each kept destination path to the value from copy_one
+            - Number of files discarded by copy_one
+            - Number of files unchanged since the last import
+    """
+    stats = {}
+    results = dict(iter_planned_copies(source_folder, copy_one, workers, incremental, stats))
+    return stats["dest_folder"], results, stats["skipped"], stats["unchanged"]
+
+def copy_files(source_folder, workers=None, incremental=None):
     """
     Copy supported media files from source_folder to DESTINATION_PATH/BACKUP_SUBFOLDER.
-    
+
     Args:
         source_folder (str): Source folder path (e.g., 'F:\\TestCard\\Photos_2025\\').
-    
+        workers (int): Number of concurrent copy threads (default: COPY_WORKERS).
+        incremental (bool): Skip files unchanged since the last import from
+            this source (default: INCREMENTAL_IMPORT).
+
     Returns:
         tuple: (bool, str, list)
             - Success flag (True if copied, False otherwise)
@@ -26,34 +358,99 @@ def copy_files(source_folder):
             logger.error(f"Source folder does not exist: {source_folder}")
             return False, f"Source folder does not exist: {source_folder}", []
 
-        # Create destination folder
-        dest_folder = os.path.join(DESTINATION_PATH, BACKUP_SUBFOLDER)
-        os.makedirs(dest_folder, exist_ok=True)
-        logger.info(f"Destination folder: {dest_folder}")
+        dest_folder, results, _, unchanged = _copy_planned_files(
+            source_folder, workers, lambda src_path, dest_path: (copy_file(src_path, dest_path), True),
+            incremental
+        )
+        copied_files = list(results)
 
-        copied_files = []
-        for root, _, files in os.walk(source_folder):
-            for file in files:
-                if os.path.splitext(file)[1].lower() in SUPPORTED_EXTENSIONS:
-                    src_path = os.path.join(root, file)
-                    dest_path = os.path.join(dest_folder, file)
-                    try:
-                        shutil.copy2(src_path, dest_path)
-                        copied_files.append(dest_path)
-                        logger.info(f"Copied {src_path} to {dest_path}")
-                    except Exception as e:
-                        logger.error(f"Error copying {src_path}: {str(e)}")
-                        continue
-
-        if not copied_files:
+        if not copied_files and not unchanged:
             logger.warning("No supported files found to copy")
             return False, "No supported files found to copy", []
 
         message = f"Copied {len(copied_files)} files to {dest_folder}"
+        if unchanged:
+            message += f" ({unchanged} unchanged since last import, skipped)"
         logger.info(message)
         print(message)
         return True, message, copied_files
 
     except Exception as e:
         logger.error(f"Error in copy_files: {str(e)}")
-        return False, f"Error copying files: {str(e)}", []
\ No newline at end of file
+        return False, f"Error copying files: {str(e)}", []
+
+def copy_and_hash_files(source_folder, workers=None, skip_known=None, incremental=None):
+    """
+    Copy supported media files and compute their SHA-256 hashes in a single read.
+
+    The returned hashes can be passed to duplicate_checker.check_duplicates so
+    the backup copies are never read back. With skip_known (e.g.,
+    duplicate_checker.hash_exists) content that is already backed up is
+    discarded before it reaches the backup folder.
+
+    Args:
+        source_folder (str): Source folder path (e.g., 'F:\\TestCard\\Photos_2025\\').
+        workers (int): Number of concurrent copy threads (default: COPY_WORKERS).
+        skip_known (callable): Optional check taking a SHA-256 hex digest.
+        incremental (bool): Skip files unchanged since the last import from
+            this source (default: INCREMENTAL_IMPORT).
+
+    Returns:
+        tuple: (bool, str, list, dict)
+            - Success flag (True if copied, False otherwise)
+            - Message summarizing the result
+            - List of copied file paths
+            - Dict mapping copied file paths to their SHA-256 hashes
+    """
+    try:
+        if not os.path.exists(source_folder):
+            logger.error(f"Source folder does not exist: {source_folder}")
+            return False, f"Source folder does not exist: {source_folder}", [], {}
+
+        dest_folder, file_hashes, skipped, unchanged = _copy_planned_files(
+            source_folder, workers,
+            lambda src_path, dest_path: copy_file_with_hash(src_path, dest_path, skip_known),
+            incremental
+        )
+        copied_files = list(file_hashes)
+
+        if not copied_files and not skipped and not unchanged:
+            logger.warning("No supported files found to copy")
+            return False, "No supported files found to copy", [], {}
+
+        message = f"Copied {len(copied_files)} files to {dest_folder}"
+        if skipped:
+            message += f" ({skipped} already backed up, skipped)"
+        if unchanged:
+            message += f" ({unchanged} unchanged since last import, skipped)"
+        logger.info(message)
+        print(message)
+        return True, message, copied_files, file_hashes
+
+    except Exception as e:
+        logger.error(f"Error in copy_and_hash_files: {str(e)}")
+        return False, f"Error copying files: {str(e)}", [], {}
+
+def iter_copy_and_hash(source_folder, workers=None, skip_known=None, incremental=None, stats=None,
+                       defer_imports=False):
+    """
+    Streaming version of copy_and_hash_files: yield each file as soon as it is copied.
+
+    Args:
+        source_folder (str): Source folder path (e.g., 'F:\\TestCard\\Photos_2025\\').
+        workers (int): Number of concurrent copy threads (default: COPY_WORKERS).
+        skip_known (callable): Optional check taking a SHA-256 hex digest.
+        incremental (bool): Skip files unchanged since the last import from
+            this source (default: INCREMENTAL_IMPORT).
+        stats (dict): Optional dict filled with copy counters (see iter_planned_copies).
+        defer_imports (bool): Leave recording copied files in the import manifest
+            to record_handoffs (see iter_planned_copies).
+
+    Yields:
+        tuple: (dest_path, file_hash) for each copied file.
+    """
+    return iter_planned_copies(
+        source_folder,
+        lambda src_path, dest_path: copy_file_with_hash(src_path, dest_path, skip_known),
+        workers, incremental, stats, defer_imports
+    )
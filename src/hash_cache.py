@@ -0,0 +1,132 @@
+import os
+import sqlite3
+import threading
+import logging
+from config import HASH_CACHE_ENABLED
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Database configuration (kept next to file_hashes.db)
+HASH_CACHE_DB_PATH = "hash_cache.db"
+
+# One connection shared by all threads: lookups are short next to the hashing they save,
+# and a connection per pool thread would leave file handles and WAL readers behind
+_conn = None
+_conn_path = None
+_lock = threading.Lock()
+
+def _connection():
+    """Return the connection to the cache database, creating the table on first use (call with _lock held)."""
+    global _conn, _conn_path
+    if _conn is None or _conn_path != HASH_CACHE_DB_PATH:
+        if _conn is not None:
+            _conn.close()
+        conn = sqlite3.connect(HASH_CACHE_DB_PATH, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS hash_cache (
+                file_path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            )
+        """)
+        conn.commit()
+        _conn, _conn_path = conn, HASH_CACHE_DB_PATH
+    return _conn
+
+def close():
+    """Close the cache connection; the next lookup or store opens it again."""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+def _identity(stat):
+    """File identity used to decide if a cached hash is still valid."""
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+def lookup(file_path, stat=None):
+    """
+    Return the cached SHA-256 hash of a file if the file is unchanged since it was hashed.
+
+    Entries whose size, mtime or inode no longer match the file are removed.
+
+    Args:
+        file_path (str): Path to the file.
+        stat (os.stat_result): Current stat of the file, if already known.
+
+    Returns:
+        str: Cached SHA-256 hash, or None if not cached or stale.
+    """
+    try:
+        stat = stat or os.stat(file_path)
+        with _lock:
+            conn = _connection()
+            row = conn.execute(
+                "SELECT size, mtime_ns, inode, hash FROM hash_cache WHERE file_path = ?",
+                (os.path.abspath(file_path),)
+            ).fetchone()
+            if not row:
+                return None
+            if tuple(row[:3]) != _identity(stat):
+                conn.execute("DELETE FROM hash_cache WHERE file_path = ?", (os.path.abspath(file_path),))
+                conn.commit()
+                logger.debug(f"Invalidated stale cached hash for {file_path}")
+                return None
+            return row[3]
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Error reading hash cache for {file_path}: {str(e)}")
+        return None
+
+def store(file_path, file_hash, stat=None):
+    """
+    Cache the SHA-256 hash of a file together with its current identity.
+
+    Args:
+        file_path (str): Path to the file.
+        file_hash (str): SHA-256 hash of the file.
+        stat (os.stat_result): Stat of the file taken before it was hashed, if known.
+    """
+    try:
+        stat = stat or os.stat(file_path)
+        with _lock:
+            conn = _connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO hash_cache (file_path, size, mtime_ns, inode, hash) VALUES (?, ?, ?, ?, ?)",
+                (os.path.abspath(file_path), *_identity(stat), file_hash)
+            )
+            conn.commit()
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Error writing hash cache for {file_path}: {str(e)}")
+
+def cached_hash(file_path, compute):
+    """
+    Return a file's SHA-256 hash from the cache, or compute and cache it.
+
+    Args:
+        file_path (str): Path to the file.
+        compute (callable): Computes the hash from the path; may raise OSError.
+
+    Returns:
+        tuple: (str, bool)
+            - SHA-256 hash of the file
+            - True if answered from the cache without reading the file
+    """
+    if not HASH_CACHE_ENABLED:
+        return compute(file_path), False
+    stat = os.stat(file_path)
+    file_hash = lookup(file_path, stat)
+    if file_hash:
+        return file_hash, True
+    file_hash = compute(file_path)
+    # Store with the stat taken before hashing: if the file changed meanwhile,
+    # the entry is already stale and gets invalidated on the next lookup
+    store(file_path, file_hash, stat)
+    return file_hash, False
@@ -0,0 +1,192 @@
+import os
+import sys
+import mmap
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import HASH_WORKERS, HASH_BUFFER_SIZE, HASH_USE_MMAP
+import hash_cache
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+def hash_file(file_path, buffer_size=None, use_mmap=None, algorithm="sha256"):
+    """
+    Compute the SHA-256 (or another) hash of a file with a large read buffer or a memory map.
+
+    Args:
+        file_path (str): Path to the file.
+        buffer_size (int): Bytes per read / hash update (default: HASH_BUFFER_SIZE).
+        use_mmap (bool): Hash a memory map of the file (default: HASH_USE_MMAP).
+        algorithm (str): hashlib algorithm name, e.g. "md5" to compare with
+            Google Drive's md5Checksum.
+
+    Returns:
+        str: Hex digest of the file.
+
+    Raises:
+        OSError: If the file can't be read.
+    """
+    buffer_size = buffer_size or HASH_BUFFER_SIZE
+    use_mmap = HASH_USE_MMAP if use_mmap is None else use_mmap
+    digest = hashlib.new(algorithm)
+
+    with open(file_path, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if use_mmap and size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, buffer_size):
+                        digest.update(view[offset:offset + buffer_size])
+                finally:
+                    view.release()
+        else:
+            buffer = bytearray(buffer_size)
+            view = memoryview(buffer)
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                digest.update(view[:read])
+
+    return digest.hexdigest()
+
+def fingerprint_file(file_path, chunks=16, chunk_size=1024 * 1024):
+    """
+    Compute a fast SHA-256 fingerprint from a file's size and evenly spaced chunks.
+
+    Reads at most chunks * chunk_size bytes however large the file is, so a
+    10 GB video costs a few dozen seeks instead of a full read. Files with
+    different fingerprints can't be identical; files with the same fingerprint
+    still need hash_file to be sure.
+
+    Args:
+        file_path (str): Path to the file.
+        chunks (int): Number of chunks sampled, the first at the start of the
+            file and the last at its end.
+        chunk_size (int): Bytes per chunk.
+
+    Returns:
+        str: SHA-256 hex digest of the size and the sampled chunks.
+
+    Raises:
+        OSError: If the file can't be read.
+    """
+    with open(file_path, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        sha256 = hashlib.sha256(f"{size}:{chunks}:{chunk_size}".encode())
+        if size <= chunks * chunk_size:
+            offsets = range(0, size, chunk_size)
+        else:
+            step = (size - chunk_size) / max(1, chunks - 1)
+            offsets = (round(i * step) for i in range(chunks))
+        for offset in offsets:
+            f.seek(offset)
+            sha256.update(f.read(chunk_size))
+    return sha256.hexdigest()
+
+def hash_file_cached(file_path, buffer_size=None, use_mmap=None):
+    """
+    Like hash_file, but answer unchanged files from the persistent hash cache.
+
+    Returns:
+        tuple: (str, bool)
+            - SHA-256 hash of the file
+            - True if answered from the cache without reading the file
+    """
+    return hash_cache.cached_hash(file_path, lambda path: hash_file(path, buffer_size, use_mmap))
+
+def _hash_item(file_path, known_hash, buffer_size, use_mmap, max_size):
+    """Return (file_hash, bytes_read) for one file, skipping the read if the hash is known."""
+    if known_hash:
+        return known_hash, 0
+    if max_size is not None and os.path.getsize(file_path) > max_size:
+        return None, 0
+    file_hash, from_cache = hash_file_cached(file_path, buffer_size, use_mmap)
+    return file_hash, 0 if from_cache else os.path.getsize(file_path)
+
+def hash_files(items, workers=None, buffer_size=None, use_mmap=None, stats=None, max_size=None):
+    """
+    Hash many files concurrently, yielding each result as soon as it is ready.
+
+    Items are consumed lazily with at most two files per worker in flight, so
+    results stream out while the input is still being produced.
+
+    Args:
+        items (iterable): File paths, or tuples (file_path, file_hash); files with
+            a known hash are passed through without being read.
+        workers (int): Number of hashing threads (default: HASH_WORKERS).
+        buffer_size (int): Bytes per read (default: HASH_BUFFER_SIZE).
+        use_mmap (bool): Hash memory-mapped files (default: HASH_USE_MMAP).
+        stats (dict): Optional dict filled with 'files', 'bytes', 'seconds' and
+            'mb_per_s' for the files actually read (not answered from the hash cache).
+        max_size (int): Optional size limit; larger files without a known hash are
+            passed through unread, with file_hash None.
+
+    Yields:
+        tuple: (file_path, file_hash), with file_hash None if the file couldn't be
+               read (or is over max_size).
+    """
+    stats = stats if stats is not None else {}
+    stats.update(files=0, bytes=0, seconds=0.0, mb_per_s=0.0)
+    workers = max(1, workers or HASH_WORKERS)
+    started = time.perf_counter()
+
+    todo = iter(items)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while True:
+                for item in todo:
+                    file_path, known_hash = item if isinstance(item, tuple) else (item, None)
+                    future = executor.submit(_hash_item, file_path, known_hash, buffer_size, use_mmap, max_size)
+                    pending[future] = file_path
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = pending.pop(future)
+                    try:
+                        file_hash, bytes_read = future.result()
+                    except OSError as e:
+                        logger.error(f"Error computing hash for {file_path}: {str(e)}")
+                        yield file_path, None
+                        continue
+                    if bytes_read:
+                        stats["files"] += 1
+                        stats["bytes"] += bytes_read
+                    yield file_path, file_hash
+        finally:
+            for future in pending:
+                future.cancel()
+            stats["seconds"] = time.perf_counter() - started
+            if stats["seconds"] > 0:
+                stats["mb_per_s"] = stats["bytes"] / (1024 * 1024) / stats["seconds"]
+            if stats["files"]:
+                logger.info(
+                    f"Hashed {stats['files']} files ({stats['bytes'] / (1024 * 1024):.1f} MB) "
+                    f"in {stats['seconds']:.2f}s: {stats['mb_per_s']:.1f} MB/s with {workers} worker(s)"
+                )
+
+if __name__ == "__main__":
+    # Measure hashing throughput for a folder, e.g. to tune settings for SD cards vs NVMe:
+    #   python hash_engine.py F:\DCIM 4 1048576 [mmap]
+    folder = sys.argv[1] if len(sys.argv) > 1 else "."
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else HASH_WORKERS
+    buffer_size = int(sys.argv[3]) if len(sys.argv) > 3 else HASH_BUFFER_SIZE
+    use_mmap = len(sys.argv) > 4 and sys.argv[4] == "mmap"
+    hash_cache.HASH_CACHE_ENABLED = False  # Measure real reads, not cache hits
+    paths = [os.path.join(root, name) for root, _, files in os.walk(folder) for name in files]
+    print(f"Hashing {len(paths)} files in {folder} (workers={workers}, buffer={buffer_size}, mmap={use_mmap})...")
+    stats = {}
+    for _ in hash_files(paths, workers, buffer_size, use_mmap, stats):
+        pass
+    print(f"{stats['files']} files, {stats['bytes'] / (1024 * 1024):.1f} MB in {stats['seconds']:.2f}s: "
+          f"{stats['mb_per_s']:.1f} MB/s")
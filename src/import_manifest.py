@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Database configuration
+MANIFEST_DB_PATH = "import_manifest.db"
+
+def source_key(source_folder):
+    """
+    Normalize a source folder path so the same card folder always maps to one manifest.
+
+    Args:
+        source_folder (str): Source folder path (e.g., 'F:\\TestCard\\Photos_2025\\').
+
+    Returns:
+        str: Normalized absolute path.
+    """
+    return os.path.normcase(os.path.abspath(os.path.normpath(source_folder)))
+
+def init_manifest():
+    """
+    Initialize SQLite database with a table of imported files per source folder.
+    """
+    with sqlite3.connect(MANIFEST_DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS imported_files (
+                source TEXT NOT NULL,
+                rel_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                dest_path TEXT,
+                imported_at REAL NOT NULL,
+                PRIMARY KEY (source, rel_path)
+            )
+        """)
+        conn.commit()
+
+def load_manifest(source_folder):
+    """
+    Load the files already imported from source_folder.
+
+    Args:
+        source_folder (str): Source folder path.
+
+    Returns:
+        dict: Maps relative path to (size, mtime_ns, dest_path); empty if no
+              manifest exists or it can't be read.
+    """
+    try:
+        init_manifest()
+        with sqlite3.connect(MANIFEST_DB_PATH) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT rel_path, size, mtime_ns, dest_path FROM imported_files WHERE source = ?",
+                (source_key(source_folder),)
+            )
+            manifest = {rel_path: (size, mtime_ns, dest_path) for rel_path, size, mtime_ns, dest_path in cursor}
+        logger.info(f"Loaded import manifest for {source_folder}: {len(manifest)} files")
+        return manifest
+    except sqlite3.Error as e:
+        logger.error(f"Error loading import manifest for {source_folder}: {str(e)}")
+        return {}
+
+def record_imports(source_folder, entries):
+    """
+    Record finished imports so later runs can skip them.
+
+    Args:
+        source_folder (str): Source folder path.
+        entries (list): Tuples (rel_path, size, mtime_ns, dest_path); dest_path is
+            None for files whose content was already backed up elsewhere.
+
+    Returns:
+        bool: True if recorded, False otherwise.
+    """
+    if not entries:
+        return True
+    try:
+        key = source_key(source_folder)
+        now = time.time()
+        with sqlite3.connect(MANIFEST_DB_PATH) as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT OR REPLACE INTO imported_files "
+                "(source, rel_path, size, mtime_ns, dest_path, imported_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(key, rel_path, size, mtime_ns, dest_path, now)
+                 for rel_path, size, mtime_ns, dest_path in entries]
+            )
+            conn.commit()
+        logger.debug(f"Recorded {len(entries)} imports for {source_folder}")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error recording imports for {source_folder}: {str(e)}")
+        return False
+
+def is_unchanged(manifest, rel_path, size, mtime_ns):
+    """
+    Check if a file was already imported and has not changed since, without opening it.
+
+    Args:
+        manifest (dict): Result of load_manifest.
+        rel_path (str): Path relative to the source folder.
+        size (int): Current file size in bytes.
+        mtime_ns (int): Current modification time in nanoseconds.
+
+    Returns:
+        bool: True if the previous import is still valid, False otherwise.
+    """
+    entry = manifest.get(rel_path)
+    if not entry or entry[0] != size or entry[1] != mtime_ns:
+        return False
+    # The backup copy must still be there (None: content was known and never copied)
+    return entry[2] is None or os.path.exists(entry[2])
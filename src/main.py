@@ -0,0 +1,320 @@
+import os
+import time
+import queue
+import itertools
+import contextlib
+import threading
+import tkinter as tk
+from tkinter import messagebox
+import logging
+from config import PIPELINE_QUEUE_SIZE, UPLOAD_IN_BACKGROUND, PREVIEWS_ENABLED, MANIFEST_BATCH_SIZE
+import file_manager
+import duplicate_checker
+import hash_cache
+import previews
+import cloud_uploader
+import upload_queue
+import storage
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+class StageQueue(queue.Queue):
+    """
+    Bounded queue between two pipeline stages.
+
+    put() blocks while the queue is full, which holds the producing stage back
+    (backpressure). Iterating yields items until the producer calls close().
+    """
+    _DONE = object()
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.finished = False
+
+    def close(self):
+        self.put(self._DONE)
+
+    def __iter__(self):
+        while not self.finished:
+            item = self.get()
+            if item is self._DONE:
+                self.finished = True
+                return
+            yield item
+
+    def discard(self):
+        """Drop remaining items so a failed consumer never leaves its producer blocked."""
+        for _ in self:
+            pass
+
+def _copy_stage(source_folder, out_q, state):
+    """Copy and hash files from the card, passing (dest_path, file_hash) downstream."""
+    try:
+        for dest_path, file_hash in file_manager.iter_copy_and_hash(
+                source_folder, skip_known=duplicate_checker.hash_exists, stats=state["copy_stats"],
+                defer_imports=True):
+            state["copied"] += 1
+            out_q.put((dest_path, file_hash))
+    except Exception as e:
+        logger.error(f"Error in copy stage: {str(e)}")
+        state["errors"].append(f"Copy failed: {str(e)}")
+    finally:
+        out_q.close()
+
+def _dedup_stage(in_q, out_q, state):
+    """
+    Check copied files against the hash database, passing unique files downstream.
+
+    With duplicate_checker.PERCEPTUAL_DEDUP, unique images that look like an
+    archived or earlier image are skipped as duplicates too.
+
+    A unique file is put in the durable upload queue, held in flight for this
+    run, before it is passed on: if the run stops or fails before uploading
+    it, its lease runs out and the background worker uploads it. Only then are
+    checked files recorded in the import manifest, so the next import skips them.
+    """
+    handed_off = []
+    try:
+        checked = duplicate_checker.iter_check_duplicates(in_q)
+        if duplicate_checker.PERCEPTUAL_DEDUP:
+            checked = duplicate_checker.iter_near_duplicates(checked)
+        for file_path, is_duplicate in checked:
+            if is_duplicate:
+                state["duplicate_files"].append(file_path)
+            else:
+                upload_queue.enqueue([file_path], state["folder_name"], state["base_folder"], claim=True,
+                                     source_folder=state["source_folder"])
+            handed_off.append(file_path)
+            if len(handed_off) >= MANIFEST_BATCH_SIZE:
+                file_manager.record_handoffs(state["source_folder"], state["copy_stats"], handed_off)
+                handed_off = []
+            if not is_duplicate:
+                out_q.put(file_path)
+    except Exception as e:
+        logger.error(f"Error in duplicate check stage: {str(e)}")
+        state["errors"].append(f"Duplicate check failed: {str(e)}")
+    finally:
+        file_manager.record_handoffs(state["source_folder"], state["copy_stats"], handed_off)
+        out_q.close()
+        in_q.discard()
+
+def _preview_stage(in_q, out_q, state):
+    """
+    Make previews of unique photos in a process pool, passing each preview
+    downstream just ahead of its original (see previews.iter_previews).
+    """
+    try:
+        for file_path, preview_path in previews.iter_previews(in_q, stats=state["preview_stats"]):
+            if preview_path:
+                state["previews"][preview_path] = file_path
+                out_q.put(preview_path)
+            out_q.put(file_path)
+    except Exception as e:
+        logger.error(f"Error in preview stage: {str(e)}")
+        state["errors"].append(f"Previews failed: {str(e)}")
+    finally:
+        out_q.close()
+        in_q.discard()
+
+def _upload_stage(in_q, state):
+    """
+    Upload unique files and their previews to the storage as they arrive, several at a time.
+
+    Every file is recorded in the durable upload queue before it is uploaded,
+    so files not uploaded when the run ends (failed, or the tool was closed)
+    are picked up by the background worker. With UPLOAD_IN_BACKGROUND, files
+    are only queued. Preview links are kept apart in state["preview_links"].
+    """
+    try:
+        files = iter(in_q)
+        first = next(files, None)
+        if first is None:
+            return  # Nothing to upload: no authentication, no Google libraries loaded
+        files = itertools.chain([first], files)
+        folder_name, base_folder = state["folder_name"], state["base_folder"]
+
+        if UPLOAD_IN_BACKGROUND:
+            for file_path in files:
+                upload_queue.enqueue([file_path], folder_name, base_folder, source_folder=state["source_folder"])
+                state["queued"] += 1
+            return
+
+        # Authenticate while the remaining files are still being copied;
+        # subfolders (MIRROR_FOLDERS) are created by the upload threads as files arrive
+        backend = storage.open_backend(folder_name, base_folder)
+        if not backend:
+            for file_path in files:
+                upload_queue.enqueue([file_path], folder_name, base_folder, source_folder=state["source_folder"])
+                state["queued"] += 1
+            state["errors"].append("Upload failed: could not authenticate or create the upload folder")
+            return
+        state["storage"] = backend.name
+
+        # Files wait in the queue, and go out previews first, then in the order of UPLOAD_SCHEDULING_POLICY
+        with contextlib.closing(upload_queue.iter_scheduled(files, folder_name, base_folder,
+                                                                 source_folder=state["source_folder"])) as jobs:
+            for file_path, result, reused in upload_queue.upload_claimed(jobs, backend):
+                if result and file_path in state["previews"]:
+                    state["preview_links"][state["previews"][file_path]] = result[1]
+                elif result:
+                    state["uploaded_files"].append((file_path, result))
+                    if reused:
+                        state["already_on_drive"] += 1
+                else:
+                    state["upload_failures"] += 1
+    except Exception as e:
+        logger.error(f"Error in upload stage: {str(e)}")
+        state["errors"].append(f"Upload failed: {str(e)}")
+    finally:
+        in_q.discard()
+
+def run_pipeline(source_folder, queue_size=None):
+    """
+    Copy, deduplicate and upload files from source_folder with all stages running concurrently.
+
+    Each stage runs in its own thread and hands files to the next one through a
+    bounded queue, so file N can upload while file N+1 is checked and file N+2
+    copied. Memory use does not grow with the number of files on the card.
+    With PREVIEWS_ENABLED, a preview stage between the check and the upload
+    makes web-sized previews of photos, which upload ahead of the originals.
+
+    Args:
+        source_folder (str): Source folder path (e.g., 'F:\\TestCard\\Photos_2025\\').
+        queue_size (int): Files buffered between stages (default: PIPELINE_QUEUE_SIZE).
+
+    Returns:
+        tuple: (bool, str, list, list)
+            - Success flag (True if every stage completed, False otherwise)
+            - Message summarizing the result
+            - List of tuples (file_name, shareable_link) for uploaded files, or
+              (file_name, shareable_link, preview_link) for photos with an uploaded preview
+            - List of duplicate file paths (for reporting)
+    """
+    if not os.path.exists(source_folder):
+        logger.error(f"Source folder does not exist: {source_folder}")
+        return False, f"Source folder does not exist: {source_folder}", [], []
+
+    queue_size = queue_size or PIPELINE_QUEUE_SIZE
+    copied_q = StageQueue(queue_size)
+    unique_q = StageQueue(queue_size)
+    upload_q = StageQueue(queue_size) if PREVIEWS_ENABLED else unique_q
+    state = {
+        "source_folder": source_folder,
+        "folder_name": os.path.basename(os.path.normpath(source_folder)),
+        "base_folder": file_manager.backup_folder(),
+        "copy_stats": {},
+        "copied": 0,
+        "duplicate_files": [],
+        "uploaded_files": [],  # (file_path, (file_name, link))
+        "previews": {},  # preview_path -> file_path
+        "preview_stats": {},
+        "preview_links": {},  # file_path -> link to its preview
+        "already_on_drive": 0,
+        "storage": "Google Drive",
+        "upload_failures": 0,
+        "queued": 0,
+        "errors": [],
+    }
+
+    # The copy stage looks hashes up (skip_known) before the dedup stage gets to create the tables
+    duplicate_checker.init_database()
+    stages = [
+        threading.Thread(target=_copy_stage, args=(source_folder, copied_q, state), name="copy"),
+        threading.Thread(target=_dedup_stage, args=(copied_q, unique_q, state), name="dedup"),
+        threading.Thread(target=_upload_stage, args=(upload_q, state), name="upload"),
+    ]
+    if PREVIEWS_ENABLED:
+        stages.insert(2, threading.Thread(target=_preview_stage, args=(unique_q, upload_q, state), name="previews"))
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
+    hash_cache.close()
+
+    uploaded_files = []
+    for file_path, (file_name, link) in state["uploaded_files"]:
+        preview_link = state["preview_links"].get(file_path)
+        uploaded_files.append((file_name, link, preview_link) if preview_link else (file_name, link))
+
+    copy_stats = state["copy_stats"]
+    message = (
+        f"Pipeline completed:\n"
+        f"- Files copied: {state['copied']}\n"
+        f"- Already backed up (not copied): {copy_stats.get('skipped', 0) + copy_stats.get('unchanged', 0)}\n"
+        f"- Duplicates skipped: {len(state['duplicate_files'])}\n"
+        f"- Files uploaded: {len(uploaded_files) - state['already_on_drive']}\n"
+        f"- Already in {state['storage']}: {state['already_on_drive']}\n"
+        f"- Upload failures: {state['upload_failures']}"
+    )
+    preview_stats = state["preview_stats"]
+    if preview_stats.get("made") or preview_stats.get("reused"):
+        message += (f"\n- Previews made: {preview_stats['made']} ({preview_stats['embedded']} from RAW), "
+                    f"uploaded: {len(state['preview_links'])}")
+    if state["queued"]:
+        message += f"\n- Queued for background upload: {state['queued']}"
+    request_stats = cloud_uploader.request_stats()
+    if request_stats["throttles"] or request_stats["retries"]:
+        message += (f"\n- Drive requests throttled / retried: "
+                    f"{request_stats['throttles']} / {request_stats['retries']}")
+    for error in state["errors"]:
+        message += f"\n- {error}"
+    logger.info(message)
+    print(message)
+
+    success = not state["errors"]
+    return success, message, uploaded_files, state["duplicate_files"]
+
+def main():
+    """
+    Run the full workflow: detect the card, pick a folder, back up and upload, then email links.
+    """
+    # card_detector needs wmi, which only exists on Windows
+    from card_detector import detect_card
+    from user_prompt import prompt_folder_name
+    from email_sender import send_email, prompt_recipient_email
+
+    detected_path = detect_card()
+    if not detected_path:
+        logger.warning("No card detected, exiting")
+        return
+
+    source_folder = prompt_folder_name(detected_path)
+    if not source_folder:
+        logger.warning("No folder selected, exiting")
+        return
+
+    started = time.time()
+    success, message, uploaded_files, duplicate_files = run_pipeline(source_folder)
+
+    root = tk.Tk()
+    root.withdraw()  # Hide main window
+    if success:
+        messagebox.showinfo("Backup Completed", message)
+    else:
+        messagebox.showerror("Error", message)
+    root.destroy()
+
+    # Links of files still waiting in the queue (queued only, or not uploaded yet) are
+    # emailed by the background worker once they are all uploaded
+    waiting = upload_queue.waiting(source_folder, started)
+    if uploaded_files or waiting:
+        recipient_email = prompt_recipient_email()
+        if recipient_email:
+            sent_links = set()
+            if uploaded_files and send_email(uploaded_files, source_folder, recipient_email)[0]:
+                sent_links = {link for _, *links in uploaded_files for link in links}
+            upload_queue.request_email(source_folder, recipient_email, started, sent_links)
+
+    # Queued and failed uploads (from this run or an earlier one) continue after the tool is closed,
+    # and so do files this run held but never uploaded, once their leases run out.
+    # The worker also fills in full hashes of files recorded with a signature only.
+    queue_counts = upload_queue.counts()
+    if (queue_counts[upload_queue.PENDING] or queue_counts[upload_queue.IN_FLIGHT]
+            or duplicate_checker.count_unverified()):
+        upload_queue.start_background_worker()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import bisect
+import sqlite3
+import tarfile
+import logging
+from config import VIDEO_EXTENSIONS, PACK_MAX_FILE_SIZE, PACK_TARGET_SIZE
+import previews
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Database configuration
+PACK_INDEX_DB_PATH = "pack_index.db"
+PACK_INDEX_NAME = "index.json"  # Last member of every archive: where each of its files sits
+
+def _connect():
+    """Open the pack index database, creating its table on first use."""
+    conn = sqlite3.connect(PACK_INDEX_DB_PATH, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS packed_files (
+            file_path TEXT NOT NULL,
+            storage TEXT NOT NULL,
+            archive_name TEXT NOT NULL,
+            archive_id TEXT NOT NULL,
+            link TEXT,
+            member TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            packed_at REAL NOT NULL,
+            PRIMARY KEY (file_path, storage)
+        )
+    """)
+    return conn
+
+class Archive:
+    """
+    Files bundled into one uncompressed .tar archive that is never written to disk.
+
+    Media files don't compress, and without compression every byte of the
+    archive is known from the file sizes alone: open() returns a seekable
+    stream that reads the files from disk as the archive is uploaded, so it
+    works with resumable and multipart uploads. The last member is an index
+    (PACK_INDEX_NAME) giving the offset and size of every file's data in
+    the archive, so a single file can be fetched with a range request.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.members = []  # (file_path, arcname, size, mtime_ns)
+        self.data_size = 0
+        self.segments = None
+        self.index = None
+        self.size = None
+
+    def add(self, file_path, arcname, stat):
+        """Add a file under arcname; stat is its os.stat() result."""
+        self.members.append((file_path, arcname, stat.st_size, stat.st_mtime_ns))
+        self.data_size += stat.st_size
+
+    def paths(self):
+        """Paths of the files in the archive."""
+        return [file_path for file_path, _, _, _ in self.members]
+
+    def finish(self):
+        """Lay out the archive: no files can be added afterwards."""
+        segments = []  # (offset, length, bytes or file path)
+        index = []
+        offset = 0
+
+        def add_member(name, size, mtime, data):
+            nonlocal offset
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = mtime
+            info.mode = 0o644
+            header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+            segments.append((offset, len(header), header))
+            offset += len(header)
+            data_offset = offset
+            if size:
+                segments.append((offset, size, data))
+                offset += size
+            padding = -size % tarfile.BLOCKSIZE
+            if padding:
+                segments.append((offset, padding, bytes(padding)))
+                offset += padding
+            return data_offset
+
+        for file_path, arcname, size, mtime_ns in self.members:
+            data_offset = add_member(arcname, size, mtime_ns // 1_000_000_000, file_path)
+            index.append({"name": arcname, "offset": data_offset, "size": size})
+        index_data = json.dumps({"archive": self.name, "files": index}, indent=1).encode("utf-8")
+        add_member(PACK_INDEX_NAME, len(index_data), int(time.time()), index_data)
+
+        # End-of-archive marker, padded to a whole record like tarfile does
+        end = 2 * tarfile.BLOCKSIZE
+        end += -(offset + end) % tarfile.RECORDSIZE
+        segments.append((offset, end, bytes(end)))
+        self.segments = segments
+        self.index = index
+        self.size = offset + end
+
+    def open(self):
+        """Return a new ArchiveStream over the finished archive."""
+        return ArchiveStream(self.segments, self.size)
+
+class ArchiveStream(io.RawIOBase):
+    """Read-only, seekable view of an Archive, reading member files from disk on demand."""
+
+    def __init__(self, segments, size):
+        super().__init__()
+        self.segments = segments
+        self.starts = [offset for offset, _, _ in segments]
+        self.size = size
+        self.pos = 0
+        self.file = None  # (path, open file) of the member being read
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        if self.pos >= self.size or not len(view):
+            return 0
+        start, length, source = self.segments[bisect.bisect_right(self.starts, self.pos) - 1]
+        skip = self.pos - start
+        n = min(len(view), length - skip)
+        if isinstance(source, bytes):
+            view[:n] = source[skip:skip + n]
+        else:
+            if self.file is None or self.file[0] != source:
+                self._close_file()
+                self.file = (source, open(source, "rb"))
+            f = self.file[1]
+            f.seek(skip)
+            read = f.readinto(view[:n])
+            if read != n:
+                raise OSError(f"{source} changed size while it was being packed")
+        self.pos += n
+        return n
+
+    def read(self, size=-1):
+        """Read size bytes (fewer only at the end), or the rest of the archive."""
+        remaining = max(0, self.size - self.pos)
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        filled = 0
+        while filled < size:
+            filled += self.readinto(view[filled:])
+        return bytes(buffer)
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file[1].close()
+            self.file = None
+
+    def close(self):
+        self._close_file()
+        super().close()
+
+def _new_archive_name():
+    return f"pack_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.tar"
+
+def pack_files(file_paths, folder_key=None, storage_name=None, target_size=None, max_file_size=None):
+    """
+    Bundle small files into archives while they arrive.
+
+    Files are consumed lazily. Videos, previews (their links are sent out),
+    files over max_file_size and files that can't be read are passed through
+    to be uploaded on their own, and
+    so are files already in an archive in storage_name, to be reused; the
+    rest are collected into an Archive that is yielded once its files add
+    up to target_size, or when file_paths runs out. An archive that would
+    hold a single file is not made: the file is passed through instead.
+
+    Args:
+        file_paths (iterable): Paths of the files to upload.
+        folder_key (callable): Relative directory of a file in the storage
+            (e.g. StorageBackend.folder_key), kept in the member names.
+        storage_name (str): Storage the archives go to (StorageBackend.name), for find_packed.
+        target_size (int): Bytes of files per archive (default: PACK_TARGET_SIZE).
+        max_file_size (int): Largest file that is packed (default: PACK_MAX_FILE_SIZE).
+
+    Yields:
+        str or Archive: A file path to upload on its own, or a finished Archive.
+    """
+    target_size = target_size or PACK_TARGET_SIZE
+    max_file_size = max_file_size or PACK_MAX_FILE_SIZE
+    archive = None
+    arcnames = set()
+
+    def finished():
+        if len(archive.members) == 1:
+            return archive.members[0][0]
+        archive.finish()
+        logger.info(f"Packed {len(archive.members)} files ({archive.data_size} bytes) into {archive.name}")
+        return archive
+
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            yield file_path  # Fails (and is reported) like any other upload
+            continue
+        if (os.path.splitext(file_path)[1].lower() in VIDEO_EXTENSIONS or stat.st_size > max_file_size
+                or previews.is_derivative(file_path) or (storage_name and find_packed(file_path, storage_name))):
+            yield file_path
+            continue
+
+        if archive is None:
+            archive = Archive(_new_archive_name())
+            arcnames.clear()
+        rel_dir = folder_key(file_path) if folder_key else ""
+        file_name = os.path.basename(file_path)
+        stem, ext = os.path.splitext(file_name)
+        arcname, n = "/".join(filter(None, [rel_dir, file_name])), 1
+        while arcname in arcnames:
+            # Same name from another folder (folders not mirrored): keep both
+            arcname, n = "/".join(filter(None, [rel_dir, f"{stem} ({n}){ext}"])), n + 1
+        arcnames.add(arcname)
+        archive.add(file_path, arcname, stat)
+        if archive.data_size >= target_size:
+            yield finished()
+            archive = None
+    if archive is not None:
+        yield finished()
+
+def record_archive(archive, storage_name, archive_id, link):
+    """
+    Record where the files of an uploaded archive are, for locate and find_packed.
+
+    Args:
+        archive (Archive): The uploaded archive.
+        storage_name (str): Name of the storage it was uploaded to (StorageBackend.name).
+        archive_id (str): The archive's file ID in that storage.
+        link (str): Link to the archive.
+    """
+    now = time.time()
+    rows = [(os.path.abspath(file_path), storage_name, archive.name, archive_id, link,
+             entry["name"], entry["offset"], entry["size"], mtime_ns, now)
+            for (file_path, _, _, mtime_ns), entry in zip(archive.members, archive.index)]
+    try:
+        with _connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO packed_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    except sqlite3.Error as e:
+        logger.error(f"Error recording the index of {archive.name}: {str(e)}")
+
+def find_packed(file_path, storage_name):
+    """
+    Return the ID of an archive already holding this file, unchanged since, in the given storage.
+
+    Returns:
+        str: Archive file ID, or None if the file was not packed (or changed since).
+    """
+    try:
+        stat = os.stat(file_path)
+        with _connect() as conn:
+            row = conn.execute(
+                "SELECT archive_id FROM packed_files WHERE file_path = ? AND storage = ? AND size = ? AND mtime_ns = ?",
+                (os.path.abspath(file_path), storage_name, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        return row[0] if row else None
+    except (OSError, sqlite3.Error):
+        return None
+
+def locate(file_path):
+    """
+    Find the archives a file was uploaded in.
+
+    Args:
+        file_path (str): Path of the file in the backup folder.
+
+    Returns:
+        list: Dicts with 'storage', 'archive', 'link', 'member', 'offset' and 'size':
+              the file's data is bytes offset to offset + size - 1 of the archive.
+    """
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT storage, archive_name, link, member, offset, size FROM packed_files WHERE file_path = ?",
+            (os.path.abspath(file_path),)
+        ).fetchall()
+    return [dict(zip(("storage", "archive", "link", "member", "offset", "size"), row)) for row in rows]
+
+if __name__ == "__main__":
+    # Show where packed files are, e.g.: python packer.py C:\Media_Backup\Photos_2025\IMG_0001.jpg
+    for path in sys.argv[1:]:
+        locations = locate(path)
+        if not locations:
+            print(f"{path}: not packed")
+        for location in locations:
+            print(f"{path}: {location['member']} in {location['archive']} ({location['storage']}), "
+                  f"bytes {location['offset']}-{location['offset'] + location['size'] - 1}: {location['link']}")
@@ -0,0 +1,202 @@
+import os
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Formats Pillow can decode; RAW files (.cr2, .nef) are skipped
+PERCEPTUAL_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+def dhash(file_path, hash_size=8):
+    """
+    Compute a 64-bit difference hash (dHash) of an image.
+
+    The image is decoded at reduced size (JPEG draft mode), converted to
+    grayscale and shrunk to (hash_size + 1) x hash_size; each bit records
+    whether a pixel is brighter than its right neighbour. Re-saved, resized
+    or recompressed copies of a photo end up a few bits apart.
+
+    Args:
+        file_path (str): Path to the image.
+        hash_size (int): Bits per row and number of rows (8 gives 64 bits).
+
+    Returns:
+        int: Fingerprint, or None if Pillow is missing or the image can't be read.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.error("Pillow is not installed; perceptual hashing is unavailable")
+        return None
+
+    try:
+        with Image.open(file_path) as img:
+            img.draft("L", (hash_size * 8, hash_size * 8))
+            resample = getattr(Image, "Resampling", Image).LANCZOS
+            small = img.convert("L").resize((hash_size + 1, hash_size), resample)
+            pixels = small.tobytes()
+    except Exception as e:
+        logger.error(f"Error computing perceptual hash for {file_path}: {str(e)}")
+        return None
+
+    fingerprint = 0
+    width = hash_size + 1
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * width + col]
+            right = pixels[row * width + col + 1]
+            fingerprint = (fingerprint << 1) | (left > right)
+    return fingerprint
+
+def hamming_distance(a, b):
+    """Number of differing bits between two fingerprints."""
+    return bin(a ^ b).count("1")
+
+def to_signed(fingerprint):
+    """Map an unsigned 64-bit fingerprint to SQLite's signed INTEGER range."""
+    return fingerprint - (1 << 64) if fingerprint >= (1 << 63) else fingerprint
+
+def to_unsigned(value):
+    """Inverse of to_signed."""
+    return value + (1 << 64) if value < 0 else value
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance.
+
+    Each child edge is labelled with its distance to the parent, so a search
+    for everything within k of a query only descends into edges labelled
+    d - k .. d + k (triangle inequality), skipping most of the tree.
+    """
+
+    def __init__(self):
+        self.root = None  # [fingerprint, items, {distance: child}]
+        self.size = 0
+
+    def add(self, fingerprint, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [fingerprint, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(fingerprint, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [fingerprint, [item], {}]
+                return
+            node = child
+
+    def search(self, fingerprint, max_distance):
+        """
+        Find all items within max_distance of fingerprint.
+
+        Returns:
+            list: Tuples (distance, item), closest first.
+        """
+        results = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(fingerprint, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda result: result[0])
+        return results
+
+def load_tree(cursor):
+    """
+    Load the stored fingerprints into a BK-tree.
+
+    Args:
+        cursor: Cursor on the hash database (with the perceptual_hashes table).
+
+    Returns:
+        BKTree: Tree of fingerprints, with the archived file paths as items.
+    """
+    tree = BKTree()
+    for file_path, value in cursor.execute("SELECT file_path, fingerprint FROM perceptual_hashes"):
+        tree.add(to_unsigned(value), file_path)
+    logger.info(f"Loaded {tree.size} perceptual fingerprints")
+    return tree
+
+def match_image(tree, file_path, max_distance):
+    """
+    Check one file against the tree, adding it if it is an image with no near duplicate.
+
+    Args:
+        tree (BKTree): Fingerprints from load_tree and of images kept so far.
+        file_path (str): File to check; non-images are kept as-is.
+        max_distance (int): Maximum Hamming distance counted as a near duplicate.
+
+    Returns:
+        tuple: (matched_path, distance, fingerprint)
+            - Closest look-alike, or None if the file is kept
+            - Hamming distance to it, or None
+            - Fingerprint to record for a kept image, or None
+    """
+    if os.path.splitext(file_path)[1].lower() not in PERCEPTUAL_EXTENSIONS:
+        return None, None, None
+    fingerprint = dhash(file_path)
+    if fingerprint is None:
+        return None, None, None
+
+    matches = tree.search(fingerprint, max_distance)
+    if matches:
+        distance, matched_path = matches[0]
+        logger.info(f"Near duplicate found: {file_path} (matches {matched_path}, distance {distance})")
+        print(f"Near duplicate found: {file_path}")
+        return matched_path, distance, None
+
+    tree.add(fingerprint, file_path)
+    return None, None, fingerprint
+
+def check_near_duplicates(cursor, media_files, max_distance):
+    """
+    Find images that look like an archived image or an earlier image in media_files.
+
+    Stored fingerprints are loaded from the perceptual_hashes table into a
+    BK-tree; fingerprints of kept images are added to the table. Near
+    duplicates are not recorded, like exact duplicates.
+
+    Args:
+        cursor: Cursor on the hash database (with the perceptual_hashes table).
+        media_files (list): File paths to check; non-images are kept as-is.
+        max_distance (int): Maximum Hamming distance counted as a near duplicate.
+
+    Returns:
+        tuple: (list, list, list)
+            - File paths kept (no near duplicate, or not an image)
+            - Tuples (file_path, matched_path, distance) for near duplicates
+            - Clusters: lists of file paths that look alike, each starting with
+              the archived or first-seen image the others matched
+    """
+    tree = load_tree(cursor)
+    kept_files = []
+    near_duplicates = []
+    clusters = {}
+    inserts = []
+    for file_path in media_files:
+        matched_path, distance, fingerprint = match_image(tree, file_path, max_distance)
+        if matched_path:
+            near_duplicates.append((file_path, matched_path, distance))
+            clusters.setdefault(matched_path, [matched_path]).append(file_path)
+            continue
+        if fingerprint is not None:
+            inserts.append((file_path, to_signed(fingerprint)))
+        kept_files.append(file_path)
+
+    record_fingerprints(cursor, inserts)
+    return kept_files, near_duplicates, list(clusters.values())
+
+def record_fingerprints(cursor, inserts):
+    """Store tuples (file_path, signed fingerprint) of kept images."""
+    cursor.executemany("INSERT OR REPLACE INTO perceptual_hashes (file_path, fingerprint) VALUES (?, ?)", inserts)
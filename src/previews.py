@@ -0,0 +1,353 @@
+import io
+import os
+import sys
+import time
+import struct
+import tempfile
+import multiprocessing
+import logging
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from config import (SUPPORTED_EXTENSIONS, VIDEO_EXTENSIONS, RAW_EXTENSIONS, PREVIEW_FOLDER, PREVIEW_SIZE,
+                    THUMBNAIL_SIZE, PREVIEW_QUALITY, PREVIEW_WORKERS)
+import file_manager
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FOLDER = "thumbnails"  # Subfolder of the preview folder holding thumbnails
+
+# TIFF tags used to find the JPEG previews embedded in CR2 and NEF files (both are TIFF based)
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_ORIENTATION = 0x0112
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+TIFF_TYPES = {1: "B", 3: "H", 4: "I", 7: "B", 13: "I"}  # BYTE, SHORT, LONG, UNDEFINED, IFD
+TIFF_TYPE_SIZES = {"B": 1, "H": 2, "I": 4}
+MAX_IFDS = 32  # Directories followed per file, against loops in damaged files
+
+# Orientation tag value -> Pillow transpose method name (as in PIL.ImageOps.exif_transpose)
+ORIENTATION_TRANSPOSE = {2: "FLIP_LEFT_RIGHT", 3: "ROTATE_180", 4: "FLIP_TOP_BOTTOM", 5: "TRANSPOSE",
+                         6: "ROTATE_270", 7: "TRANSVERSE", 8: "ROTATE_90"}
+
+def has_preview(file_path):
+    """True if previews are made for the file: supported photos (JPEG, PNG, RAW), not videos."""
+    ext = os.path.splitext(file_path)[1].lower()
+    return ext in SUPPORTED_EXTENSIONS and ext not in VIDEO_EXTENSIONS
+
+def preview_folder():
+    """Return the folder previews are written to (PREVIEW_FOLDER in the backup folder)."""
+    return os.path.join(file_manager.backup_folder(), PREVIEW_FOLDER)
+
+def is_derivative(file_path):
+    """True if file_path is a preview or thumbnail, not an original."""
+    rel_path = os.path.relpath(os.path.abspath(file_path), os.path.abspath(preview_folder()))
+    return not rel_path.startswith("..") and not os.path.isabs(rel_path)
+
+def derivative_paths(file_path, folder=None):
+    """
+    Paths of the preview and thumbnail of a file.
+
+    They keep the file's subfolder of the backup and its full name, so the
+    previews of IMG_0001.CR2 and IMG_0001.JPG (RAW + JPEG) don't collide.
+
+    Args:
+        file_path (str): Path of the file in the backup folder.
+        folder (str): Folder of the previews (default: preview_folder()).
+
+    Returns:
+        tuple: (preview_path, thumbnail_path)
+    """
+    rel_dir = os.path.relpath(os.path.dirname(os.path.abspath(file_path)), os.path.abspath(file_manager.backup_folder()))
+    if rel_dir == "." or rel_dir.startswith(".."):
+        rel_dir = ""
+    name = os.path.basename(file_path) + ".jpg"
+    folder = os.path.join(folder or preview_folder(), rel_dir)
+    return os.path.join(folder, name), os.path.join(folder, THUMBNAIL_FOLDER, name)
+
+def _read_ifd(f, endian, offset):
+    """Read a TIFF directory: returns ({tag: [values]}, offset of the next directory)."""
+    f.seek(offset)
+    count = struct.unpack(endian + "H", f.read(2))[0]
+    data = f.read(12 * count)
+    next_raw = f.read(4)
+    entries = {}
+    for i in range(min(count, len(data) // 12)):
+        tag, type_, n, raw = struct.unpack(endian + "HHI4s", data[i * 12:(i + 1) * 12])
+        fmt = TIFF_TYPES.get(type_)
+        if fmt is None or n > 4096:
+            continue
+        size = n * TIFF_TYPE_SIZES[fmt]
+        if size <= 4:
+            buffer = raw[:size]
+        else:
+            f.seek(struct.unpack(endian + "I", raw)[0])
+            buffer = f.read(size)
+            if len(buffer) < size:
+                continue
+        entries[tag] = list(struct.unpack(endian + fmt * n, buffer))
+    next_offset = struct.unpack(endian + "I", next_raw)[0] if len(next_raw) == 4 else 0
+    return entries, next_offset
+
+def _is_lossy_jpeg(f, offset):
+    """True if the data at offset is a baseline or progressive JPEG (not the lossless JPEG of RAW sensor data)."""
+    f.seek(offset)
+    if f.read(2) != b"\xff\xd8":
+        return False
+    for _ in range(64):
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return False
+        if marker[1] in (0xC0, 0xC1, 0xC2):
+            return True
+        if 0xC3 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+            return False  # Lossless, hierarchical or arithmetic coding
+        f.seek(struct.unpack(">H", marker[2:])[0] - 2, os.SEEK_CUR)
+    return False
+
+def extract_embedded_preview(file_path):
+    """
+    Find the largest JPEG preview embedded in a TIFF-based RAW file (CR2, NEF, ...).
+
+    Cameras store a full-size or near full-size JPEG next to the sensor data;
+    extracting it reads a few megabytes instead of decoding the RAW file.
+
+    Args:
+        file_path (str): Path to the RAW file.
+
+    Returns:
+        tuple: (bytes, int) - the JPEG data and the file's orientation tag (1 if
+               missing), or (None, 1) if the file holds no usable preview.
+    """
+    with open(file_path, "rb") as f:
+        header = f.read(8)
+        if header[:4] not in (b"II*\x00", b"MM\x00*"):
+            return None, 1
+        endian = "<" if header[:2] == b"II" else ">"
+        todo = [struct.unpack(endian + "I", header[4:])[0]]
+        seen = set()
+        orientation = 1
+        candidates = []  # (length, offset)
+        while todo and len(seen) < MAX_IFDS:
+            offset = todo.pop(0)
+            if not offset or offset in seen:
+                continue
+            seen.add(offset)
+            try:
+                entries, next_offset = _read_ifd(f, endian, offset)
+            except struct.error:
+                continue
+            if len(seen) == 1 and entries.get(TAG_ORIENTATION):
+                orientation = entries[TAG_ORIENTATION][0]
+            todo.append(next_offset)
+            todo.extend(entries.get(TAG_SUB_IFDS, []))
+            if TAG_JPEG_OFFSET in entries and TAG_JPEG_LENGTH in entries:
+                candidates.append((entries[TAG_JPEG_LENGTH][0], entries[TAG_JPEG_OFFSET][0]))
+            elif (entries.get(TAG_COMPRESSION, [None])[0] in (6, 7) and len(entries.get(TAG_STRIP_OFFSETS, [])) == 1
+                  and len(entries.get(TAG_STRIP_BYTE_COUNTS, [])) == 1):
+                candidates.append((entries[TAG_STRIP_BYTE_COUNTS][0], entries[TAG_STRIP_OFFSETS][0]))
+
+        for length, offset in sorted(candidates, reverse=True):
+            if _is_lossy_jpeg(f, offset):
+                f.seek(offset)
+                return f.read(length), orientation
+    return None, 1
+
+def _open_raw(file_path):
+    """
+    Open a RAW file as a Pillow image: its embedded preview, else (with rawpy) a half-size decode.
+
+    Returns:
+        tuple: (PIL.Image, str, int) - the image, its source ("embedded" or "decoded")
+               and the RAW file's orientation tag.
+    """
+    from PIL import Image
+
+    data, orientation = extract_embedded_preview(file_path)
+    if data is None:
+        try:
+            import rawpy
+        except ImportError:
+            raise ValueError("no embedded preview found (install rawpy to decode RAW files without one)")
+        with rawpy.imread(file_path) as raw:
+            try:
+                thumb = raw.extract_thumb()
+                if thumb.format == rawpy.ThumbFormat.JPEG:
+                    # LibRaw's flip (0, 3, 5, 6) as an orientation tag
+                    return Image.open(io.BytesIO(thumb.data)), "embedded", {3: 3, 5: 8, 6: 6}.get(raw.sizes.flip, 1)
+            except rawpy.LibRawError:
+                pass
+            # postprocess() applies the orientation itself
+            return Image.fromarray(raw.postprocess(half_size=True, use_camera_wb=True)), "decoded", 1
+    return Image.open(io.BytesIO(data)), "embedded", orientation
+
+def _save_jpeg(img, path, quality):
+    """Write a JPEG atomically, so a half-written preview is never uploaded."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = path + ".part"
+    img.save(partial_path, "JPEG", quality=quality, optimize=True, progressive=True)
+    os.replace(partial_path, path)
+
+def make_derivatives(file_path, preview_path, thumbnail_path=None, preview_size=None, thumbnail_size=None,
+                     quality=None):
+    """
+    Write the web-sized JPEG preview (and thumbnail) of a photo.
+
+    Runs in a worker process (see iter_previews). RAW files use their embedded
+    JPEG preview; JPEGs are decoded at reduced size (draft mode). The
+    orientation is applied and metadata is dropped.
+
+    Args:
+        file_path (str): Path to the photo.
+        preview_path (str): Where to write the preview.
+        thumbnail_path (str): Where to write the thumbnail, or None for none.
+        preview_size (int): Longest edge of the preview (default: PREVIEW_SIZE).
+        thumbnail_size (int): Longest edge of the thumbnail (default: THUMBNAIL_SIZE).
+        quality (int): JPEG quality (default: PREVIEW_QUALITY).
+
+    Returns:
+        str: Source of the preview: "embedded" (RAW preview), "decoded" (full RAW decode) or "image".
+
+    Raises:
+        Exception: If the photo can't be read or the preview can't be written.
+    """
+    from PIL import Image
+
+    preview_size = preview_size or PREVIEW_SIZE
+    thumbnail_size = THUMBNAIL_SIZE if thumbnail_size is None else thumbnail_size
+    quality = quality or PREVIEW_QUALITY
+
+    if os.path.splitext(file_path)[1].lower() in RAW_EXTENSIONS:
+        img, source, orientation = _open_raw(file_path)
+    else:
+        img, source, orientation = Image.open(file_path), "image", 1
+    with img:
+        # An embedded RAW preview usually has no orientation of its own: the RAW file's applies
+        orientation = img.getexif().get(TAG_ORIENTATION) or orientation
+        img.draft("RGB", (preview_size, preview_size))  # JPEG: decode at 1/2, 1/4 or 1/8 scale
+        preview = img.convert("RGB")
+    if orientation in ORIENTATION_TRANSPOSE:
+        preview = preview.transpose(getattr(getattr(Image, "Transpose", Image), ORIENTATION_TRANSPOSE[orientation]))
+    resample = getattr(Image, "Resampling", Image).LANCZOS
+    preview.thumbnail((preview_size, preview_size), resample)
+    _save_jpeg(preview, preview_path, quality)
+    if thumbnail_path and thumbnail_size:
+        preview.thumbnail((thumbnail_size, thumbnail_size), resample)
+        _save_jpeg(preview, thumbnail_path, quality)
+    return source
+
+def iter_previews(file_paths, workers=None, stats=None, folder=None):
+    """
+    Make previews of photos in a pool of processes, yielding each file as soon as its preview is ready.
+
+    Files are consumed lazily with at most two per process in flight, so
+    file_paths can be a pipeline queue. Files without previews (videos) are
+    yielded right away; a preview newer than its photo is reused. The
+    processes are only started once the first photo arrives.
+
+    Args:
+        file_paths (iterable): Paths of the files (in the backup folder).
+        workers (int): Number of processes (default: PREVIEW_WORKERS, or one per CPU core).
+        stats (dict): If given, filled with counts: 'made', 'embedded', 'reused' and 'failed'.
+        folder (str): Folder of the previews (default: preview_folder()).
+
+    Yields:
+        tuple: (file_path, preview_path) - preview_path is None if the file has
+               no preview or making it failed.
+    """
+    workers = max(1, workers or PREVIEW_WORKERS or os.cpu_count() or 1)
+    stats = stats if stats is not None else {}
+    for key in ("made", "embedded", "reused", "failed"):
+        stats.setdefault(key, 0)
+    executor = None
+    pending = {}
+    todo = iter(file_paths)
+    try:
+        while True:
+            for file_path in todo:
+                if not has_preview(file_path):
+                    yield file_path, None
+                    continue
+                preview_path, thumbnail_path = derivative_paths(file_path, folder)
+                try:
+                    if os.path.getmtime(preview_path) >= os.path.getmtime(file_path):
+                        stats["reused"] += 1
+                        yield file_path, preview_path
+                        continue
+                except OSError:
+                    pass  # No preview yet
+                if executor is None:
+                    # spawn everywhere, as on Windows: forking a process that runs threads isn't safe
+                    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                future = executor.submit(make_derivatives, file_path, preview_path, thumbnail_path)
+                pending[future] = (file_path, preview_path)
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path, preview_path = pending.pop(future)
+                try:
+                    source = future.result()
+                except Exception as e:
+                    stats["failed"] += 1
+                    logger.warning(f"No preview for {os.path.basename(file_path)}: {str(e)}")
+                    yield file_path, None
+                    continue
+                stats["made"] += 1
+                stats["embedded"] += source == "embedded"
+                logger.info(f"Made preview of {os.path.basename(file_path)} ({source})")
+                yield file_path, preview_path
+    finally:
+        if executor is not None:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+
+def benchmark(file_paths, workers=None):
+    """
+    Measure preview throughput, in images per second and per core.
+
+    Previews are written to a temporary folder and discarded.
+
+    Args:
+        file_paths (list): Photos to make previews of.
+        workers (int): Number of processes (default: PREVIEW_WORKERS, or one per CPU core).
+
+    Returns:
+        dict: 'images', 'embedded', 'failed', 'workers', 'seconds', 'images_per_s'
+              and 'images_per_s_per_core'.
+    """
+    workers = max(1, workers or PREVIEW_WORKERS or os.cpu_count() or 1)
+    stats = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        started = time.perf_counter()
+        for _ in iter_previews([path for path in file_paths if has_preview(path)], workers, stats, scratch):
+            pass
+        seconds = time.perf_counter() - started
+    images_per_s = stats["made"] / seconds if seconds > 0 else 0.0
+    result = {"images": stats["made"], "embedded": stats["embedded"], "failed": stats["failed"],
+              "workers": workers, "seconds": seconds, "images_per_s": images_per_s,
+              "images_per_s_per_core": images_per_s / min(workers, os.cpu_count() or workers)}
+    logger.info(f"Made {result['images']} previews with {workers} process(es) in {seconds:.2f}s: "
+                f"{images_per_s:.1f} images/s, {result['images_per_s_per_core']:.1f} per core")
+    return result
+
+if __name__ == "__main__":
+    # Measure preview throughput for a folder of photos with 1, 2, ... processes, e.g.:
+    #   python previews.py C:\Media_Backup\Photos_2025 1,2,4,8
+    folder = sys.argv[1] if len(sys.argv) > 1 else "."
+    counts = [int(n) for n in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1, os.cpu_count() or 1]
+    paths = [os.path.join(root, name) for root, _, files in os.walk(folder) for name in files]
+    print(f"Making previews of {len([path for path in paths if has_preview(path)])} photos in {folder}...")
+    for count in counts:
+        result = benchmark(paths, count)
+        print(f"{count} process(es): {result['images']} images ({result['embedded']} from embedded RAW previews, "
+              f"{result['failed']} failed) in {result['seconds']:.2f}s: {result['images_per_s']:.1f} images/s, "
+              f"{result['images_per_s_per_core']:.1f} images/s per core")
@@ -0,0 +1,274 @@
+import ssl
+import time
+import random
+import socket
+import http.client
+import threading
+import logging
+from config import (DRIVE_REQUESTS_PER_SECOND, DRIVE_BURST, DRIVE_MAX_CONCURRENCY, DRIVE_MAX_RETRIES,
+                    DRIVE_BACKOFF_BASE, DRIVE_BACKOFF_MAX, UPLOAD_MAX_BYTES_PER_SECOND)
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: rate limits and transient server errors
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# 403 reasons Drive uses for rate limits (other 403s, e.g. no permission, are final)
+RATE_LIMIT_REASONS = ("ratelimitexceeded", "userratelimitexceeded", "sharingratelimitexceeded")
+# Errors of the connection itself; other OSErrors (a file that can't be read, a full disk) are final
+NETWORK_ERRORS = (ConnectionError, socket.timeout, TimeoutError, socket.gaierror, ssl.SSLError,
+                  http.client.HTTPException)
+
+# Process-wide limiter shared by every Drive request (see get_drive_limiter)
+_drive_limiter = None
+_drive_limiter_lock = threading.Lock()
+_bandwidth_limiter = None
+
+def classify_error(error):
+    """
+    Decide if a failed API call should be retried.
+
+    Works on googleapiclient HttpError (and anything with a similar .resp) and
+    on network errors, without importing the Google libraries. Local I/O
+    errors, e.g. from reading the file being uploaded, are not retried.
+
+    Args:
+        error (Exception): The exception raised by the call.
+
+    Returns:
+        tuple: (bool, bool, float)
+            - True if the call can be retried
+            - True if the server asked us to slow down (429, 403 rate limit)
+            - Seconds the server asked to wait (Retry-After), or None
+    """
+    resp = getattr(error, "resp", None)
+    status = getattr(resp, "status", None)
+    if status is None:
+        # No HTTP response: dropped connection, timeout, DNS hiccup (httplib2 raises its own)
+        retryable = isinstance(error, NETWORK_ERRORS) or any(
+            cls.__name__ == "HttpLib2Error" for cls in type(error).__mro__)
+        return retryable, False, None
+
+    retry_after = None
+    try:
+        header = resp.get("retry-after") if hasattr(resp, "get") else None
+        retry_after = float(header) if header is not None else None
+    except (TypeError, ValueError):
+        pass  # HTTP-date form; fall back to the computed backoff
+
+    content = getattr(error, "content", b"") or b""
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", "replace")
+    rate_limited = status == 429 or (status == 403 and any(reason in content.lower() for reason in RATE_LIMIT_REASONS))
+    return rate_limited or status in RETRYABLE_STATUSES, rate_limited, retry_after
+
+class RateLimiter:
+    """
+    Shared limiter for API requests from any number of threads.
+
+    - A token bucket caps the request rate (rate per second, bursts up to burst).
+    - An AIMD window caps requests in flight: it grows by one after a window's
+      worth of successes and halves when the server throttles us, so it settles
+      near the highest concurrency the server sustains.
+    - Retryable failures are retried with exponential backoff and full jitter;
+      a Retry-After from the server is honoured.
+
+    stats counts requests, throttles (429 / rate-limit 403), retries and
+    failures (calls given up on), and holds the current concurrency window.
+    """
+
+    def __init__(self, rate=10.0, burst=20, max_concurrency=8, min_concurrency=1, max_retries=6,
+                 base_delay=1.0, max_delay=64.0, clock=time.monotonic, sleep=time.sleep, rand=random.random):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.rand = rand
+
+        self.condition = threading.Condition()
+        self.tokens = float(burst)
+        self.refilled_at = clock()
+        self.window = float(max_concurrency)
+        self.in_flight = 0
+        self.successes = 0
+        self.stats = {"requests": 0, "throttles": 0, "retries": 0, "failures": 0,
+                      "concurrency": max_concurrency}
+
+    def _take_tokens(self, cost):
+        """
+        Wait for a token, then take cost tokens; returns without holding the condition lock.
+
+        A request costing more than the bucket holds (a batch) drives it into
+        debt, which the following requests wait out.
+        """
+        while True:
+            with self.condition:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+                self.refilled_at = now
+                if self.tokens >= 1:
+                    self.tokens -= cost
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+    def acquire(self, cost=1):
+        """Block until a request may be sent (tokens and a concurrency slot)."""
+        self._take_tokens(cost)
+        with self.condition:
+            while self.in_flight >= int(self.window):
+                self.condition.wait()
+            self.in_flight += 1
+            self.stats["requests"] += 1
+
+    def release(self, throttled=False):
+        """Free the slot of a finished request and adapt the concurrency window."""
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled()
+            else:
+                self.successes += 1
+                if self.successes >= self.window and self.window < self.max_concurrency:
+                    self.window += 1  # Additive increase, once per window of successes
+                    self.successes = 0
+                    self.stats["concurrency"] = int(self.window)
+            self.condition.notify_all()
+
+    def throttled(self):
+        """Record a throttle response (also for calls made outside call(), e.g. inside a batch)."""
+        with self.condition:
+            self.stats["throttles"] += 1
+            self.window = max(self.min_concurrency, self.window / 2)  # Multiplicative decrease
+            self.successes = 0
+            self.stats["concurrency"] = int(self.window)
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retry number attempt (1-based)."""
+        delay = self.rand() * min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, func, *args, cost=1, **kwargs):
+        """
+        Run func(*args, **kwargs) under the limiter, retrying retryable failures.
+
+        Args:
+            func (callable): The request, e.g. an HttpRequest's execute method.
+            cost (int): Tokens the request uses, e.g. the number of calls in a batch.
+
+        Returns:
+            Whatever func returns.
+
+        Raises:
+            Exception: The last error if it isn't retryable or retries ran out.
+        """
+        attempt = 0
+        while True:
+            self.acquire(cost)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                retryable, rate_limited, retry_after = classify_error(e)
+                self.release(throttled=rate_limited)
+                attempt += 1
+                if not retryable or attempt > self.max_retries:
+                    if retryable:
+                        with self.condition:
+                            self.stats["failures"] += 1
+                    raise
+                delay = self.backoff(attempt, retry_after)
+                with self.condition:
+                    self.stats["retries"] += 1
+                logger.warning(f"Request failed ({str(e)}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                self.sleep(delay)
+                continue
+            self.release()
+            return result
+
+class BandwidthLimiter:
+    """
+    Cap on the bytes per second sent by all upload threads together.
+
+    Each upload request or chunk is charged before it is sent: a caller waits
+    while earlier ones are still "in debt", then adds its own bytes to the debt.
+    The rate can be changed (or lifted with 0) at any time with set_rate;
+    waiting threads pick the new rate up within wait_slice seconds.
+    """
+
+    def __init__(self, rate=0, clock=time.monotonic, sleep=time.sleep, wait_slice=0.5):
+        self.rate = rate or 0
+        self.clock = clock
+        self.sleep = sleep
+        self.wait_slice = wait_slice
+        self.lock = threading.Lock()
+        self.allowance = 0.0  # Bytes that may be sent now; negative while in debt
+        self.updated_at = clock()
+        self.sent = 0
+
+    def set_rate(self, rate):
+        """Change the cap (bytes per second); 0 or None removes it."""
+        with self.lock:
+            self._refill()
+            self.rate = rate or 0
+            if not self.rate:
+                self.allowance = 0.0
+        logger.info(f"Upload bandwidth cap set to {self.rate or 'unlimited'} bytes/s")
+
+    def _refill(self):
+        now = self.clock()
+        if self.rate:
+            self.allowance = min(self.rate, self.allowance + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def consume(self, nbytes):
+        """Wait until nbytes may be sent under the cap."""
+        while True:
+            with self.lock:
+                self._refill()
+                if not self.rate or self.allowance >= 0:
+                    if self.rate:
+                        self.allowance -= nbytes
+                    self.sent += nbytes
+                    return
+                wait = min(self.wait_slice, -self.allowance / self.rate)
+            self.sleep(wait)
+
+def get_bandwidth_limiter():
+    """
+    Return the process-wide upload bandwidth limiter, capped at UPLOAD_MAX_BYTES_PER_SECOND on first use.
+
+    Returns:
+        BandwidthLimiter: The shared limiter.
+    """
+    global _bandwidth_limiter
+    with _drive_limiter_lock:
+        if _bandwidth_limiter is None:
+            _bandwidth_limiter = BandwidthLimiter(UPLOAD_MAX_BYTES_PER_SECOND)
+        return _bandwidth_limiter
+
+def get_drive_limiter():
+    """
+    Return the process-wide limiter for Google Drive requests, built from the config on first use.
+
+    Every thread and every Drive client shares it, so the request rate and the
+    concurrency window apply to the whole process.
+
+    Returns:
+        RateLimiter: The shared limiter.
+    """
+    global _drive_limiter
+    with _drive_limiter_lock:
+        if _drive_limiter is None:
+            _drive_limiter = RateLimiter(DRIVE_REQUESTS_PER_SECOND, DRIVE_BURST, DRIVE_MAX_CONCURRENCY,
+                                         max_retries=DRIVE_MAX_RETRIES, base_delay=DRIVE_BACKOFF_BASE,
+                                         max_delay=DRIVE_BACKOFF_MAX)
+        return _drive_limiter
@@ -0,0 +1,131 @@
+import os
+import logging
+from config import VIDEO_EXTENSIONS, UPLOAD_SCHEDULING_POLICY, UPLOAD_AGING_BYTES_PER_SECOND
+import previews
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# A scheduling policy maps (size, file_path, age) to a sort key: files with the
+# smallest key upload first. age is the number of seconds the file has waited.
+
+def fifo(size, file_path, age):
+    """Upload files in the order they were queued."""
+    return -age
+
+def small_first(size, file_path, age):
+    """Upload the smallest files first, so most links are ready soon."""
+    return size
+
+def sjf_aging(size, file_path, age):
+    """
+    Shortest job first with aging: small files first, but a waiting file counts
+    UPLOAD_AGING_BYTES_PER_SECOND smaller per second, so a large video isn't
+    starved by a stream of new photos.
+    """
+    return size - age * UPLOAD_AGING_BYTES_PER_SECOND
+
+def photos_first(size, file_path, age):
+    """Upload photos before videos, the smallest first within each."""
+    is_video = os.path.splitext(file_path)[1].lower() in VIDEO_EXTENSIONS
+    return (2 ** 62 if is_video else 0) + size
+
+# The built-in policies as ORDER BY terms over the upload_jobs columns (size,
+# is_video, enqueued_at), so upload_queue.claim sorts in SQLite instead of
+# calling back into Python for every waiting job. Takes the current time.
+_SQL_ORDER = {
+    fifo: lambda now: ("enqueued_at", []),
+    small_first: lambda now: ("size", []),
+    sjf_aging: lambda now: ("size - (? - enqueued_at) * ?", [now, UPLOAD_AGING_BYTES_PER_SECOND]),
+    photos_first: lambda now: ("is_video, size", []),
+}
+
+SCHEDULING_POLICIES = {
+    "fifo": fifo,
+    "small_first": small_first,
+    "sjf_aging": sjf_aging,
+    "photos_first": photos_first,
+}
+
+def register_policy(name, policy):
+    """
+    Add a scheduling policy, selectable by name with UPLOAD_SCHEDULING_POLICY.
+
+    Args:
+        name (str): Policy name.
+        policy (callable): Function (size, file_path, age) -> number; smaller uploads first.
+    """
+    SCHEDULING_POLICIES[name] = policy
+
+def get_policy(policy=None):
+    """
+    Return a scheduling policy function.
+
+    Args:
+        policy (str or callable): Policy name, a policy function, or None for
+            UPLOAD_SCHEDULING_POLICY. An unknown name falls back to fifo.
+
+    Returns:
+        callable: Function (size, file_path, age) -> sort key.
+    """
+    if callable(policy):
+        return policy
+    name = policy or UPLOAD_SCHEDULING_POLICY
+    if name not in SCHEDULING_POLICIES:
+        logger.warning(f"Unknown upload scheduling policy '{name}', uploading in queue order")
+        return fifo
+    return SCHEDULING_POLICIES[name]
+
+def sql_order(policy=None, now=0):
+    """
+    Return ORDER BY terms equivalent to a built-in scheduling policy.
+
+    Args:
+        policy (str or callable): See get_policy.
+        now (float): Current time, for policies that age waiting jobs.
+
+    Returns:
+        tuple: (str, list) the terms and their parameters, or None for a
+            policy that only exists as a Python function (e.g. one added with register_policy).
+    """
+    order = _SQL_ORDER.get(get_policy(policy))
+    return order(now) if order else None
+
+def previews_first(key):
+    """
+    Wrap a policy so previews (see previews.is_derivative) upload before any
+    original, whatever the policy, and the links sent out work soonest.
+
+    Args:
+        key (callable): Policy function (size, file_path, age) -> sort key.
+
+    Returns:
+        callable: Function (size, file_path, age) -> sort key.
+    """
+    def key_with_previews(size, file_path, age):
+        return key(size, file_path, age) - (2 ** 62 if previews.is_derivative(file_path) else 0)
+    return key_with_previews
+
+def order_files(file_paths, policy=None):
+    """
+    Sort files for upload according to a scheduling policy (all counted as just queued).
+    Previews go first (see previews_first).
+
+    Args:
+        file_paths (iterable): Paths of the files to upload.
+        policy (str or callable): See get_policy.
+
+    Returns:
+        list: The paths in upload order; files that can't be read keep size 0.
+    """
+    key = previews_first(get_policy(policy))
+    sized = []
+    for index, file_path in enumerate(file_paths):
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            size = 0
+        sized.append((key(size, file_path, 0), index, file_path))
+    return [file_path for _, _, file_path in sorted(sized)]
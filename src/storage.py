@@ -0,0 +1,514 @@
+import os
+import sys
+import time
+import shutil
+import pathlib
+import threading
+from abc import ABC, abstractmethod
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import (UPLOAD_WORKERS, SHARE_BATCH_SIZE, MIRROR_FOLDERS, STORAGE_BACKEND, LOCAL_STORAGE_PATH,
+                    S3_BUCKET, S3_ENDPOINT_URL, S3_REGION, S3_LINK_EXPIRY, S3_MULTIPART_THRESHOLD, PACK_SMALL_FILES,
+                    PREVIEW_FOLDER)
+import file_manager
+import hash_engine
+import packer
+import rate_limiter
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+def relative_dir(file_path, base_folder, mirror=None):
+    """
+    Subdirectory of base_folder holding file_path, with "/" separators ("" for
+    the root, or when folders aren't mirrored). Previews (in PREVIEW_FOLDER)
+    stay in their folder even when folders aren't mirrored.
+    """
+    mirror = MIRROR_FOLDERS if mirror is None else mirror
+    if not base_folder:
+        return ""
+    rel_dir = os.path.relpath(os.path.dirname(os.path.abspath(file_path)), os.path.abspath(base_folder))
+    if rel_dir == "." or rel_dir.startswith(".."):
+        return ""
+    if not mirror:
+        return PREVIEW_FOLDER if rel_dir.split(os.sep)[0] == PREVIEW_FOLDER else ""
+    return rel_dir.replace(os.sep, "/")
+
+class StorageBackend(ABC):
+    """
+    Where uploaded files go: Google Drive (cloud_uploader.DriveBackend), a
+    local or network folder (LocalBackend) or an S3-compatible bucket (S3Backend).
+
+    upload_files calls the methods below from several threads at once; a
+    backend keeps whatever per-thread state (clients, connections) it needs.
+    File IDs and folder IDs are opaque strings chosen by the backend. A
+    backend missing one of the abstract methods can't be instantiated.
+    """
+    name = "storage"
+    needs_sharing = False  # True if files only get a working link once passed to share()
+
+    def prepare(self):
+        """Get ready for uploads (create the root folder, index existing files). Returns False if it failed."""
+        return True
+
+    def folder_key(self, file_path):
+        """Relative directory a file is uploaded into ("" for the root folder)."""
+        return ""
+
+    @abstractmethod
+    def resolve_folder(self, rel_dir=""):
+        """Return the ID of the folder for a relative directory, creating it if needed (None if that failed)."""
+
+    def find_existing(self, folder_id, file_path):
+        """Return the ID of a file in the folder with the same content (size and MD5), or None."""
+        return None
+
+    @abstractmethod
+    def upload(self, file_path, folder_id):
+        """Upload a file into a folder and return its ID; raises on failure."""
+
+    @abstractmethod
+    def upload_stream(self, name, stream, size, folder_id):
+        """Upload size bytes read from a seekable stream as file name (e.g. a packer.Archive); returns its ID."""
+
+    def share(self, file_ids):
+        """Make files reachable by their link; returns the set of IDs that could not be shared."""
+        return set()
+
+    @abstractmethod
+    def link(self, file_id):
+        """Return the link to send for an uploaded file."""
+
+def _item_files(item):
+    """Paths of the files an upload item (a file path or a packer.Archive) carries."""
+    return item.paths() if isinstance(item, packer.Archive) else [item]
+
+def _item_name(item):
+    return item.name if isinstance(item, packer.Archive) else os.path.basename(item)
+
+def upload_files(file_paths, backend, workers=None, share_batch_size=None, pack=None, errors=None):
+    """
+    Upload files concurrently to a storage backend, yielding each result as soon as it is ready.
+
+    Files are consumed lazily with at most two per worker in flight, so
+    file_paths can be a pipeline queue. With a backend that needs sharing,
+    uploaded files are shared in batches when share_batch_size of them are
+    waiting or no upload is in flight, so each result is yielded once its link works.
+    Files already in the storage are shared again too (sharing is idempotent):
+    an earlier run may have uploaded them and failed to share them.
+
+    In pack mode, small files are bundled into archives (see packer.pack_files)
+    uploaded into the root folder, one upload and one share per archive; each
+    packed file's result carries the link to its archive. Files found in an
+    archive uploaded earlier (packer.find_packed) are reused.
+
+    Args:
+        file_paths (iterable): Paths of the files to upload.
+        backend (StorageBackend): Where to upload them, already prepared.
+        workers (int): Number of upload threads (default: UPLOAD_WORKERS).
+        share_batch_size (int): Files shared per batch (default: SHARE_BATCH_SIZE).
+        pack (bool): Bundle small files into archives (default: PACK_SMALL_FILES).
+        errors (dict): Optional dict filled with the error message of each failed file, by path.
+
+    Yields:
+        tuple: (file_path, result, reused)
+            - file_path: The file
+            - result: (file_name, link), or None if the upload failed
+            - reused: True if the file was already in the storage
+    """
+    workers = max(1, workers or UPLOAD_WORKERS)
+    share_batch_size = share_batch_size or SHARE_BATCH_SIZE
+    pack = PACK_SMALL_FILES if pack is None else pack
+    errors = errors if errors is not None else {}
+    unshared = []  # (item, file_id, reused) uploaded or found but not yet shared
+
+    def upload_one(item):
+        if isinstance(item, packer.Archive):
+            folder_id = backend.resolve_folder("")
+            if not folder_id:
+                raise RuntimeError(f"Could not create {backend.name} folder for {item.name}")
+            with item.open() as stream:
+                return backend.upload_stream(item.name, stream, item.size, folder_id), False
+        archive_id = pack and packer.find_packed(item, backend.name)
+        if archive_id:
+            return archive_id, True
+        folder_id = backend.resolve_folder(backend.folder_key(item))
+        if not folder_id:
+            raise RuntimeError(f"Could not create {backend.name} folder for {os.path.basename(item)}")
+        file_id = backend.find_existing(folder_id, item)
+        if file_id:
+            return file_id, True
+        return backend.upload(item, folder_id), False
+
+    def flush():
+        failed = set()
+        if backend.needs_sharing:
+            # Files packed in one archive found earlier share its ID
+            failed = backend.share(list(dict.fromkeys(file_id for _, file_id, _ in unshared)))
+        for item, file_id, reused in unshared:
+            if file_id in failed:
+                print(f"Error sharing {_item_name(item)}")
+                for file_path in _item_files(item):
+                    errors[file_path] = f"Could not share {_item_name(item)}"
+                    yield file_path, None, False
+                continue
+            link = backend.link(file_id)
+            if reused:
+                logger.info(f"{_item_name(item)} is already in {backend.name} (ID: {file_id}, Link: {link})")
+                print(f"Already in {backend.name}: {_item_name(item)}")
+                yield item, (_item_name(item), link), True
+                continue
+            if isinstance(item, packer.Archive):
+                packer.record_archive(item, backend.name, file_id, link)
+                print(f"Uploaded {len(item.members)} files packed in {item.name} to {backend.name}: {link}")
+            else:
+                print(f"Uploaded {_item_name(item)} to {backend.name}: {link}")
+            for file_path in _item_files(item):
+                yield file_path, (os.path.basename(file_path), link), False
+        unshared.clear()
+
+    todo = packer.pack_files(file_paths, backend.folder_key, backend.name) if pack else iter(file_paths)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload") as executor:
+        try:
+            while True:
+                for item in todo:
+                    pending[executor.submit(upload_one, item)] = item
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    name = _item_name(item)
+                    try:
+                        file_id, reused = future.result()
+                    except Exception as e:
+                        logger.error(f"Error uploading {name}: {str(e)}")
+                        print(f"Error uploading {name}: {str(e)}")
+                        for file_path in _item_files(item):
+                            errors[file_path] = str(e)
+                            yield file_path, None, False
+                        continue
+                    unshared.append((item, file_id, reused))
+                if len(unshared) >= share_batch_size or (unshared and not pending):
+                    yield from flush()
+            yield from flush()
+        finally:
+            for future in pending:
+                future.cancel()
+
+class _ContentIndex:
+    """Files of a storage folder by size, to find a file's content without reading it unless sizes match."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.folders = {}  # folder ID -> {size: [(file_id, md5 or None), ...]}
+
+    def is_loaded(self, folder_id):
+        with self.lock:
+            return folder_id in self.folders
+
+    def load(self, folder_id, entries):
+        """Index a folder's files, from tuples (file_id, size, md5 or None if unknown yet)."""
+        by_size = {}
+        for file_id, size, md5 in entries:
+            by_size.setdefault(size, []).append((file_id, md5))
+        with self.lock:
+            self.folders[folder_id] = by_size
+
+    def add(self, folder_id, file_id, size, md5):
+        with self.lock:
+            self.folders.setdefault(folder_id, {}).setdefault(size, []).append((file_id, md5))
+
+    def find(self, folder_id, file_path, remote_md5):
+        """
+        Return the ID of an indexed file with the content of file_path, or None.
+
+        remote_md5(file_id) supplies the MD5 of indexed files listed without one.
+        """
+        size = os.path.getsize(file_path)
+        with self.lock:
+            candidates = list(self.folders.get(folder_id, {}).get(size, []))
+        if not candidates:
+            return None
+        md5 = hash_engine.hash_file(file_path, algorithm="md5")
+        for file_id, candidate_md5 in candidates:
+            if (candidate_md5 or remote_md5(file_id)) == md5:
+                return file_id
+        return None
+
+class LocalBackend(StorageBackend):
+    """
+    Upload into a folder: a NAS share, a synced folder, or a scratch directory
+    for offline benchmarks and tests. Links are file:// URIs.
+    """
+    name = "local storage"
+
+    def __init__(self, root, folder_name, base_folder=None, mirror=None):
+        self.root = os.path.join(root, folder_name)
+        self.base_folder = base_folder
+        self.mirror = mirror
+        self.index = _ContentIndex()
+        self.lock = threading.Lock()
+
+    def prepare(self):
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            return True
+        except OSError as e:
+            logger.error(f"Error creating storage folder {self.root}: {str(e)}")
+            print(f"Error creating storage folder {self.root}: {str(e)}")
+            return False
+
+    def folder_key(self, file_path):
+        return relative_dir(file_path, self.base_folder, self.mirror)
+
+    def resolve_folder(self, rel_dir=""):
+        folder = os.path.join(self.root, *rel_dir.split("/")) if rel_dir else self.root
+        os.makedirs(folder, exist_ok=True)
+        if not self.index.is_loaded(folder):
+            self.index.load(folder, [(entry.path, entry.stat().st_size, None)
+                                     for entry in os.scandir(folder) if entry.is_file() and ".part" not in entry.name])
+        return folder
+
+    def find_existing(self, folder_id, file_path):
+        return self.index.find(folder_id, file_path, lambda file_id: hash_engine.hash_file(file_id, algorithm="md5"))
+
+    def _store(self, file_name, folder_id, write):
+        """Write a new file into the folder with write(partial_path), under a free name; returns its path."""
+        stem, ext = os.path.splitext(file_name)
+        with self.lock:
+            # Another file with this name but other content is already there: keep both
+            dest_path, n = os.path.join(folder_id, file_name), 1
+            while os.path.exists(dest_path):
+                dest_path, n = os.path.join(folder_id, f"{stem} ({n}){ext}"), n + 1
+            open(dest_path, "xb").close()  # Reserve the name for this thread
+        partial_path = dest_path + ".part"
+        try:
+            write(partial_path)
+            os.replace(partial_path, dest_path)
+        except Exception:
+            for path in (partial_path, dest_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        self.index.add(folder_id, dest_path, os.path.getsize(dest_path), None)
+        logger.info(f"Uploaded {file_name} to {dest_path}")
+        return dest_path
+
+    def upload(self, file_path, folder_id):
+        return self._store(os.path.basename(file_path), folder_id,
+                           lambda partial_path: file_manager.copy_file(file_path, partial_path))
+
+    def upload_stream(self, name, stream, size, folder_id):
+        def write(partial_path):
+            with open(partial_path, "wb") as f:
+                shutil.copyfileobj(stream, f, 1024 * 1024)
+        return self._store(name, folder_id, write)
+
+    def link(self, file_id):
+        return pathlib.Path(os.path.abspath(file_id)).as_uri()
+
+class S3Backend(StorageBackend):
+    """
+    Upload into an S3-compatible bucket (AWS S3, MinIO, Ceph, ...) under the
+    key prefix folder_name/. Links are presigned GET URLs valid for S3_LINK_EXPIRY
+    seconds. Needs boto3; credentials come from the usual AWS sources
+    (environment, ~/.aws/credentials).
+    """
+    name = "S3"
+
+    def __init__(self, bucket, folder_name, base_folder=None, mirror=None, endpoint_url=None, region=None,
+                 link_expiry=None, multipart_threshold=None, client_kwargs=None):
+        self.bucket = bucket
+        self.prefix = folder_name.strip("/") + "/"
+        self.base_folder = base_folder
+        self.mirror = mirror
+        self.endpoint_url = endpoint_url
+        self.region = region or S3_REGION
+        self.link_expiry = link_expiry or S3_LINK_EXPIRY
+        self.multipart_threshold = multipart_threshold or S3_MULTIPART_THRESHOLD
+        self.client_kwargs = client_kwargs or {}
+        self.client = None
+        self.index = _ContentIndex()
+
+    def prepare(self):
+        try:
+            import boto3
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError:
+            logger.error("boto3 is not installed; the S3 storage backend is unavailable")
+            print("boto3 is not installed; the S3 storage backend is unavailable")
+            return False
+
+        try:
+            # S3 clients are thread-safe; one is shared by every upload thread.
+            # Checksums only when required, as not every S3-compatible server supports the newer ones.
+            config = Config(s3={"addressing_style": "path"}, retries={"mode": "adaptive", "max_attempts": 6},
+                            request_checksum_calculation="when_required",
+                            response_checksum_validation="when_required")
+            self.client = boto3.client("s3", endpoint_url=self.endpoint_url, region_name=self.region,
+                                       config=config, **self.client_kwargs)
+            try:
+                self.client.head_bucket(Bucket=self.bucket)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchBucket"):
+                    raise
+                if self.region and self.region != "us-east-1":
+                    # Outside us-east-1 S3 requires the bucket's region in the request
+                    self.client.create_bucket(Bucket=self.bucket,
+                                              CreateBucketConfiguration={"LocationConstraint": self.region})
+                else:
+                    self.client.create_bucket(Bucket=self.bucket)
+                logger.info(f"Created S3 bucket {self.bucket}")
+            return True
+        except Exception as e:
+            logger.error(f"Error opening S3 bucket {self.bucket}: {str(e)}")
+            print(f"Error opening S3 bucket {self.bucket}: {str(e)}")
+            return False
+
+    def folder_key(self, file_path):
+        return relative_dir(file_path, self.base_folder, self.mirror)
+
+    def resolve_folder(self, rel_dir=""):
+        """S3 has no folders: the "folder" is a key prefix, listed once to find existing content."""
+        prefix = self.prefix + (rel_dir + "/" if rel_dir else "")
+        if not self.index.is_loaded(prefix):
+            entries = []
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter="/"):
+                for obj in page.get("Contents", []):
+                    etag = obj["ETag"].strip('"')
+                    # A multipart ETag is not the MD5 of the object; its MD5 is in the metadata
+                    entries.append((obj["Key"], obj["Size"], None if "-" in etag else etag))
+            self.index.load(prefix, entries)
+        return prefix
+
+    def _stored_md5(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=key).get("Metadata", {}).get("md5")
+
+    def find_existing(self, folder_id, file_path):
+        return self.index.find(folder_id, file_path, self._stored_md5)
+
+    def _transfer_config(self):
+        from boto3.s3.transfer import TransferConfig
+        return TransferConfig(multipart_threshold=self.multipart_threshold)
+
+    @staticmethod
+    def _charge_bandwidth():
+        """
+        Callback charging bytes to the shared bandwidth cap as boto3 reads them
+        for sending, so a large object is paced part by part rather than all up front.
+        """
+        bandwidth = rate_limiter.get_bandwidth_limiter()
+
+        def charge(nbytes):
+            if nbytes > 0:  # A retried part is reported as negative progress first
+                bandwidth.consume(nbytes)
+        return charge
+
+    def upload(self, file_path, folder_id):
+        file_name = os.path.basename(file_path)
+        key = folder_id + file_name
+        size = os.path.getsize(file_path)
+        md5 = hash_engine.hash_file(file_path, algorithm="md5")
+        # Objects up to multipart_threshold go in one PUT, larger ones in parallel parts
+        self.client.upload_file(file_path, self.bucket, key, ExtraArgs={"Metadata": {"md5": md5}},
+                                Config=self._transfer_config(), Callback=self._charge_bandwidth())
+        self.index.add(folder_id, key, size, md5)
+        logger.info(f"Uploaded {file_name} to s3://{self.bucket}/{key}")
+        return key
+
+    def upload_stream(self, name, stream, size, folder_id):
+        key = folder_id + name
+        self.client.upload_fileobj(stream, self.bucket, key, Config=self._transfer_config(),
+                                   Callback=self._charge_bandwidth())
+        logger.info(f"Uploaded {name} to s3://{self.bucket}/{key}")
+        return key
+
+    def link(self, file_id):
+        return self.client.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": file_id},
+                                                  ExpiresIn=self.link_expiry)
+
+def open_backend(folder_name, base_folder=None, client_factory=None, backend=None):
+    """
+    Create and prepare the STORAGE_BACKEND for an upload into folder_name.
+
+    Args:
+        folder_name (str): Name of the folder to upload into (e.g., 'Photos_2025').
+        base_folder (str): Backup folder whose subdirectories are mirrored, if any.
+        client_factory (callable): Drive client factory (default: cloud_uploader.drive_client_factory()).
+        backend (str): "drive", "local", "s3" or "fake_drive" (default: STORAGE_BACKEND).
+
+    Returns:
+        StorageBackend: The prepared backend, or None if it could not be prepared
+                        (e.g. authentication failed).
+    """
+    backend = backend or STORAGE_BACKEND
+    if backend == "drive":
+        import cloud_uploader  # Imports storage itself
+        return cloud_uploader.open_drive_backend(folder_name, base_folder, client_factory)
+    if backend == "fake_drive":
+        # The Drive backend's own code (chunks, limiter, batched sharing) against a local endpoint
+        import cloud_uploader
+        import fake_drive
+        return cloud_uploader.open_drive_backend(folder_name, base_folder, fake_drive.client_factory())
+    if backend == "local":
+        storage = LocalBackend(LOCAL_STORAGE_PATH, folder_name, base_folder)
+    elif backend == "s3":
+        storage = S3Backend(S3_BUCKET, folder_name, base_folder, endpoint_url=S3_ENDPOINT_URL)
+    else:
+        logger.error(f"Unknown storage backend '{backend}'")
+        print(f"Unknown storage backend '{backend}'")
+        return None
+    return storage if storage.prepare() else None
+
+def benchmark(file_paths, backend, workers=None):
+    """
+    Measure upload throughput to a backend.
+
+    Args:
+        file_paths (list): Files to upload.
+        backend (StorageBackend): Prepared backend, e.g. a LocalBackend, an S3Backend
+            pointed at a local MinIO, or the Drive backend on fake_drive.
+        workers (int): Number of upload threads (default: UPLOAD_WORKERS).
+
+    Returns:
+        dict: 'files', 'bytes', 'failed', 'seconds' and 'mb_per_s' of the uploads.
+    """
+    stats = {"files": 0, "bytes": 0, "failed": 0}
+    started = time.perf_counter()
+    for file_path, result, reused in upload_files(file_paths, backend, workers):
+        if result:
+            stats["files"] += 1
+            stats["bytes"] += 0 if reused else os.path.getsize(file_path)
+        else:
+            stats["failed"] += 1
+    stats["seconds"] = time.perf_counter() - started
+    stats["mb_per_s"] = stats["bytes"] / (1024 * 1024) / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    logger.info(f"Uploaded {stats['files']} files ({stats['bytes'] / (1024 * 1024):.1f} MB) to {backend.name} "
+                f"in {stats['seconds']:.2f}s: {stats['mb_per_s']:.1f} MB/s")
+    return stats
+
+if __name__ == "__main__":
+    # Measure upload throughput offline, e.g. against a local MinIO (S3_ENDPOINT_URL), a scratch folder
+    # or the fake Drive endpoint (FAKE_DRIVE_LATENCY per request):
+    #   python storage.py C:\Media_Backup\Photos_2025 local 4
+    #   python storage.py C:\Media_Backup\Photos_2025 s3 8
+    #   python storage.py C:\Media_Backup\Photos_2025 fake_drive 8
+    folder = sys.argv[1] if len(sys.argv) > 1 else "."
+    backend_name = sys.argv[2] if len(sys.argv) > 2 else "local"
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else UPLOAD_WORKERS
+    paths = [os.path.join(root, name) for root, _, files in os.walk(folder) for name in files]
+    storage = open_backend(f"benchmark_{int(time.time())}", backend=backend_name)
+    if storage:
+        print(f"Uploading {len(paths)} files from {folder} to {storage.name} with {workers} worker(s)...")
+        stats = benchmark(paths, storage, workers)
+        print(f"{stats['files']} files, {stats['bytes'] / (1024 * 1024):.1f} MB in {stats['seconds']:.2f}s: "
+              f"{stats['mb_per_s']:.1f} MB/s ({stats['failed']} failed)")
@@ -0,0 +1,628 @@
+import os
+import sys
+import time
+import sqlite3
+import contextlib
+import threading
+import subprocess
+import logging
+from config import UPLOAD_WORKERS, UPLOAD_MAX_ATTEMPTS, UPLOAD_RETRY_DELAY, VIDEO_EXTENSIONS
+import cloud_uploader
+import scheduling
+import storage
+import previews
+import duplicate_checker
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, filename="media_uploader.log",
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Database configuration
+UPLOAD_QUEUE_DB_PATH = "upload_queue.db"
+UPLOAD_LEASE_SECONDS = 300  # An in-flight job not renewed for this long is taken over (its worker died)
+SETTINGS_POLL_INTERVAL = 5  # Seconds between checks of settings changed while a worker runs
+
+# Job states
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+# One connection shared by all threads (the enqueue feeder, upload threads and
+# lease keeper), so the schema is set up once and no connection is left open
+_conn = None
+_conn_path = None
+_lock = threading.Lock()
+
+def _connection():
+    """Return the connection to the queue database, creating its tables when it's opened (call with _lock held)."""
+    global _conn, _conn_path
+    if _conn is None or _conn_path != UPLOAD_QUEUE_DB_PATH:
+        if _conn is not None:
+            _conn.close()
+        conn = sqlite3.connect(UPLOAD_QUEUE_DB_PATH, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")  # Let the pipeline enqueue while a worker drains
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS upload_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_path TEXT NOT NULL,
+                folder_name TEXT NOT NULL,
+                base_folder TEXT,
+                size INTEGER NOT NULL DEFAULT 0,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_until REAL,
+                retry_at REAL NOT NULL DEFAULT 0,
+                file_name TEXT,
+                link TEXT,
+                reused INTEGER,
+                last_error TEXT,
+                enqueued_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                source_folder TEXT,
+                recipient TEXT,
+                emailed INTEGER NOT NULL DEFAULT 0,
+                is_preview INTEGER NOT NULL DEFAULT 0,
+                is_video INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (file_path, folder_name)
+            )
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(upload_jobs)")}
+        if "size" not in columns:
+            # Queue created before size-aware scheduling
+            conn.execute("ALTER TABLE upload_jobs ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+        if "source_folder" not in columns:
+            # Queue created before links were emailed from the background worker
+            conn.execute("ALTER TABLE upload_jobs ADD COLUMN source_folder TEXT")
+            conn.execute("ALTER TABLE upload_jobs ADD COLUMN recipient TEXT")
+            conn.execute("ALTER TABLE upload_jobs ADD COLUMN emailed INTEGER NOT NULL DEFAULT 0")
+        if "is_preview" not in columns:
+            # Queue created before the fixed part of the scheduling key was stored
+            conn.execute("ALTER TABLE upload_jobs ADD COLUMN is_preview INTEGER NOT NULL DEFAULT 0")
+            conn.execute("ALTER TABLE upload_jobs ADD COLUMN is_video INTEGER NOT NULL DEFAULT 0")
+            conn.executemany("UPDATE upload_jobs SET is_preview = ?, is_video = ? WHERE id = ?",
+                             [(*_file_kind(file_path), job_id)
+                              for job_id, file_path in conn.execute("SELECT id, file_path FROM upload_jobs").fetchall()])
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_upload_jobs_state ON upload_jobs (state, retry_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_upload_jobs_order ON upload_jobs (state, is_preview, size)")
+        conn.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value)")
+        conn.commit()
+        _conn, _conn_path = conn, UPLOAD_QUEUE_DB_PATH
+    return _conn
+
+@contextlib.contextmanager
+def _connect(policy=None):
+    """
+    Use the queue database: the shared connection, held by the caller until
+    the block ends, then committed (or rolled back if the block raised).
+
+    Args:
+        policy (str or callable): Scheduling policy made available to queries as
+            schedule_key(size, file_path, age) (see scheduling.get_policy).
+    """
+    with _lock:
+        conn = _connection()
+        conn.create_function("schedule_key", 3, scheduling.get_policy(policy))
+        with conn:
+            yield conn
+
+def close():
+    """Close the queue connection; the next call opens it again."""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+def _file_kind(file_path):
+    """(is_preview, is_video) of a file, stored with its job so claim can sort without Python calls."""
+    return (int(previews.is_derivative(file_path)),
+            int(os.path.splitext(file_path)[1].lower() in VIDEO_EXTENSIONS))
+
+def _file_size(file_path):
+    """Size of a file for scheduling, 0 if it can't be read (its upload will fail and say why)."""
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+def enqueue(file_paths, folder_name, base_folder=None, claim=False, source_folder=None):
+    """
+    Add files to the upload queue.
+
+    A file already queued for the same folder is queued again from
+    scratch (attempt count reset, no email requested), whatever its earlier state.
+
+    Args:
+        file_paths (iterable): Paths of the files to upload.
+        folder_name (str): Name of the folder to upload into (see storage.open_backend).
+        base_folder (str): Backup folder whose subdirectories are mirrored in the storage, if any.
+        claim (bool): Mark the jobs in flight for the caller, who uploads them right
+            away (see upload_claimed); otherwise they wait for a worker.
+        source_folder (str): Card folder the files were imported from, for request_email.
+
+    Returns:
+        list: Job IDs, in the order of file_paths.
+    """
+    now = time.time()
+    state, lease_until = (IN_FLIGHT, now + UPLOAD_LEASE_SECONDS) if claim else (PENDING, None)
+    job_ids = []
+    with _connect() as conn:
+        for file_path in file_paths:
+            conn.execute("""
+                INSERT INTO upload_jobs (file_path, folder_name, base_folder, size, state, attempts, lease_until,
+                                         enqueued_at, updated_at, source_folder, is_preview, is_video)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (file_path, folder_name) DO UPDATE SET
+                    base_folder = excluded.base_folder, size = excluded.size, state = excluded.state,
+                    is_preview = excluded.is_preview, is_video = excluded.is_video,
+                    attempts = excluded.attempts, lease_until = excluded.lease_until, retry_at = 0,
+                    file_name = NULL, link = NULL, reused = NULL, last_error = NULL,
+                    enqueued_at = excluded.enqueued_at, updated_at = excluded.updated_at,
+                    source_folder = excluded.source_folder, recipient = NULL, emailed = 0
+            """, (file_path, folder_name, base_folder, _file_size(file_path), state, 1 if claim else 0,
+                  lease_until, now, now, source_folder, *_file_kind(file_path)))
+            job_ids.append(conn.execute(
+                "SELECT id FROM upload_jobs WHERE file_path = ? AND folder_name = ?", (file_path, folder_name)
+            ).fetchone()[0])
+        conn.commit()
+    logger.debug(f"Queued {len(job_ids)} files for folder {folder_name}")
+    return job_ids
+
+def claim(limit, target=None, policy=None):
+    """
+    Take up to limit jobs that are due: pending ones whose retry time has come,
+    and in-flight ones whose lease expired (their worker died or was closed).
+
+    Previews go first whatever the policy (see scheduling.previews_first).
+    Built-in policies sort in SQLite on the columns stored by enqueue; other
+    policies are called for every due job.
+
+    Args:
+        limit (int): Most jobs to take.
+        target (tuple): Only take jobs for this (folder_name, base_folder).
+        policy (str or callable): Scheduling policy choosing which jobs go first
+            (default: UPLOAD_SCHEDULING_POLICY, see scheduling.get_policy).
+
+    Returns:
+        list: Tuples (job_id, file_path, folder_name, base_folder), in upload order.
+    """
+    now = time.time()
+    query = """
+        SELECT id, file_path, folder_name, base_folder FROM upload_jobs
+        WHERE ((state = ? AND retry_at <= ?) OR (state = ? AND lease_until < ?))
+    """
+    params = [PENDING, now, IN_FLIGHT, now]
+    if target:
+        query += " AND folder_name = ? AND base_folder IS ?"
+        params.extend(target)
+    order = scheduling.sql_order(policy, now)
+    if order:
+        query += f" ORDER BY is_preview DESC, {order[0]}, id LIMIT ?"
+        params.extend([*order[1], limit])
+    else:
+        query += " ORDER BY is_preview DESC, schedule_key(size, file_path, ? - enqueued_at), id LIMIT ?"
+        params.extend([now, limit])
+    with _connect(policy) as conn:
+        conn.execute("BEGIN IMMEDIATE")  # No other worker claims the same rows
+        jobs = conn.execute(query, params).fetchall()
+        conn.executemany(
+            "UPDATE upload_jobs SET state = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE id = ?",
+            [(IN_FLIGHT, now + UPLOAD_LEASE_SECONDS, now, job[0]) for job in jobs]
+        )
+        conn.commit()
+    return jobs
+
+def renew(job_ids):
+    """Extend the leases of jobs still being uploaded."""
+    now = time.time()
+    with _connect() as conn:
+        conn.executemany("UPDATE upload_jobs SET lease_until = ? WHERE id = ? AND state = ?",
+                         [(now + UPLOAD_LEASE_SECONDS, job_id, IN_FLIGHT) for job_id in job_ids])
+        conn.commit()
+
+def complete(job_id, file_name, link, reused=False):
+    """Mark a job done, with the link of the uploaded file."""
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE upload_jobs SET state = ?, file_name = ?, link = ?, reused = ?, lease_until = NULL, "
+            "last_error = NULL, updated_at = ? WHERE id = ?",
+            (DONE, file_name, link, int(reused), now, job_id)
+        )
+        conn.commit()
+
+def fail(job_id, error):
+    """
+    Record a failed attempt: the job is retried after UPLOAD_RETRY_DELAY seconds
+    (doubled per attempt), or marked failed after UPLOAD_MAX_ATTEMPTS attempts.
+
+    Returns:
+        str: The job's new state, PENDING or FAILED.
+    """
+    now = time.time()
+    with _connect() as conn:
+        row = conn.execute("SELECT attempts FROM upload_jobs WHERE id = ?", (job_id,)).fetchone()
+        attempts = row[0] if row else UPLOAD_MAX_ATTEMPTS
+        state = FAILED if attempts >= UPLOAD_MAX_ATTEMPTS else PENDING
+        retry_at = now + UPLOAD_RETRY_DELAY * 2 ** max(0, attempts - 1)
+        conn.execute(
+            "UPDATE upload_jobs SET state = ?, retry_at = ?, lease_until = NULL, last_error = ?, updated_at = ? "
+            "WHERE id = ?",
+            (state, retry_at, error, now, job_id)
+        )
+        conn.commit()
+    return state
+
+def counts():
+    """
+    Return the number of jobs per state.
+
+    Returns:
+        dict: Maps each of PENDING, IN_FLIGHT, DONE and FAILED to a count.
+    """
+    try:
+        with _connect() as conn:
+            rows = conn.execute("SELECT state, COUNT(*) FROM upload_jobs GROUP BY state").fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Error reading upload queue: {str(e)}")
+        rows = []
+    result = {PENDING: 0, IN_FLIGHT: 0, DONE: 0, FAILED: 0}
+    result.update(rows)
+    return result
+
+def failures(limit=20):
+    """
+    Return the jobs whose last attempt failed, most recent first.
+
+    Returns:
+        list: Tuples (file_path, state, attempts, last_error).
+    """
+    with _connect() as conn:
+        return conn.execute(
+            "SELECT file_path, state, attempts, last_error FROM upload_jobs "
+            "WHERE state IN (?, ?) AND last_error IS NOT NULL ORDER BY updated_at DESC LIMIT ?",
+            (PENDING, FAILED, limit)
+        ).fetchall()
+
+def waiting(source_folder, since):
+    """Number of jobs for files from source_folder, queued since the given time, that are not uploaded yet."""
+    with _connect() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM upload_jobs WHERE source_folder = ? AND enqueued_at >= ? AND state IN (?, ?)",
+            (source_folder, since, PENDING, IN_FLIGHT)
+        ).fetchone()[0]
+
+def request_email(source_folder, recipient, since, sent_links=()):
+    """
+    Have the links of files from source_folder emailed to recipient once they are uploaded.
+
+    Applies to jobs queued since the given time, except those whose link was
+    already sent (sent_links). The background worker sends one email per
+    source folder and recipient when none of its jobs is left waiting (see
+    send_requested_emails).
+
+    Returns:
+        int: Number of jobs whose links are to be emailed.
+    """
+    sent_links = set(sent_links)
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT id, link FROM upload_jobs WHERE source_folder = ? AND enqueued_at >= ? AND emailed = 0",
+            (source_folder, since)
+        ).fetchall()
+        conn.executemany("UPDATE upload_jobs SET emailed = 1 WHERE id = ?",
+                         [(job_id,) for job_id, link in rows if link in sent_links])
+        requested = [(recipient, job_id) for job_id, link in rows if link not in sent_links]
+        conn.executemany("UPDATE upload_jobs SET recipient = ? WHERE id = ?", requested)
+        conn.commit()
+    return len(requested)
+
+def send_requested_emails():
+    """
+    Email the links requested with request_email, for every source folder and
+    recipient whose jobs are all done or failed. Photos are listed with the
+    link to their preview, as in main.run_pipeline.
+
+    Returns:
+        int: Number of emails sent.
+    """
+    with _connect() as conn:
+        groups = conn.execute("""
+            SELECT source_folder, recipient FROM upload_jobs WHERE recipient IS NOT NULL AND emailed = 0
+            GROUP BY source_folder, recipient HAVING SUM(state IN (?, ?)) = 0
+        """, (PENDING, IN_FLIGHT)).fetchall()
+    sent = 0
+    for source_folder, recipient in groups:
+        with _connect() as conn:
+            rows = conn.execute(
+                "SELECT file_path, file_name, link FROM upload_jobs "
+                "WHERE source_folder = ? AND recipient = ? AND emailed = 0 AND state = ? ORDER BY id",
+                (source_folder, recipient, DONE)
+            ).fetchall()
+        links = {file_path: link for file_path, _, link in rows}
+        uploaded_files = []
+        for file_path, file_name, link in rows:
+            if previews.is_derivative(file_path):
+                continue  # Listed with its original
+            preview_link = links.get(previews.derivative_paths(file_path)[0])
+            uploaded_files.append((file_name, link, preview_link) if preview_link else (file_name, link))
+        if uploaded_files:
+            import email_sender  # Only needed (with its DNS and SMTP modules) when there is something to send
+            success, message = email_sender.send_links(uploaded_files, source_folder, recipient)
+            if not success:
+                logger.error(f"Error emailing links for {source_folder} to {recipient}: {message}")
+                continue  # Tried again after the next batch, or by the next worker
+            sent += 1
+        with _connect() as conn:
+            conn.execute(
+                "UPDATE upload_jobs SET emailed = 1 WHERE source_folder = ? AND recipient = ? AND emailed = 0 "
+                "AND state IN (?, ?)",
+                (source_folder, recipient, DONE, FAILED)
+            )
+            conn.commit()
+    return sent
+
+def next_due():
+    """Return when the next waiting job is due (time.time() scale), or None if no job is waiting."""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT MIN(CASE WHEN state = ? THEN retry_at ELSE lease_until END) FROM upload_jobs WHERE state IN (?, ?)",
+            (PENDING, PENDING, IN_FLIGHT)
+        ).fetchone()
+    return row[0]
+
+def set_bandwidth_limit(bytes_per_second):
+    """
+    Cap the upload bandwidth, in this process and in running background workers.
+
+    Workers pick the new cap up within SETTINGS_POLL_INTERVAL seconds, also in
+    the middle of an upload.
+
+    Args:
+        bytes_per_second (int): The cap, or 0 for no cap.
+    """
+    with _connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('max_bytes_per_second', ?)",
+                     (int(bytes_per_second or 0),))
+        conn.commit()
+    cloud_uploader.set_bandwidth_limit(bytes_per_second)
+
+def get_bandwidth_limit():
+    """Return the bandwidth cap set with set_bandwidth_limit, or None if none was set."""
+    with _connect() as conn:
+        row = conn.execute("SELECT value FROM settings WHERE name = 'max_bytes_per_second'").fetchone()
+    return row[0] if row else None
+
+def _watch_settings(stop):
+    """Apply bandwidth caps set by other processes until stop is set."""
+    applied = None
+    while True:
+        try:
+            limit = get_bandwidth_limit()
+            if limit is not None and limit != applied:
+                cloud_uploader.set_bandwidth_limit(limit)
+                applied = limit
+        except sqlite3.Error as e:
+            logger.warning(f"Error reading upload settings: {str(e)}")
+        if stop.wait(SETTINGS_POLL_INTERVAL):
+            return
+
+def _keep_leases(job_ids, stop):
+    """Renew the leases of the given jobs every third of UPLOAD_LEASE_SECONDS until stop is set."""
+    while not stop.wait(UPLOAD_LEASE_SECONDS / 3):
+        try:
+            renew(list(job_ids.values()))
+        except sqlite3.Error as e:
+            logger.warning(f"Error renewing upload leases: {str(e)}")
+
+def iter_scheduled(file_paths, folder_name, base_folder=None, policy=None, source_folder=None):
+    """
+    Queue files as they arrive and hand them out for upload in scheduling order.
+
+    A thread moves file_paths (e.g. a pipeline queue) into the upload queue,
+    so everything that arrives is recorded even if the upload stops early;
+    each job handed out is the best waiting one for the policy, not the oldest.
+
+    Args:
+        file_paths (iterable): Paths of the files to upload.
+        folder_name (str): Name of the folder to upload into.
+        base_folder (str): Backup folder mirrored below it, if any.
+        policy (str or callable): See scheduling.get_policy.
+        source_folder (str): Card folder the files were imported from (see enqueue).
+
+    Yields:
+        tuple: (job_id, file_path) of a claimed job, for upload_claimed.
+    """
+    arrived = threading.Condition()
+    feeding = {"done": False, "error": None}
+
+    def feed():
+        try:
+            for file_path in file_paths:
+                enqueue([file_path], folder_name, base_folder, source_folder=source_folder)
+                with arrived:
+                    arrived.notify()
+        except Exception as e:
+            feeding["error"] = e
+        finally:
+            with arrived:
+                feeding["done"] = True
+                arrived.notify()
+
+    feeder = threading.Thread(target=feed, name="upload-enqueue", daemon=True)
+    feeder.start()
+    try:
+        while True:
+            with arrived:
+                done = feeding["done"]
+            jobs = claim(1, (folder_name, base_folder), policy)
+            if jobs:
+                yield jobs[0][0], jobs[0][1]
+            elif done:
+                break
+            else:
+                with arrived:
+                    if not feeding["done"]:
+                        arrived.wait(0.5)
+    finally:
+        feeder.join()  # Files arriving after an early stop are still queued for the background worker
+    if feeding["error"]:
+        raise feeding["error"]
+
+def upload_claimed(jobs, backend, workers=None):
+    """
+    Upload claimed jobs into one storage target, recording each outcome in the queue.
+
+    Jobs are consumed lazily (see storage.upload_files) and their leases
+    renewed while they upload, so no other worker takes them over. A failed
+    job's last_error says why its upload failed.
+
+    Args:
+        jobs (iterable): Tuples (job_id, file_path) of claimed jobs.
+        backend (storage.StorageBackend): The target, from storage.open_backend.
+        workers (int): Number of upload threads (default: UPLOAD_WORKERS).
+
+    Yields:
+        tuple: (file_path, result, reused) as yielded by storage.upload_files.
+    """
+    job_ids = {}  # file_path -> job ID, for jobs in flight
+    errors = {}  # file_path -> why its upload failed
+
+    def file_paths():
+        for job_id, file_path in jobs:
+            job_ids[file_path] = job_id
+            yield file_path
+
+    stop = threading.Event()
+    keeper = threading.Thread(target=_keep_leases, args=(job_ids, stop), name="upload-leases", daemon=True)
+    keeper.start()
+    try:
+        for file_path, result, reused in storage.upload_files(file_paths(), backend, workers, errors=errors):
+            job_id = job_ids.pop(file_path)
+            if result:
+                complete(job_id, result[0], result[1], reused)
+            elif fail(job_id, errors.pop(file_path, "Upload failed")) == FAILED:
+                logger.error(f"Giving up on {file_path} after {UPLOAD_MAX_ATTEMPTS} attempts")
+            yield file_path, result, reused
+    finally:
+        stop.set()
+
+def run_worker(client_factory=None, workers=None, wait_for_retries=True, stop_event=None):
+    """
+    Drain the upload queue: upload every due job, then wait for jobs due for a
+    retry, until no pending or in-flight job is left.
+
+    Safe to run next to the pipeline or another worker: jobs are claimed
+    atomically and leased. Links requested with request_email are emailed
+    after each batch that settles the last job of their source folder. The
+    first time no job is due, recorded files that only have a signature get
+    their full hash (duplicate_checker.verify_full_hashes).
+
+    Args:
+        client_factory (callable): Returns a new authenticated Drive API service, for
+            the Drive backend (default: cloud_uploader.drive_client_factory()).
+        workers (int): Number of upload threads (default: UPLOAD_WORKERS).
+        wait_for_retries (bool): Sleep until failed jobs are due again; False
+            returns as soon as no job is due.
+        stop_event (threading.Event): Set to stop after the current batch.
+
+    Returns:
+        dict: Job counts per state when the worker stopped (see counts).
+    """
+    workers = max(1, workers or UPLOAD_WORKERS)
+    targets = {}  # (folder_name, base_folder) -> opened storage backend
+    stop_event = stop_event or threading.Event()
+    settings_stop = threading.Event()
+    threading.Thread(target=_watch_settings, args=(settings_stop,), name="upload-settings", daemon=True).start()
+    hashes_verified = False
+
+    while not stop_event.is_set():
+        jobs = claim(workers * 4)
+        if not jobs:
+            if not hashes_verified:
+                _verify_hashes()
+                hashes_verified = True
+                continue  # Jobs may have become due meanwhile
+            due = next_due()
+            if due is None or not wait_for_retries:
+                break
+            stop_event.wait(max(0.0, min(due - time.time(), UPLOAD_LEASE_SECONDS)))
+            continue
+
+        groups = {}
+        for job_id, file_path, folder_name, base_folder in jobs:
+            groups.setdefault((folder_name, base_folder), []).append((job_id, file_path))
+        for key, group in groups.items():
+            if key not in targets:
+                backend = storage.open_backend(*key, client_factory=client_factory)
+                if backend is None:
+                    # Authentication or the folder failed: try again when the jobs are due
+                    for job_id, _ in group:
+                        fail(job_id, f"Could not open storage for folder '{key[0]}'")
+                    continue
+                targets[key] = backend
+            for _ in upload_claimed(group, targets[key], workers):
+                pass
+        _send_emails()
+
+    _send_emails()
+    settings_stop.set()
+    result = counts()
+    close()
+    logger.info(f"Upload worker stopped: {result}")
+    return result
+
+def _verify_hashes():
+    """duplicate_checker.verify_full_hashes, without ever stopping the worker."""
+    try:
+        if duplicate_checker.count_unverified():
+            duplicate_checker.verify_full_hashes()
+    except Exception as e:
+        logger.error(f"Error verifying full hashes: {str(e)}")
+
+def _send_emails():
+    """send_requested_emails, without ever stopping the worker."""
+    try:
+        send_requested_emails()
+    except Exception as e:
+        logger.error(f"Error sending requested emails: {str(e)}")
+
+def start_background_worker():
+    """
+    Start a headless worker process draining the queue (python upload_queue.py).
+
+    The process is detached, so it keeps uploading after the tool is closed.
+
+    Returns:
+        subprocess.Popen: The worker process, or None if it could not be started.
+    """
+    kwargs = {"cwd": os.getcwd(), "stdin": subprocess.DEVNULL, "stdout": subprocess.DEVNULL,
+              "stderr": subprocess.DEVNULL}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    try:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], **kwargs)
+        logger.info(f"Started background upload worker (PID {process.pid})")
+        return process
+    except OSError as e:
+        logger.error(f"Error starting background upload worker: {str(e)}")
+        print(f"Error starting background upload worker: {str(e)}")
+        return None
+
+if __name__ == "__main__":
+    # Headless worker: python upload_queue.py [workers]
+    # Queue status: python upload_queue.py status
+    # Bandwidth cap, also for running workers: python upload_queue.py limit <bytes per second, 0 for none>
+    if len(sys.argv) > 1 and sys.argv[1] == "status":
+        print(counts())
+        for file_path, state, attempts, last_error in failures():
+            print(f"{state} after {attempts} attempt(s): {file_path}: {last_error}")
+    elif len(sys.argv) > 2 and sys.argv[1] == "limit":
+        set_bandwidth_limit(int(sys.argv[2]))
+        print(f"Upload bandwidth cap: {int(sys.argv[2]) or 'unlimited'} bytes/s")
+    else:
+        print(run_worker(workers=int(sys.argv[1]) if len(sys.argv) > 1 else None))
@@ -0,0 +1,67 @@
+from src.bloom_filter import BloomFilter
+import src.duplicate_checker
+import sqlite3
+import os
+
+def test_bloom_filter(tmp_path):
+    print("Testing Bloom filter false-positive rate and snapshot...")
+    bloom = BloomFilter(10000, false_positive_rate=0.01)
+    for i in range(10000):
+        bloom.add(f"hash:{i}")
+    assert all(f"hash:{i}" in bloom for i in range(10000))
+    false_positives = sum(f"hash:other{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+    bloom.save(str(tmp_path / "filter.bloom"), {"row_count": 1})
+    loaded, meta = BloomFilter.load(str(tmp_path / "filter.bloom"))
+    assert meta == {"row_count": 1}
+    assert loaded.bits == bloom.bits and "hash:42" in loaded
+
+    capped = BloomFilter(10 ** 7, false_positive_rate=0.001, max_bytes=1024)
+    assert len(capped.bits) == 1024
+
+def test_filter_skips_database(tmp_path, monkeypatch):
+    print("Testing Bloom filter in front of file_hashes.db...")
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+    monkeypatch.setattr(src.duplicate_checker.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"image{i}.jpg"
+        path.write_bytes(os.urandom(1000 + i))
+        paths.append(str(path))
+
+    results = list(src.duplicate_checker.iter_check_duplicates(paths))
+    assert not any(is_duplicate for _, is_duplicate in results)
+    membership = src.duplicate_checker.get_membership_filter()
+    assert membership.stats["skipped"] == 5  # Every size was new: no size lookup hit the database
+    assert os.path.exists(str(tmp_path / "file_hashes.db.bloom"))
+
+    # A fresh process loads the snapshot and still knows every stored size
+    monkeypatch.setattr(src.duplicate_checker, "_membership_filter", None)
+    membership = src.duplicate_checker.get_membership_filter()
+    assert all(membership.might_contain(f"size:{1000 + i}") for i in range(5))
+    assert not src.duplicate_checker.hash_exists("0" * 64)
+
+def test_filter_sees_updated_hashes(tmp_path, monkeypatch):
+    print("Testing Bloom filter with hashes set by another process...")
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+    monkeypatch.setattr(src.duplicate_checker, "_membership_filter", None)
+    src.duplicate_checker.init_database()
+    with src.duplicate_checker.connect_database() as conn:
+        conn.execute("INSERT INTO file_hashes (file_path, hash, size) VALUES ('a.jpg', NULL, 1000)")
+        conn.commit()
+    membership = src.duplicate_checker.get_membership_filter()
+    membership.save()
+    assert not membership.might_contain("hash:" + "a" * 64)
+
+    # Another process (e.g. verify_full_hashes) records the full hash of the existing row
+    with sqlite3.connect(str(tmp_path / "file_hashes.db")) as other:
+        other.execute("UPDATE file_hashes SET hash = ? WHERE file_path = 'a.jpg'", ("a" * 64,))
+        other.commit()
+    membership.checked_at = 0.0
+    assert membership.might_contain("hash:" + "a" * 64)
+    assert src.duplicate_checker.hash_exists("a" * 64)
+
+    # A fresh process loading the older snapshot catches up too
+    monkeypatch.setattr(src.duplicate_checker, "_membership_filter", None)
+    assert src.duplicate_checker.get_membership_filter().might_contain("hash:" + "a" * 64)
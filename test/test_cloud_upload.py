@@ -1,4 +1,47 @@
-from src.cloud_uploader import upload_to_drive
+from src.cloud_uploader import upload_to_drive, sync_remote_index, upload_files, DriveFolders, DriveBackend
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import src.cloud_uploader
+from src.rate_limiter import RateLimiter
+import email.parser
+import subprocess
+import threading
+import datetime
+import hashlib
+import sys
+import json
+import re
+import time
+import os
+import pytest
+
+class FakeRequest:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+class FakeFiles:
+    """files() resource of a Drive folder, listed two files per page."""
+
+    def __init__(self, remote_files):
+        self.remote_files = remote_files
+        self.list_calls = 0
+
+    def list(self, q, spaces, fields, pageSize, pageToken=None):
+        self.list_calls += 1
+        start = int(pageToken or 0)
+        response = {"files": self.remote_files[start:start + 2]}
+        if start + 2 < len(self.remote_files):
+            response["nextPageToken"] = str(start + 2)
+        return FakeRequest(response)
+
+class FakeService:
+    def __init__(self, remote_files):
+        self.fake_files = FakeFiles(remote_files)
+
+    def files(self):
+        return self.fake_files
 
 def test_cloud_uploader():
     print("Testing cloud_uploader module...")
@@ -16,5 +59,402 @@ def test_cloud_uploader():
     else:
         print("Upload failed or no files uploaded.")
 
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    """Answers the Drive v3 calls made by upload_file, slowly enough to overlap."""
+
+    def _reply(self, status, response=None, headers=None):
+        payload = json.dumps(response).encode() if response is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            server.requests.append(self.path)
+            file_id = f"file{len(server.requests)}"
+        time.sleep(0.05)
+        with server.lock:
+            server.active -= 1
+
+        if self.path.startswith("/batch/"):
+            self._reply_batch(body)
+        elif "uploadType=resumable" in self.path:
+            session_id = str(len(server.sessions))
+            server.sessions[session_id] = {"total": int(self.headers["X-Upload-Content-Length"]), "data": bytearray()}
+            self._reply(200, headers={"Location": f"http://127.0.0.1:{server.server_port}/upload/session/{session_id}"})
+        elif self.path.startswith("/upload/drive/v3/files?") and server.throttled_uploads:
+            server.throttled_uploads -= 1  # Alternate rate limits (with Retry-After) and server errors
+            if server.throttled_uploads % 2:
+                self._reply(429, {"error": {"code": 429, "message": "Rate Limit Exceeded"}}, {"Retry-After": "0"})
+            else:
+                self._reply(503, {"error": {"code": 503, "message": "Backend Error"}})
+        elif self.path.startswith("/upload/drive/v3/files?"):
+            parents = re.search(rb'"parents": \["([^"]+)"\]', body)
+            parent_id = parents.group(1).decode() if parents else None
+            if parent_id in server.missing_folders:
+                self._reply(404, {"error": {"code": 404, "message": f"File not found: {parent_id}."}})
+                return
+            name = re.search(rb'"name": "([^"]+)"', body).group(1).decode()
+            server.uploads[name] = parent_id
+            self._reply(200, {"id": file_id, "size": str(len(body))})
+        elif self.path.startswith("/drive/v3/files?"):
+            metadata = json.loads(body)
+            server.folders[file_id] = (metadata.get("parents", [None])[0], metadata["name"])
+            self._reply(200, {"id": file_id})
+        elif "/permissions" in self.path:
+            self._reply(200, {"id": "anyoneWithLink"})
+        else:
+            self._reply(404, {})
+
+    def _reply_batch(self, body):
+        """Answer a multipart/mixed batch of permission calls, failing the first server.share_failures of them."""
+        server = self.server
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        parts = []
+        for part in message.get_payload():
+            request_line = part.get_payload().lstrip().split("\n", 1)[0]
+            file_id = request_line.split("/files/")[1].split("/")[0]
+            server.batched.append(file_id)
+            if server.share_failures:
+                server.share_failures -= 1
+                server.failed_shares.append(file_id)
+                status, response = "403 Forbidden", {"error": {"code": 403, "message": "rateLimitExceeded"}}
+            else:
+                status, response = "200 OK", {"id": "anyoneWithLink"}
+            parts.append(
+                f"--batch_boundary\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'].strip('<>')}>\r\n\r\n"
+                f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n\r\n{json.dumps(response)}\r\n"
+            )
+        payload = ("".join(parts) + "--batch_boundary--\r\n").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/mixed; boundary=batch_boundary")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        """files().list: the fake Drive has no folders to find by name."""
+        self.server.requests.append(self.path)
+        self._reply(200, {"files": []})
+
+    def do_PUT(self):
+        """Resumable upload session: chunks and status queries."""
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        session = server.sessions[self.path.rsplit("/", 1)[1]]
+        content_range = self.headers["Content-Range"]
+        server.requests.append(f"PUT {content_range}")
+        if not content_range.startswith("bytes */"):
+            start = int(content_range.split()[1].split("-")[0])
+            if server.fail_at is not None and start >= server.fail_at:
+                server.fail_at = None  # Connection "drops" once, before this chunk arrives
+                self._reply(503, {"error": {"code": 503, "message": "Backend Error"}})
+                return
+            assert start == len(session["data"])
+            session["data"] += body
+        if len(session["data"]) == session["total"]:
+            self._reply(200, {"id": "bigfile", "size": str(session["total"])})
+        elif session["data"]:
+            self._reply(308, headers={"Range": f"bytes=0-{len(session['data']) - 1}"})
+        else:
+            self._reply(308)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def fake_drive():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeDriveHandler)
+    server.lock = threading.Lock()
+    server.active = server.max_active = 0
+    server.requests = []
+    server.sessions = {}
+    server.fail_at = None
+    server.batched = []
+    server.share_failures = 0
+    server.uploads = {}
+    server.folders = {}
+    server.missing_folders = set()
+    server.failed_shares = []
+    server.throttled_uploads = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def drive_limiter(monkeypatch):
+    """A fresh Drive limiter per test, with short backoffs."""
+    limiter = RateLimiter(rate=1000, burst=1000, max_concurrency=8, base_delay=0.01, max_delay=0.05)
+    monkeypatch.setattr(src.cloud_uploader.rate_limiter, "_drive_limiter", limiter)
+    return limiter
+
+def fake_drive_client(server):
+    """Build a Drive service from the bundled discovery document, pointed at the fake server."""
+    discovery_module = pytest.importorskip("googleapiclient.discovery")
+    from googleapiclient.discovery_cache import get_static_doc
+    from googleapiclient.http import build_http
+    discovery = json.loads(get_static_doc("drive", "v3"))
+    discovery["rootUrl"] = f"http://127.0.0.1:{server.server_port}/"
+    return discovery_module.build_from_document(discovery, http=build_http())
+
+def test_concurrent_uploads(tmp_path, monkeypatch, fake_drive):
+    print("Testing concurrent uploads against a local fake Drive endpoint...")
+    monkeypatch.setattr(src.cloud_uploader.drive_index, "DRIVE_INDEX_DB_PATH", str(tmp_path / "drive_index.db"))
+    clients = []
+
+    def client_factory():
+        service = fake_drive_client(fake_drive)
+        clients.append(service)
+        return service
+
+    paths = []
+    for i in range(8):
+        path = tmp_path / f"image{i}.jpg"
+        path.write_bytes(os.urandom(1024))
+        paths.append(str(path))
+
+    monkeypatch.setattr(src.cloud_uploader, "SHARE_BATCH_SIZE", 3)
+    fake_drive.share_failures = 1  # Fails inside its batch, then succeeds on its own
+    results = list(upload_files(paths, "folder-id", client_factory, workers=4))
+    assert sorted(path for path, _, _ in results) == sorted(paths)
+    assert all(result and not reused for _, result, reused in results)
+    assert len({link for _, (_, link), _ in results}) == 8
+    assert fake_drive.max_active > 1
+    assert len(clients) <= 5  # One client per worker plus one for sharing, each reused
+
+    # Eight creates, permissions in batches of up to three plus one single retry
+    uploads = [request for request in fake_drive.requests if request.startswith("/upload/")]
+    batches = [request for request in fake_drive.requests if request.startswith("/batch/")]
+    singles = [request for request in fake_drive.requests if "/permissions" in request]
+    assert len(uploads) == 8
+    assert len(batches) >= 3
+    assert len(set(fake_drive.batched)) == 8
+    assert len(singles) == 1 and f"/files/{fake_drive.failed_shares[0]}/" in singles[0]
+
+def test_share_folder_once(tmp_path, monkeypatch, fake_drive):
+    print("Testing folder-level sharing...")
+    monkeypatch.setattr(src.cloud_uploader.drive_index, "DRIVE_INDEX_DB_PATH", str(tmp_path / "drive_index.db"))
+    monkeypatch.setattr(src.cloud_uploader, "SHARE_MODE", "folder")
+    service = fake_drive_client(fake_drive)
+    path = tmp_path / "image1.jpg"
+    path.write_bytes(os.urandom(1024))
+
+    share = src.cloud_uploader.needs_file_sharing(service, "folder-id")
+    assert not share
+    results = list(upload_files([str(path)], "folder-id", lambda: fake_drive_client(fake_drive), share=share))
+    assert results[0][1][0] == "image1.jpg"
+    assert [request for request in fake_drive.requests if "permissions" in request or "batch" in request] == [
+        "/drive/v3/files/folder-id/permissions?fields=id&alt=json"]
+
+def test_resumable_upload(tmp_path, monkeypatch, fake_drive):
+    print("Testing resumable uploads that continue after a dropped connection...")
+    monkeypatch.setattr(src.cloud_uploader.drive_index, "DRIVE_INDEX_DB_PATH", str(tmp_path / "drive_index.db"))
+    monkeypatch.setattr(src.cloud_uploader, "UPLOAD_CHUNK_SIZE", 256 * 1024)
+    monkeypatch.setattr(src.cloud_uploader, "RESUMABLE_UPLOAD_MIN_SIZE", 256 * 1024)
+    content = os.urandom(1024 * 1024 + 100)
+    path = tmp_path / "video1.mp4"
+    path.write_bytes(content)
+
+    fake_drive.fail_at = 512 * 1024
+    monkeypatch.setattr(src.cloud_uploader.rate_limiter, "_drive_limiter", RateLimiter(max_retries=0))  # Give up
+    assert src.cloud_uploader.upload_file(fake_drive_client(fake_drive), str(path), "folder-id") is None
+    stat = os.stat(path)
+    session = src.cloud_uploader.drive_index.load_session(str(path), "folder-id", stat.st_size, stat.st_mtime_ns)
+    assert session[1] == 512 * 1024
+
+    # Next run, new client: the server is asked for its offset and only the rest is sent
+    fake_drive.requests.clear()
+    result = src.cloud_uploader.upload_file(fake_drive_client(fake_drive), str(path), "folder-id")
+    assert result == ("video1.mp4", "https://drive.google.com/file/d/bigfile/view?usp=sharing")
+    puts = [request for request in fake_drive.requests if request.startswith("PUT")]
+    assert puts[0] == f"PUT bytes */{len(content)}"
+    assert puts[1].startswith(f"PUT bytes {512 * 1024}-")
+    assert bytes(fake_drive.sessions["0"]["data"]) == content
+    assert src.cloud_uploader.drive_index.load_session(str(path), "folder-id", stat.st_size, stat.st_mtime_ns) is None
+
+def test_throttled_uploads(tmp_path, monkeypatch, fake_drive, drive_limiter):
+    print("Testing backoff and retries on 429 and 503 responses...")
+    monkeypatch.setattr(src.cloud_uploader.drive_index, "DRIVE_INDEX_DB_PATH", str(tmp_path / "drive_index.db"))
+    paths = []
+    for i in range(4):
+        path = tmp_path / f"image{i}.jpg"
+        path.write_bytes(os.urandom(1024))
+        paths.append(str(path))
+
+    fake_drive.throttled_uploads = 4
+    results = list(upload_files(paths, "folder-id", lambda: fake_drive_client(fake_drive), workers=2))
+    assert all(result for _, result, _ in results) and len(results) == 4
+    assert len([request for request in fake_drive.requests if request.startswith("/upload/")]) == 8
+
+    stats = src.cloud_uploader.request_stats()
+    assert stats["throttles"] == 2  # The 429s; the 503s are retried without shrinking the window
+    assert stats["retries"] == 4 and stats["failures"] == 0
+    assert stats["concurrency"] < 8
+
+def test_mirrored_folders(tmp_path, monkeypatch, fake_drive):
+    print("Testing cached, mirrored Drive folders...")
+    monkeypatch.setattr(src.cloud_uploader.drive_index, "DRIVE_INDEX_DB_PATH", str(tmp_path / "drive_index.db"))
+    base = tmp_path / "backup"
+    paths = []
+    for rel_path in ["image0.jpg", "100CANON/image1.jpg", "100CANON/image2.jpg", "101CANON/image3.jpg"]:
+        path = base / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(1024))
+        paths.append(str(path))
+    client_factory = lambda: fake_drive_client(fake_drive)
+
+    folders = DriveFolders("Photos_2025", str(base), mirror=True)
+    root_id = folders.resolve(client_factory())
+    folders.resolve_all(client_factory, {folders.rel_dir(path) for path in paths})
+    assert set(fake_drive.folders.values()) == {(None, "Photos_2025"), (root_id, "100CANON"), (root_id, "101CANON")}
+    results = list(upload_files(paths, folders, client_factory, share=False))
+    assert all(result for _, result, _ in results)
+    assert fake_drive.uploads["image0.jpg"] == root_id
+    assert fake_drive.uploads["image1.jpg"] == fake_drive.uploads["image2.jpg"] == folders.ids["100CANON"]
+    assert fake_drive.uploads["image3.jpg"] == folders.ids["101CANON"]
+
+    # Warm run: every folder comes from the cache, no list or create calls
+    fake_drive.requests.clear()
+    warm = DriveFolders("Photos_2025", str(base), mirror=True)
+    warm.resolve(client_factory())
+    warm.resolve_all(client_factory, {warm.rel_dir(path) for path in paths})
+    assert warm.ids == folders.ids
+    assert fake_drive.requests == []
+
+    # A folder deleted on Drive is noticed on upload, recreated once and the upload retried
+    fake_drive.missing_folders = {folders.ids["101CANON"]}
+    stale = DriveFolders("Photos_2025", str(base), mirror=True)
+    results = list(upload_files(paths[3:], stale, client_factory, share=False))
+    assert results[0][1] is not None
+    assert stale.ids["101CANON"] != folders.ids["101CANON"]
+    assert fake_drive.uploads["image3.jpg"] == stale.ids["101CANON"]
+
+def test_lazy_google_imports(tmp_path):
+    print("Testing that importing the tool doesn't load the Google libraries...")
+    src_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    code = ("import sys, main, cloud_uploader; "
+            "loaded = [name for name in sys.modules if name.startswith(('google', 'googleapiclient'))]; "
+            "assert not loaded, loaded")
+    subprocess.run([sys.executable, "-c", code], cwd=str(tmp_path), check=True,
+                   env=dict(os.environ, PYTHONPATH=src_dir))
+
+def test_cached_client_factory(tmp_path, monkeypatch):
+    print("Testing the process-wide Drive client factory...")
+    pytest.importorskip("googleapiclient.discovery")
+    token_file = tmp_path / "token.json"
+    expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=2)
+    token_file.write_text(json.dumps({
+        "token": "access-token", "refresh_token": "refresh-token", "client_id": "id", "client_secret": "secret",
+        "token_uri": "https://oauth2.googleapis.com/token", "expiry": expiry.isoformat() + "Z",
+    }))
+    monkeypatch.setattr(src.cloud_uploader, "TOKEN_FILE", str(token_file))
+    monkeypatch.setattr(src.cloud_uploader, "_client_factory", None)
+    try:
+        factory = src.cloud_uploader.drive_client_factory()
+        assert factory is not None and src.cloud_uploader.drive_client_factory() is factory
+        first, second = factory(), factory()
+        assert first is not second and first._http is not second._http  # One transport per worker
+        assert first.files().list(q="x").uri.startswith("https://www.googleapis.com/drive/v3/files")
+        # The token is valid for two hours: its refresh is scheduled shortly before it expires
+        assert src.cloud_uploader._refresh_timer.interval == pytest.approx(
+            7200 - src.cloud_uploader.TOKEN_REFRESH_MARGIN, abs=60)
+    finally:
+        src.cloud_uploader._refresh_timer.cancel()
+
+def test_background_token_refresh(tmp_path, monkeypatch):
+    print("Testing proactive token refresh...")
+    monkeypatch.setattr(src.cloud_uploader, "TOKEN_FILE", str(tmp_path / "token.json"))
+    refreshed = threading.Event()
+
+    class FakeCredentials:
+        refresh_token = "refresh-token"
+        expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(seconds=60)
+
+        def refresh(self, request):
+            self.expiry += datetime.timedelta(hours=1)
+            refreshed.set()
+
+        def to_json(self):
+            return json.dumps({"token": "new-token"})
+
+    src.cloud_uploader._schedule_refresh(FakeCredentials())  # Expires within the margin: refresh now
+    first_timer = src.cloud_uploader._refresh_timer
+    assert refreshed.wait(5)
+    deadline = time.time() + 5
+    while src.cloud_uploader._refresh_timer is first_timer and time.time() < deadline:
+        time.sleep(0.01)
+    src.cloud_uploader._refresh_timer.cancel()  # The next refresh, an hour from now
+    assert src.cloud_uploader._refresh_timer.interval > 3000
+    assert json.loads((tmp_path / "token.json").read_text()) == {"token": "new-token"}
+
+def test_remote_dedup(tmp_path, monkeypatch):
+    print("Testing reuse of files already on Google Drive...")
+    monkeypatch.setattr(src.cloud_uploader.drive_index, "DRIVE_INDEX_DB_PATH", str(tmp_path / "drive_index.db"))
+    uploaded = tmp_path / "image1.jpg"
+    uploaded.write_bytes(os.urandom(2048))
+    same_size = tmp_path / "image2.jpg"
+    same_size.write_bytes(os.urandom(2048))
+    new_file = tmp_path / "video1.mp4"
+    new_file.write_bytes(os.urandom(4096))
+    remote_files = [{"id": f"other{i}", "name": f"other{i}.jpg", "md5Checksum": "0" * 32, "size": "1000"}
+                    for i in range(4)]
+    remote_files.append({"id": "abc123", "name": "image1.jpg", "size": "2048",
+                         "md5Checksum": hashlib.md5(uploaded.read_bytes()).hexdigest()})
+    service = FakeService(remote_files)
+
+    assert sync_remote_index(service, "folder-id")
+    assert service.fake_files.list_calls == 3  # Five files, two per page
+    backend = DriveBackend("folder-id", lambda: service, remote_dedup=True)
+    assert backend.find_existing("folder-id", str(uploaded)) == "abc123"
+    assert backend.find_existing("folder-id", str(same_size)) is None
+    assert backend.find_existing("folder-id", str(new_file)) is None
+
+    # A fresh listing is reused instead of fetched again
+    assert sync_remote_index(service, "folder-id")
+    assert service.fake_files.list_calls == 3
+
 if __name__ == "__main__":
-    test_cloud_uploader()
\ No newline at end of file
+    test_cloud_uploader()
+def test_packed_uploads(tmp_path, monkeypatch, fake_drive):
+    print("Testing pack mode: small files uploaded in one archive, videos on their own...")
+    import tarfile
+    import io
+    monkeypatch.setattr(src.cloud_uploader.drive_index, "DRIVE_INDEX_DB_PATH", str(tmp_path / "drive_index.db"))
+    monkeypatch.setattr(src.cloud_uploader.storage.packer, "PACK_INDEX_DB_PATH", str(tmp_path / "pack_index.db"))
+    monkeypatch.setattr(src.cloud_uploader, "UPLOAD_CHUNK_SIZE", 256 * 1024)
+    monkeypatch.setattr(src.cloud_uploader, "RESUMABLE_UPLOAD_MIN_SIZE", 256 * 1024)
+    paths = []
+    for i in range(8):
+        path = tmp_path / f"image{i}.jpg"
+        path.write_bytes(os.urandom(100 * 1024))
+        paths.append(str(path))
+    video = tmp_path / "video1.mp4"
+    video.write_bytes(os.urandom(1024))
+    paths.append(str(video))
+
+    backend = src.cloud_uploader.DriveBackend("folder-id", lambda: fake_drive_client(fake_drive))
+    results = list(src.cloud_uploader.storage.upload_files(paths, backend, workers=2, pack=True))
+    assert sorted(path for path, _, _ in results) == sorted(paths)
+    links = {os.path.basename(path): result[1] for path, result, _ in results}
+    assert links["image0.jpg"] == links["image7.jpg"] == "https://drive.google.com/file/d/bigfile/view?usp=sharing"
+
+    # One resumable archive upload in chunks, one upload for the video, and both shared in one batch
+    uploads = [request for request in fake_drive.requests if request.startswith("/upload/")]
+    assert len(uploads) == 2 and list(fake_drive.uploads) == ["video1.mp4"]
+    assert len([request for request in fake_drive.requests if request.startswith("PUT bytes")]) > 1
+    assert sorted(fake_drive.batched) == sorted(["bigfile", links["video1.mp4"].split("/")[5]])
+    with tarfile.open(fileobj=io.BytesIO(bytes(fake_drive.sessions["0"]["data"]))) as tar:
+        assert tar.getnames()[:-1] == [f"image{i}.jpg" for i in range(8)]
+        assert tar.extractfile("image5.jpg").read() == open(paths[5], "rb").read()
@@ -0,0 +1,198 @@
+from src.duplicate_checker import find_duplicates, hash_exists, compute_file_hash, init_database, connect_database
+from src.file_manager import copy_and_hash_files
+import src.duplicate_checker
+import src.file_manager
+import sqlite3
+import os
+
+def test_copy_and_hash_skips_known(tmp_path, monkeypatch):
+    print("Testing single-pass copy and hash...")
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+    monkeypatch.setattr(src.duplicate_checker.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+    monkeypatch.setattr(src.file_manager, "DESTINATION_PATH", str(tmp_path / "backup"))
+    monkeypatch.setattr(src.file_manager.import_manifest, "MANIFEST_DB_PATH", str(tmp_path / "import_manifest.db"))
+    source = tmp_path / "card"
+    source.mkdir()
+    (source / "image1.jpg").write_bytes(os.urandom(4096))
+    (source / "image2.jpg").write_bytes(os.urandom(4096))
+
+    success, message, copied_files, file_hashes = copy_and_hash_files(str(source), skip_known=hash_exists)
+    assert success
+    assert len(copied_files) == 2
+    for file_path in copied_files:
+        assert file_hashes[file_path] == compute_file_hash(file_path)
+
+    unique_files, duplicate_files = find_duplicates(copied_files, file_hashes)
+    assert sorted(unique_files) == sorted(copied_files)
+    assert duplicate_files == []
+
+    # Same card again, renamed: known content never reaches the backup folder
+    (source / "image1.jpg").rename(source / "image1_copy.jpg")
+    success, message, copied_files, file_hashes = copy_and_hash_files(str(source), skip_known=hash_exists,
+                                                                      incremental=False)
+    assert success
+    assert copied_files == []
+    assert "2 already backed up" in message
+    assert not os.path.exists(tmp_path / "backup" / "Photos_2025" / "image1_copy.jpg")
+
+def test_migrate_legacy_database(tmp_path, monkeypatch):
+    print("Testing migration of the original file_hashes.db layout...")
+    db_path = str(tmp_path / "file_hashes.db")
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", db_path)
+    monkeypatch.setattr(src.duplicate_checker.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+    image = tmp_path / "image1.jpg"
+    image.write_bytes(os.urandom(1024))
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE file_hashes (file_path TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+        conn.execute("INSERT INTO file_hashes VALUES (?, ?)", (str(image), compute_file_hash(str(image))))
+        conn.execute("INSERT INTO file_hashes VALUES (?, ?)", ("C:/Media_Backup/gone.jpg", "abc"))
+
+    init_database()
+    init_database()  # Already migrated: nothing to do
+
+    with connect_database() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        row = conn.execute("SELECT size FROM file_hashes WHERE file_path = ?", (str(image),)).fetchone()
+        assert row[0] == 1024
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT file_path FROM file_hashes WHERE hash = ?", ("abc",)).fetchall()
+        assert "idx_file_hashes_hash" in str(plan)
+    assert hash_exists("abc")
+
+def test_tiered_duplicate_check(tmp_path, monkeypatch):
+    print("Testing size/partial/full hash tiers...")
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+    monkeypatch.setattr(src.duplicate_checker.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+    monkeypatch.setattr(src.duplicate_checker, "PARTIAL_HASH_BLOCK_SIZE", 1024)
+    monkeypatch.setattr(src.duplicate_checker.hash_cache, "HASH_CACHE_ENABLED", False)
+    full_hashes = []
+    hash_file = src.duplicate_checker.hash_engine.hash_file
+    monkeypatch.setattr(src.duplicate_checker.hash_engine, "hash_file",
+                        lambda file_path, *args: full_hashes.append(file_path) or hash_file(file_path, *args))
+
+    body = os.urandom(64 * 1024)
+    files = {
+        "video1.mp4": body,
+        "image1.jpg": os.urandom(1000),
+        "video2.mp4": body[:-1] + bytes([body[-1] ^ 0xFF]),  # Same size, other tail
+        "video1_copy.mp4": body,
+    }
+    for name, content in files.items():
+        (tmp_path / name).write_bytes(content)
+    paths = [str(tmp_path / name) for name in files]
+
+    unique_files, duplicate_files = find_duplicates(paths[:2])
+    assert len(unique_files) == 2
+    assert full_hashes == []  # Unique sizes: no file read in full
+
+    unique_files, duplicate_files = find_duplicates(paths[2:3])
+    assert unique_files == paths[2:3]
+    assert full_hashes == []  # Same size, different tail: still no full read
+
+    unique_files, duplicate_files = find_duplicates(paths[3:])
+    assert duplicate_files == paths[3:]
+    assert sorted(full_hashes) == sorted([paths[0], paths[3]])
+
+def test_bulk_duplicate_check(tmp_path, monkeypatch):
+    print("Testing batched, set-based duplicate check...")
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+    monkeypatch.setattr(src.duplicate_checker.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+    content = os.urandom(8192)
+    names = ["image1.jpg", "image2.jpg", "image1_copy.jpg", "image3.jpg", "image1_again.jpg"]
+    for name in names:
+        (tmp_path / name).write_bytes(content if "image1" in name else os.urandom(8192))
+    paths = [str(tmp_path / name) for name in names]
+
+    # Batches of two: duplicates are found inside a batch and across batches
+    unique_files, duplicate_files = find_duplicates(paths + [str(tmp_path / "missing.jpg")], batch_size=2)
+    assert unique_files == [paths[0], paths[1], paths[3]]
+    assert duplicate_files == [paths[2], paths[4]]
+
+    # Same result through the streaming checker
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes_stream.db"))
+    results = list(src.duplicate_checker.iter_check_duplicates(paths))
+    assert [path for path, is_duplicate in results if is_duplicate] == duplicate_files
+
+def test_fast_fingerprint_for_large_files(tmp_path, monkeypatch):
+    print("Testing sampled fingerprints for large videos...")
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+    monkeypatch.setattr(src.duplicate_checker.hash_cache, "HASH_CACHE_ENABLED", False)
+    monkeypatch.setattr(src.duplicate_checker, "FAST_FINGERPRINT_MIN_SIZE", 256 * 1024)
+    monkeypatch.setattr(src.duplicate_checker, "FAST_FINGERPRINT_CHUNKS", 4)
+    monkeypatch.setattr(src.duplicate_checker, "FAST_FINGERPRINT_CHUNK_SIZE", 4096)
+    monkeypatch.setattr(src.duplicate_checker, "DEDUP_STRATEGY", "full")
+    full_hashes = []
+    hash_file = src.duplicate_checker.hash_engine.hash_file
+    monkeypatch.setattr(src.duplicate_checker.hash_engine, "hash_file",
+                        lambda file_path, *args: full_hashes.append(file_path) or hash_file(file_path, *args))
+
+    body = bytearray(os.urandom(1024 * 1024))
+    (tmp_path / "video1.mp4").write_bytes(body)
+    body[300 * 1024] ^= 0xFF  # Between two sampled chunks: same fingerprint, other content
+    (tmp_path / "video2.mov").write_bytes(body)
+    (tmp_path / "image1.jpg").write_bytes(os.urandom(1000))
+    paths = [str(tmp_path / name) for name in ["video1.mp4", "image1.jpg"]]
+
+    results = list(src.duplicate_checker.iter_check_duplicates(paths))
+    assert not any(is_duplicate for _, is_duplicate in results)
+    assert full_hashes == [paths[1]]  # Only the small file is hashed in full up front
+    with connect_database() as conn:
+        row = conn.execute("SELECT hash, signature_mode FROM file_hashes WHERE file_path = ?", (paths[0],)).fetchone()
+    assert row == (None, "sampled:4x4096")
+
+    # A fingerprint collision is settled by the full hashes of both files
+    unique_files, duplicate_files = find_duplicates([str(tmp_path / "video2.mov")])
+    assert unique_files == [str(tmp_path / "video2.mov")]
+    assert sorted(full_hashes[1:]) == sorted([paths[0], str(tmp_path / "video2.mov")])
+
+    # The background pass hashes what is still only fingerprinted
+    (tmp_path / "video3.mp4").write_bytes(os.urandom(512 * 1024))
+    find_duplicates([str(tmp_path / "video3.mp4")])
+    assert src.duplicate_checker.verify_full_hashes() == 1
+    assert hash_exists(compute_file_hash(str(tmp_path / "video3.mp4")))
+
+def test_match_after_backup_pruned(tmp_path, monkeypatch):
+    print("Testing matches against backup files that are gone...")
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+    monkeypatch.setattr(src.duplicate_checker.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+    monkeypatch.setattr(src.duplicate_checker, "PARTIAL_HASH_BLOCK_SIZE", 1024)
+    content = os.urandom(8192)
+    (tmp_path / "card.jpg").write_bytes(content)
+    backup = tmp_path / "IMG_0001.jpg"
+    src.file_manager.copy_file_with_hash(str(tmp_path / "card.jpg"), str(backup))
+
+    # Checked without its hash: the one cached while copying is recorded
+    unique_files, duplicate_files = find_duplicates([str(backup)])
+    assert unique_files == [str(backup)]
+    assert hash_exists(compute_file_hash(str(tmp_path / "card.jpg")))
+
+    # The backup copy is pruned; the same content is still a duplicate
+    os.remove(backup)
+    (tmp_path / "IMG_0002.jpg").write_bytes(content)
+    unique_files, duplicate_files = find_duplicates([str(tmp_path / "IMG_0002.jpg")])
+    assert duplicate_files == [str(tmp_path / "IMG_0002.jpg")]
+    results = list(src.duplicate_checker.iter_check_duplicates([str(tmp_path / "IMG_0002.jpg")]))
+    assert results == [(str(tmp_path / "IMG_0002.jpg"), True)]
+
+def test_hash_exists_fresh_install(tmp_path, monkeypatch, caplog):
+    print("Testing hash lookups before the database is initialized...")
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+    monkeypatch.setattr(src.duplicate_checker, "BLOOM_FILTER_ENABLED", False)
+    assert not hash_exists("0" * 64)
+    assert not [record for record in caplog.records if record.levelname == "ERROR"]
+
+def test_unverifiable_rows(tmp_path, monkeypatch):
+    print("Testing signature-only rows whose backup file was deleted...")
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+    monkeypatch.setattr(src.duplicate_checker.hash_cache, "HASH_CACHE_ENABLED", False)
+    paths = []
+    for name in ("image1.jpg", "image2.jpg"):
+        (tmp_path / name).write_bytes(os.urandom(2048))
+        paths.append(str(tmp_path / name))
+    find_duplicates(paths)
+    assert src.duplicate_checker.count_unverified() == 2
+
+    os.remove(paths[1])  # Pruned backup copy: it can never get a full hash
+    assert src.duplicate_checker.verify_full_hashes() == 1
+    assert src.duplicate_checker.count_unverified() == 0
+    with connect_database() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM file_hashes WHERE hash IS NULL").fetchone()[0] == 1
@@ -1,17 +1,139 @@
-from src.file_manager import copy_and_filter_files
+from src.file_manager import copy_files, copy_file
+import src.file_manager
+import errno
+import hashlib
 import os
 
 def test_file_manager():
     print("Testing file_manager module...")
     test_folder = "F:\\TestCard\\Photos_2025\\"
-    success, backup_folder, media_files = copy_and_filter_files(test_folder)
+    success, message, media_files = copy_files(test_folder)
     if success:
-        print(f"Backup folder: {backup_folder}")
-        print(f"Media files found: {len(media_files)}")
+        print(f"Copy result: {message}")
+        print(f"Media files copied: {len(media_files)}")
         if media_files:
             print(f"Sample media files: {[os.path.basename(f) for f in media_files[:5]]}")
     else:
         print("File copy failed or no files found.")
 
+def test_parallel_copy(tmp_path, monkeypatch):
+    print("Testing parallel copy...")
+    source = tmp_path / "card"
+    (source / "DCIM").mkdir(parents=True)
+    (source / "DCIM" / "video1.mp4").write_bytes(os.urandom(256 * 1024))
+    (source / "image1.jpg").write_bytes(os.urandom(1024))
+    (source / "notes.txt").write_bytes(b"not media")
+    monkeypatch.setattr(src.file_manager, "DESTINATION_PATH", str(tmp_path / "backup"))
+    monkeypatch.setattr(src.file_manager.import_manifest, "MANIFEST_DB_PATH", str(tmp_path / "import_manifest.db"))
+
+    success, message, copied_files = copy_files(str(source), workers=2)
+    assert success
+    assert sorted(os.path.basename(f) for f in copied_files) == ["image1.jpg", "video1.mp4"]
+    for dest_path in copied_files:
+        name = os.path.basename(dest_path)
+        src_path = source / "DCIM" / name if name.endswith(".mp4") else source / name
+        assert open(dest_path, "rb").read() == src_path.read_bytes()
+
+def test_kernel_copy_fallback(tmp_path, monkeypatch):
+    print("Testing kernel copy with unsupported filesystem...")
+    src_path = tmp_path / "video1.mp4"
+    src_path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    os.utime(src_path, ns=(1_600_000_000_000_000_000, 1_600_000_000_000_000_000))
+
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(src.file_manager, "COPY_BACKEND", "kernel")
+    monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+    monkeypatch.setattr(os, "sendfile", unsupported, raising=False)
+
+    dest_path = tmp_path / "copy.mp4"
+    copy_file(str(src_path), str(dest_path), chunk_size=1024 * 1024)
+    assert dest_path.read_bytes() == src_path.read_bytes()
+    assert os.stat(dest_path).st_mtime_ns == os.stat(src_path).st_mtime_ns
+
+    # A destination (e.g. a NAS share) that takes fewer bytes per write than asked
+    real_write = os.write
+    monkeypatch.setattr(os, "write", lambda fd, data: real_write(fd, data[:1000]))
+    copy_file(str(src_path), str(dest_path), chunk_size=1024 * 1024)
+    assert dest_path.read_bytes() == src_path.read_bytes()
+
+def test_copy_with_hash_short_writes(tmp_path, monkeypatch):
+    print("Testing copy-and-hash to a destination taking short writes...")
+    monkeypatch.setattr(src.file_manager.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+    src_path = tmp_path / "video1.mp4"
+    src_path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    real_write = os.write
+    monkeypatch.setattr(os, "write", lambda fd, data: real_write(fd, data[:1000]))
+
+    dest_path = tmp_path / "copy.mp4"
+    file_hash, kept = src.file_manager.copy_file_with_hash(str(src_path), str(dest_path))
+    assert kept and dest_path.read_bytes() == src_path.read_bytes()
+    assert file_hash == hashlib.sha256(src_path.read_bytes()).hexdigest()
+
+def test_incremental_reimport(tmp_path, monkeypatch):
+    print("Testing incremental re-import...")
+    source = tmp_path / "card"
+    source.mkdir()
+    (source / "image1.jpg").write_bytes(os.urandom(1024))
+    (source / "image2.jpg").write_bytes(os.urandom(1024))
+    monkeypatch.setattr(src.file_manager, "DESTINATION_PATH", str(tmp_path / "backup"))
+    monkeypatch.setattr(src.file_manager.import_manifest, "MANIFEST_DB_PATH", str(tmp_path / "import_manifest.db"))
+
+    success, message, copied_files = copy_files(str(source))
+    assert success and len(copied_files) == 2
+
+    # Nothing changed: no file is copied again
+    success, message, copied_files = copy_files(str(source))
+    assert success and copied_files == []
+    assert "2 unchanged" in message
+
+    # A modified file and a deleted backup copy are picked up again
+    (source / "image1.jpg").write_bytes(os.urandom(2048))
+    os.remove(tmp_path / "backup" / "Photos_2025" / "image2.jpg")
+    success, message, copied_files = copy_files(str(source))
+    assert sorted(os.path.basename(f) for f in copied_files) == ["image1.jpg", "image2.jpg"]
+
+    success, message, copied_files = copy_files(str(source), incremental=False)
+    assert len(copied_files) == 2
+
 if __name__ == "__main__":
-    test_file_manager()
\ No newline at end of file
+    test_file_manager()
+
+def test_deferred_imports(tmp_path, monkeypatch):
+    print("Testing imports recorded only once files are handed on...")
+    source = tmp_path / "card"
+    source.mkdir()
+    (source / "image1.jpg").write_bytes(os.urandom(1024))
+    (source / "image2.jpg").write_bytes(os.urandom(1024))
+    monkeypatch.setattr(src.file_manager, "DESTINATION_PATH", str(tmp_path / "backup"))
+    monkeypatch.setattr(src.file_manager.import_manifest, "MANIFEST_DB_PATH", str(tmp_path / "import_manifest.db"))
+    monkeypatch.setattr(src.file_manager.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+
+    stats = {}
+    copied = [dest_path for dest_path, _ in src.file_manager.iter_copy_and_hash(
+        str(source), stats=stats, defer_imports=True)]
+    assert len(copied) == 2 and len(stats["imports"]) == 2
+    assert src.file_manager.import_manifest.load_manifest(str(source)) == {}
+
+    # Only the file handed on is skipped by the next import; the other one is copied again
+    src.file_manager.record_handoffs(str(source), stats, copied[:1])
+    stats = {}
+    recopied = [dest_path for dest_path, _ in src.file_manager.iter_copy_and_hash(str(source), stats=stats)]
+    assert recopied == copied[1:] and stats["unchanged"] == 1
+
+def test_mirror_folders(tmp_path, monkeypatch):
+    print("Testing copies that keep the card's subfolders...")
+    source = tmp_path / "card"
+    for folder in ["100CANON", "101CANON"]:
+        (source / folder).mkdir(parents=True)
+        (source / folder / "IMG_0001.jpg").write_bytes(os.urandom(1024))
+    monkeypatch.setattr(src.file_manager, "DESTINATION_PATH", str(tmp_path / "backup"))
+    monkeypatch.setattr(src.file_manager, "MIRROR_FOLDERS", True)
+    monkeypatch.setattr(src.file_manager.import_manifest, "MANIFEST_DB_PATH", str(tmp_path / "import_manifest.db"))
+
+    success, message, copied_files = copy_files(str(source))
+    assert success
+    backup = src.file_manager.backup_folder()
+    assert sorted(os.path.relpath(f, backup) for f in copied_files) == [
+        os.path.join("100CANON", "IMG_0001.jpg"), os.path.join("101CANON", "IMG_0001.jpg")]
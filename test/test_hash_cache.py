@@ -0,0 +1,46 @@
+from src.hash_engine import hash_files
+import src.hash_engine
+import hashlib
+import os
+
+def test_hash_cache(tmp_path, monkeypatch):
+    print("Testing persistent hash cache...")
+    monkeypatch.setattr(src.hash_engine.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+    path = tmp_path / "video1.mp4"
+    path.write_bytes(os.urandom(256 * 1024))
+
+    stats = {}
+    assert dict(hash_files([str(path)], stats=stats))[str(path)] == hashlib.sha256(path.read_bytes()).hexdigest()
+    assert stats["files"] == 1
+
+    # Unchanged file: answered from the cache without reading it
+    assert dict(hash_files([str(path)], stats=stats))[str(path)] == hashlib.sha256(path.read_bytes()).hexdigest()
+    assert stats["files"] == 0
+
+    # Modified file: the stale entry is dropped and the file is read again
+    path.write_bytes(os.urandom(128 * 1024))
+    assert dict(hash_files([str(path)], stats=stats))[str(path)] == hashlib.sha256(path.read_bytes()).hexdigest()
+    assert stats["files"] == 1
+
+def test_hash_cache_connection(tmp_path, monkeypatch):
+    print("Testing that hashing threads share one cache connection...")
+    monkeypatch.setattr(src.hash_engine.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+    paths = []
+    for i in range(8):
+        path = tmp_path / f"image{i}.jpg"
+        path.write_bytes(os.urandom(1024 + i))
+        paths.append(str(path))
+
+    def open_handles():
+        fd_dir = "/proc/self/fd"
+        return sum(os.path.realpath(os.path.join(fd_dir, fd)).startswith(str(tmp_path / "hash_cache.db"))
+                   for fd in os.listdir(fd_dir) if os.path.exists(os.path.join(fd_dir, fd)))
+
+    assert len(dict(hash_files(paths, workers=4))) == 8
+    if os.path.isdir("/proc/self/fd"):
+        assert open_handles() <= 3  # Database, WAL and shared-memory files of one connection
+    src.hash_engine.hash_cache.close()
+    if os.path.isdir("/proc/self/fd"):
+        assert open_handles() == 0
+    assert src.hash_engine.hash_cache.lookup(paths[0])  # Reopened on demand
+    src.hash_engine.hash_cache.close()
@@ -0,0 +1,37 @@
+from src.hash_engine import hash_file, hash_files
+import src.hash_engine
+import hashlib
+import os
+
+def test_hash_file(tmp_path):
+    print("Testing hash_file with buffered and mmap reads...")
+    content = os.urandom(3 * 1024 * 1024 + 5)
+    path = tmp_path / "video1.mp4"
+    path.write_bytes(content)
+    expected = hashlib.sha256(content).hexdigest()
+    assert hash_file(str(path), buffer_size=64 * 1024) == expected
+    assert hash_file(str(path), buffer_size=64 * 1024, use_mmap=True) == expected
+
+    empty = tmp_path / "empty.jpg"
+    empty.write_bytes(b"")
+    assert hash_file(str(empty), use_mmap=True) == hashlib.sha256(b"").hexdigest()
+
+def test_hash_files(tmp_path, monkeypatch):
+    print("Testing parallel hashing...")
+    monkeypatch.setattr(src.hash_engine.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+    expected = {}
+    for i in range(10):
+        content = os.urandom(100 * 1024 + i)
+        path = tmp_path / f"image{i}.jpg"
+        path.write_bytes(content)
+        expected[str(path)] = hashlib.sha256(content).hexdigest()
+    items = list(expected) + [(str(tmp_path / "known.jpg"), "abc"), str(tmp_path / "missing.jpg")]
+
+    stats = {}
+    results = dict(hash_files(items, workers=3, stats=stats))
+    assert results.pop(str(tmp_path / "known.jpg")) == "abc"
+    assert results.pop(str(tmp_path / "missing.jpg")) is None
+    assert results == expected
+    assert stats["files"] == 10
+    assert stats["bytes"] == sum(os.path.getsize(path) for path in expected)
+    print(f"Throughput: {stats['mb_per_s']:.1f} MB/s")
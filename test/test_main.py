@@ -0,0 +1,142 @@
+from src.main import run_pipeline
+import src.main
+import pytest
+import os
+
+@pytest.fixture
+def isolated_dbs(tmp_path, monkeypatch):
+    """Point the backup folder and every database the pipeline uses into tmp_path."""
+    monkeypatch.setattr(src.main.file_manager, "DESTINATION_PATH", str(tmp_path / "backup"))
+    monkeypatch.setattr(src.main.file_manager.import_manifest, "MANIFEST_DB_PATH", str(tmp_path / "import_manifest.db"))
+    monkeypatch.setattr(src.main.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+    monkeypatch.setattr(src.main.duplicate_checker.hash_cache, "HASH_CACHE_DB_PATH", str(tmp_path / "hash_cache.db"))
+    monkeypatch.setattr(src.main.upload_queue, "UPLOAD_QUEUE_DB_PATH", str(tmp_path / "upload_queue.db"))
+    yield
+    src.main.upload_queue.close()
+
+@pytest.mark.parametrize("backend", ["drive", "local"])
+def test_run_pipeline(tmp_path, isolated_dbs, monkeypatch, backend):
+    print(f"Testing streaming pipeline ({backend} storage)...")
+    monkeypatch.setattr(src.main.storage, "STORAGE_BACKEND", backend)
+    monkeypatch.setattr(src.main.storage, "LOCAL_STORAGE_PATH", str(tmp_path / "uploaded"))
+    monkeypatch.setattr(src.main.cloud_uploader, "drive_client_factory", lambda: lambda: "service")
+    monkeypatch.setattr(src.main.cloud_uploader, "create_drive_folder", lambda service, name, parent_id=None: "folder-id")
+    monkeypatch.setattr(src.main.cloud_uploader, "sync_remote_index", lambda service, folder_id: False)
+    monkeypatch.setattr(src.main.cloud_uploader, "needs_file_sharing", lambda service, folder_id: True)
+    monkeypatch.setattr(src.main.cloud_uploader, "_upload_media",
+                        lambda service, file_path, folder_id: f"id-{os.path.basename(file_path)}")
+    monkeypatch.setattr(src.main.cloud_uploader, "share_files", lambda service, file_ids: set())
+
+    source = tmp_path / "card"
+    (source / "DCIM").mkdir(parents=True)
+    content = os.urandom(64 * 1024)
+    (source / "image1.jpg").write_bytes(content)
+    (source / "DCIM" / "image1_burst.jpg").write_bytes(content)
+    (source / "video1.mp4").write_bytes(os.urandom(256 * 1024))
+
+    success, message, uploaded_files, duplicate_files = run_pipeline(str(source), queue_size=1)
+    assert success
+    assert len(uploaded_files) == 2
+    assert len(duplicate_files) == 1
+    print(message)
+    assert src.main.upload_queue.counts() == {"pending": 0, "in_flight": 0, "done": 2, "failed": 0}
+    if backend == "local":
+        uploaded = os.listdir(tmp_path / "uploaded" / "card")
+        assert len(uploaded) == 2 and "video1.mp4" in uploaded
+        assert "Already in local storage: 0" in message
+
+def test_previews(tmp_path, isolated_dbs, monkeypatch):
+    print("Testing previews uploaded with the originals...")
+    Image = pytest.importorskip("PIL.Image")
+    monkeypatch.setattr(src.main.storage, "STORAGE_BACKEND", "local")
+    monkeypatch.setattr(src.main.storage, "LOCAL_STORAGE_PATH", str(tmp_path / "uploaded"))
+
+    source = tmp_path / "card"
+    source.mkdir()
+    Image.new("RGB", (4000, 3000), (90, 120, 200)).save(source / "image1.jpg", quality=95)
+    (source / "video1.mp4").write_bytes(os.urandom(4096))
+
+    success, message, uploaded_files, duplicate_files = run_pipeline(str(source), queue_size=1)
+    assert success
+    print(message)
+    uploaded = tmp_path / "uploaded" / "card"
+    assert sorted(uploaded_files) == [
+        ("image1.jpg", (uploaded / "image1.jpg").as_uri(), (uploaded / "previews" / "image1.jpg.jpg").as_uri()),
+        ("video1.mp4", (uploaded / "video1.mp4").as_uri()),
+    ]
+    with Image.open(uploaded / "previews" / "image1.jpg.jpg") as img:
+        assert img.size == (2048, 1536)
+    assert "Files uploaded: 2" in message and "Previews made: 1" in message
+    assert src.main.upload_queue.counts()["done"] == 3
+
+def test_failed_upload_stage(tmp_path, isolated_dbs, monkeypatch):
+    print("Testing that files lost by a failed upload stage are neither forgotten nor skipped...")
+    monkeypatch.setattr(src.main, "PREVIEWS_ENABLED", False)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("closed")
+    monkeypatch.setattr(src.main.storage, "open_backend", fail)
+
+    source = tmp_path / "card"
+    source.mkdir()
+    content = os.urandom(1024)
+    (source / "image1.jpg").write_bytes(content)
+    (source / "image2.jpg").write_bytes(content)
+    (source / "video1.mp4").write_bytes(os.urandom(2048))
+
+    success, message, uploaded_files, duplicate_files = run_pipeline(str(source), queue_size=1)
+    assert not success and uploaded_files == []
+    # Unique files were held in the durable queue before the upload stage dropped them
+    assert sum(src.main.upload_queue.counts().values()) == 2
+    # Checked files are in the import manifest, duplicates included
+    assert len(src.main.file_manager.import_manifest.load_manifest(str(source))) == 3
+
+def test_no_upload_without_files(tmp_path, isolated_dbs, monkeypatch):
+    print("Testing that a run with nothing to upload never authenticates...")
+    calls = []
+    monkeypatch.setattr(src.main.cloud_uploader, "drive_client_factory", lambda: calls.append("auth"))
+
+    source = tmp_path / "card"
+    source.mkdir()
+    (source / "notes.txt").write_text("not media")
+
+    success, message, uploaded_files, duplicate_files = run_pipeline(str(source), queue_size=1)
+    assert success and uploaded_files == [] and calls == []
+
+def test_background_uploads(tmp_path, isolated_dbs, monkeypatch):
+    print("Testing queue-only uploads...")
+    monkeypatch.setattr(src.main, "UPLOAD_IN_BACKGROUND", True)
+    calls = []
+    monkeypatch.setattr(src.main.cloud_uploader, "drive_client_factory", lambda: calls.append("auth"))
+
+    source = tmp_path / "card"
+    source.mkdir()
+    (source / "image1.jpg").write_bytes(os.urandom(1024))
+    (source / "video1.mp4").write_bytes(os.urandom(2048))
+
+    success, message, uploaded_files, duplicate_files = run_pipeline(str(source), queue_size=1)
+    assert success and uploaded_files == [] and calls == []
+    assert "Queued for background upload: 2" in message
+    assert src.main.upload_queue.counts()["pending"] == 2
+
+def test_perceptual_dedup(tmp_path, isolated_dbs, monkeypatch):
+    print("Testing look-alike photos skipped by the pipeline...")
+    Image = pytest.importorskip("PIL.Image")
+    monkeypatch.setattr(src.main.storage, "STORAGE_BACKEND", "local")
+    monkeypatch.setattr(src.main.storage, "LOCAL_STORAGE_PATH", str(tmp_path / "uploaded"))
+    monkeypatch.setattr(src.main.duplicate_checker, "PERCEPTUAL_DEDUP", True)
+    monkeypatch.setattr(src.main, "PREVIEWS_ENABLED", False)
+
+    source = tmp_path / "card"
+    source.mkdir()
+    photo = Image.new("L", (256, 256))
+    photo.putdata([(x + 2 * y) % 256 for y in range(256) for x in range(256)])
+    photo.convert("RGB").save(source / "image1.jpg", quality=95)
+    photo.convert("RGB").resize((200, 200)).save(source / "image1_export.jpg", quality=60)
+    (source / "video1.mp4").write_bytes(os.urandom(2048))
+
+    success, message, uploaded_files, duplicate_files = run_pipeline(str(source), queue_size=1)
+    assert success
+    assert len(uploaded_files) == 2 and len(duplicate_files) == 1
+    assert os.path.basename(duplicate_files[0]) in ("image1.jpg", "image1_export.jpg")
+    assert len(src.main.file_manager.import_manifest.load_manifest(str(source))) == 3
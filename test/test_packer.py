@@ -0,0 +1,93 @@
+from src.packer import pack_files, Archive, PACK_INDEX_NAME
+from src.storage import LocalBackend, upload_files
+import src.storage
+import tarfile
+import json
+import os
+import pytest
+
+@pytest.fixture(autouse=True)
+def pack_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.storage.packer, "PACK_INDEX_DB_PATH", str(tmp_path / "pack_index.db"))
+
+def make_files(folder, sizes):
+    paths = []
+    for rel_path, size in sizes.items():
+        path = folder / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(size))
+        paths.append(str(path))
+    return paths
+
+def test_archive_stream(tmp_path):
+    print("Testing archives streamed from the files on disk...")
+    paths = make_files(tmp_path, {"image1.jpg": 1000, "image2.jpg": 0, "image3.cr2": 5000})
+    archive = Archive("pack.tar")
+    for i, path in enumerate(paths):
+        archive.add(path, f"DCIM/{os.path.basename(path)}" if i else os.path.basename(path), os.stat(path))
+    archive.finish()
+
+    with archive.open() as stream:
+        data = stream.read()
+        assert len(data) == archive.size and archive.size % tarfile.RECORDSIZE == 0
+        # Random access, as resumable and multipart uploads do
+        stream.seek(archive.index[2]["offset"] + 10)
+        assert stream.read(100) == open(paths[2], "rb").read()[10:110]
+        assert stream.seek(0, os.SEEK_END) == archive.size and stream.read(10) == b""
+
+    archive_path = tmp_path / "pack.tar"
+    archive_path.write_bytes(data)
+    with tarfile.open(archive_path) as tar:
+        assert tar.getnames() == ["image1.jpg", "DCIM/image2.jpg", "DCIM/image3.cr2", PACK_INDEX_NAME]
+        assert tar.extractfile("DCIM/image3.cr2").read() == open(paths[2], "rb").read()
+        index = json.load(tar.extractfile(PACK_INDEX_NAME))
+    assert index["files"] == archive.index
+    for entry, path in zip(index["files"], paths):
+        assert data[entry["offset"]:entry["offset"] + entry["size"]] == open(path, "rb").read()
+
+def test_pack_files(tmp_path):
+    print("Testing which files are packed...")
+    paths = make_files(tmp_path, {f"image{i}.jpg": 400 for i in range(5)})
+    paths += make_files(tmp_path, {"video1.mp4": 100, "big.cr2": 2000, "a/image3.jpg": 400})
+    items = list(pack_files(paths + [str(tmp_path / "missing.jpg")], target_size=1000, max_file_size=1000))
+
+    archives = [item for item in items if isinstance(item, Archive)]
+    assert [len(archive.members) for archive in archives] == [3, 3]
+    assert [item for item in items if not isinstance(item, Archive)] == [
+        str(tmp_path / "video1.mp4"), str(tmp_path / "big.cr2"), str(tmp_path / "missing.jpg")]
+    # Same name from another folder, with folders not mirrored
+    assert [arcname for _, arcname, _, _ in archives[1].members] == ["image3.jpg", "image4.jpg", "image3 (1).jpg"]
+
+    # A batch of one file is not worth an archive
+    assert list(pack_files(paths[:1])) == paths[:1]
+
+def test_packed_upload(tmp_path):
+    print("Testing pack mode with the local storage backend...")
+    backup = tmp_path / "backup"
+    paths = make_files(backup, {f"DCIM/image{i}.jpg": 3000 for i in range(6)})
+    paths += make_files(backup, {"video1.mp4": 3000})
+    backend = LocalBackend(str(tmp_path / "nas"), "Photos_2025", str(backup), mirror=True)
+    assert backend.prepare()
+
+    results = list(upload_files(paths, backend, workers=2, pack=True))
+    assert sorted(path for path, _, _ in results) == sorted(paths)
+    assert all(result and not reused for _, result, reused in results)
+    uploaded = tmp_path / "nas" / "Photos_2025"
+    archives = [name for name in os.listdir(uploaded) if name.endswith(".tar")]
+    assert len(archives) == 1 and sorted(os.listdir(uploaded)) == sorted(archives + ["video1.mp4"])
+    archive_link = (uploaded / archives[0]).as_uri()
+    links = {os.path.basename(path): result[1] for path, result, _ in results}
+    assert links["video1.mp4"] == (uploaded / "video1.mp4").as_uri()
+    assert {links[f"image{i}.jpg"] for i in range(6)} == {archive_link}
+
+    # The index tells where each file's bytes are in the uploaded archive
+    location = src.storage.packer.locate(paths[3])[0]
+    assert location["member"] == "DCIM/image3.jpg" and location["link"] == archive_link
+    with open(uploaded / archives[0], "rb") as f:
+        f.seek(location["offset"])
+        assert f.read(location["size"]) == open(paths[3], "rb").read()
+
+    # Packed files are found again on the next run, nothing is uploaded twice
+    results = list(upload_files(paths, backend, pack=True))
+    assert all(reused for _, _, reused in results)
+    assert len(os.listdir(uploaded)) == 2
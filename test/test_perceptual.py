@@ -0,0 +1,41 @@
+from src.perceptual import BKTree, hamming_distance, dhash
+from src.duplicate_checker import find_near_duplicates
+import src.duplicate_checker
+import random
+import pytest
+
+def test_bk_tree():
+    print("Testing BK-tree against brute force...")
+    rng = random.Random(7)
+    fingerprints = [rng.getrandbits(64) for _ in range(2000)]
+    tree = BKTree()
+    for i, fingerprint in enumerate(fingerprints):
+        tree.add(fingerprint, i)
+
+    for _ in range(20):
+        query = fingerprints[rng.randrange(len(fingerprints))] ^ (1 << rng.randrange(64))
+        expected = sorted(i for i, fingerprint in enumerate(fingerprints) if hamming_distance(query, fingerprint) <= 10)
+        assert sorted(item for _, item in tree.search(query, 10)) == expected
+
+def test_near_duplicates(tmp_path, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    print("Testing perceptual near-duplicate detection...")
+    monkeypatch.setattr(src.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+
+    # A smooth gradient photo, re-saved at another quality, and an unrelated picture
+    photo = Image.new("L", (256, 256))
+    photo.putdata([(x + 2 * y) % 256 for y in range(256) for x in range(256)])
+    photo.convert("RGB").save(tmp_path / "image1.jpg", quality=95)
+    photo.convert("RGB").resize((200, 200)).save(tmp_path / "image1_export.jpg", quality=60)
+    photo.transpose(Image.Transpose.FLIP_LEFT_RIGHT).convert("RGB").save(tmp_path / "image2.jpg")
+    paths = [str(tmp_path / name) for name in ["image1.jpg", "image2.jpg", "image1_export.jpg"]]
+
+    assert hamming_distance(dhash(paths[0]), dhash(paths[2])) <= 6
+    kept_files, near_duplicates, clusters = find_near_duplicates(paths)
+    assert kept_files == paths[:2]
+    assert [(path, match) for path, match, _ in near_duplicates] == [(paths[2], paths[0])]
+    assert clusters == [[paths[0], paths[2]]]
+
+    # Fingerprints persist: a later run matches against the archive
+    kept_files, near_duplicates, clusters = find_near_duplicates(paths[2:])
+    assert kept_files == []
@@ -0,0 +1,150 @@
+from src.previews import extract_embedded_preview, make_derivatives, iter_previews, benchmark, derivative_paths
+import src.previews
+import struct
+import io
+import os
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+def jpeg_bytes(width, height, color=(200, 40, 40)):
+    img = Image.new("RGB", (width, height), color)
+    img.paste((20, 20, 220), (0, 0, width // 4, height // 4))  # A corner marker, to check the orientation
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def write_tiff(path, endian, ifds, blobs):
+    """
+    Write a TIFF-based RAW stand-in.
+
+    ifds: list of (entries, next_ifd) with entries (tag, type, values); a value
+    ("blob", name), ("length", name) or ("ifd", index) is replaced by that offset or length.
+    """
+    sizes = {3: 2, 4: 4}
+    ifd_offsets, offset = [], 8
+    for entries, _ in ifds:
+        ifd_offsets.append(offset)
+        offset += 2 + 12 * len(entries) + 4
+    arrays = []  # Out-of-line values, after the directories
+    array_offsets = {}
+    for i, (entries, _) in enumerate(ifds):
+        for j, (tag, type_, values) in enumerate(entries):
+            if sizes[type_] * len(values) > 4:
+                array_offsets[(i, j)] = offset
+                offset += sizes[type_] * len(values)
+    blob_offsets = {}
+    for name, data in blobs.items():
+        blob_offsets[name] = offset
+        offset += len(data)
+
+    def resolve(value):
+        if isinstance(value, tuple):
+            kind, name = value
+            return {"blob": blob_offsets, "ifd": dict(enumerate(ifd_offsets))}.get(kind, {}).get(name) \
+                if kind != "length" else len(blobs[name])
+        return value
+
+    out = bytearray((b"II*\x00" if endian == "<" else b"MM\x00*") + struct.pack(endian + "I", ifd_offsets[0]))
+    for i, (entries, next_ifd) in enumerate(ifds):
+        out += struct.pack(endian + "H", len(entries))
+        for j, (tag, type_, values) in enumerate(entries):
+            fmt = {3: "H", 4: "I"}[type_]
+            packed = struct.pack(endian + fmt * len(values), *[resolve(value) for value in values])
+            if (i, j) in array_offsets:
+                arrays.append(packed)
+                field = struct.pack(endian + "I", array_offsets[(i, j)])
+            else:
+                field = packed.ljust(4, b"\x00")
+            out += struct.pack(endian + "HHI", tag, type_, len(values)) + field
+        out += struct.pack(endian + "I", ifd_offsets[next_ifd] if next_ifd is not None else 0)
+    for packed in arrays:
+        out += packed
+    for data in blobs.values():
+        out += data
+    path.write_bytes(bytes(out))
+
+# Lossless JPEG (SOF3) like the sensor data of a CR2: larger than any preview, but not one
+LOSSLESS = b"\xff\xd8\xff\xc3\x00\x0b\x08\x00\x10\x00\x10\x01\x01\x11\x00" + bytes(500 * 1024)
+
+def make_cr2(path, preview, orientation=1):
+    """CR2 layout: IFD0 holds the large preview as a strip, IFD1 a small thumbnail, IFD3 the sensor data."""
+    write_tiff(path, "<", [
+        ([(0x0103, 3, [6]), (0x0111, 4, [("blob", "preview")]), (0x0112, 3, [orientation]),
+          (0x0117, 4, [("length", "preview")])], 1),
+        ([(0x0201, 4, [("blob", "thumb")]), (0x0202, 4, [("length", "thumb")])], 2),
+        ([(0x0103, 3, [6]), (0x0111, 4, [("blob", "raw")]), (0x0117, 4, [("length", "raw")])], None),
+    ], {"preview": preview, "thumb": jpeg_bytes(160, 120), "raw": LOSSLESS})
+
+def make_nef(path, preview, orientation=1):
+    """NEF layout: big-endian, previews and sensor data in SubIFDs of IFD0."""
+    write_tiff(path, ">", [
+        ([(0x0112, 3, [orientation]), (0x014A, 4, [("ifd", 1), ("ifd", 2)])], None),
+        ([(0x0201, 4, [("blob", "preview")]), (0x0202, 4, [("length", "preview")])], None),
+        ([(0x0103, 3, [34713]), (0x0111, 4, [("blob", "raw")]), (0x0117, 4, [("length", "raw")])], None),
+    ], {"preview": preview, "raw": bytes(600 * 1024)})
+
+def test_embedded_preview(tmp_path):
+    print("Testing extraction of JPEG previews embedded in RAW files...")
+    preview = jpeg_bytes(1200, 800)
+    make_cr2(tmp_path / "image1.cr2", preview, orientation=6)
+    make_nef(tmp_path / "image2.nef", preview, orientation=8)
+    assert extract_embedded_preview(str(tmp_path / "image1.cr2")) == (preview, 6)
+    assert extract_embedded_preview(str(tmp_path / "image2.nef")) == (preview, 8)
+
+    (tmp_path / "image3.cr2").write_bytes(b"II*\x00" + os.urandom(1024))
+    assert extract_embedded_preview(str(tmp_path / "image3.cr2"))[0] is None
+    (tmp_path / "image4.nef").write_bytes(b"not a tiff")
+    assert extract_embedded_preview(str(tmp_path / "image4.nef")) == (None, 1)
+
+def test_make_derivatives(tmp_path):
+    print("Testing previews and thumbnails...")
+    make_cr2(tmp_path / "image1.cr2", jpeg_bytes(1200, 800), orientation=6)
+    source = make_derivatives(str(tmp_path / "image1.cr2"), str(tmp_path / "p1.jpg"), str(tmp_path / "t1.jpg"),
+                              preview_size=600, thumbnail_size=90)
+    assert source == "embedded"
+    with Image.open(tmp_path / "p1.jpg") as img:
+        assert img.size == (400, 600)  # Rotated by the RAW file's orientation
+        assert img.getpixel((390, 10))[2] > 150  # The top-left marker is now top-right
+    with Image.open(tmp_path / "t1.jpg") as img:
+        assert img.size == (60, 90)
+
+    (tmp_path / "image2.jpg").write_bytes(jpeg_bytes(3000, 2000))
+    assert make_derivatives(str(tmp_path / "image2.jpg"), str(tmp_path / "p2.jpg"), preview_size=600) == "image"
+    with Image.open(tmp_path / "p2.jpg") as img:
+        assert img.size == (600, 400) and img.format == "JPEG"
+
+def test_iter_previews(tmp_path, monkeypatch):
+    print("Testing previews made in a process pool...")
+    monkeypatch.setattr(src.previews.file_manager, "DESTINATION_PATH", str(tmp_path / "backup"))
+    backup = tmp_path / "backup" / src.previews.file_manager.BACKUP_SUBFOLDER
+    (backup / "DCIM").mkdir(parents=True)
+    make_cr2(backup / "DCIM" / "IMG_0001.CR2", jpeg_bytes(1200, 800))
+    (backup / "DCIM" / "IMG_0001.JPG").write_bytes(jpeg_bytes(1200, 800))
+    (backup / "video1.mp4").write_bytes(os.urandom(1024))
+    (backup / "broken.jpg").write_bytes(os.urandom(1024))
+    paths = [str(backup / "DCIM" / "IMG_0001.CR2"), str(backup / "DCIM" / "IMG_0001.JPG"),
+             str(backup / "video1.mp4"), str(backup / "broken.jpg")]
+
+    stats = {}
+    results = dict(iter_previews(paths, workers=2, stats=stats))
+    assert stats == {"made": 2, "embedded": 1, "reused": 0, "failed": 1}
+    assert results[paths[2]] is None and results[paths[3]] is None
+    # RAW + JPEG pairs get a preview each, in the file's subfolder of the preview folder
+    assert results[paths[0]] == str(backup / "previews" / "DCIM" / "IMG_0001.CR2.jpg")
+    assert results[paths[1]] == derivative_paths(paths[1])[0] and os.path.exists(derivative_paths(paths[1])[1])
+
+    stats = {}
+    assert dict(iter_previews(paths[:2], workers=2, stats=stats)) == {path: results[path] for path in paths[:2]}
+    assert stats["reused"] == 2 and stats["made"] == 0
+
+def test_benchmark(tmp_path):
+    print("Testing the preview benchmark...")
+    paths = []
+    for i in range(4):
+        make_cr2(tmp_path / f"image{i}.cr2", jpeg_bytes(1600, 1200))
+        paths.append(str(tmp_path / f"image{i}.cr2"))
+    result = benchmark(paths + [str(tmp_path / "video1.mp4")], workers=2)
+    assert result["images"] == 4 and result["embedded"] == 4 and result["workers"] == 2
+    assert result["images_per_s_per_core"] > 0
+    assert not (tmp_path / "previews").exists()
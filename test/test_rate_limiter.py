@@ -0,0 +1,116 @@
+from src.rate_limiter import RateLimiter, BandwidthLimiter, classify_error
+import pytest
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class FakeResponse(dict):
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+
+class FakeHttpError(Exception):
+    def __init__(self, status, content=b"", headers=None):
+        super().__init__(f"HTTP {status}")
+        self.resp = FakeResponse(status, headers)
+        self.content = content
+
+def make_limiter(clock, **kwargs):
+    return RateLimiter(clock=clock, sleep=clock.sleep, rand=lambda: 1.0, **kwargs)
+
+def test_token_bucket():
+    print("Testing the token bucket rate...")
+    clock = FakeClock()
+    limiter = make_limiter(clock, rate=10, burst=2)
+    for _ in range(6):
+        limiter.call(lambda: None)
+    # Two requests from the burst, then one every 0.1s
+    assert clock.now == pytest.approx(0.4)
+
+    limiter.call(lambda: None, cost=5)  # A batch goes into debt...
+    started = clock.now
+    limiter.call(lambda: None)
+    assert clock.now - started == pytest.approx(0.5)  # ...which the next request waits out
+
+def test_classify_error():
+    print("Testing which errors are retried...")
+    assert classify_error(FakeHttpError(429, headers={"retry-after": "7"})) == (True, True, 7.0)
+    assert classify_error(FakeHttpError(503)) == (True, False, None)
+    assert classify_error(FakeHttpError(403, b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}'))[:2] == (True, True)
+    assert classify_error(FakeHttpError(403, b'{"error": {"errors": [{"reason": "insufficientFilePermissions"}]}}'))[0] is False
+    assert classify_error(FakeHttpError(404))[0] is False
+    assert classify_error(ConnectionResetError())[0] is True
+    assert classify_error(TimeoutError())[0] is True
+    assert classify_error(FileNotFoundError(2, "No such file"))[0] is False  # Local I/O: fails at once
+    assert classify_error(OSError(28, "No space left on device"))[0] is False
+    assert classify_error(ValueError())[0] is False
+
+def test_backoff_and_aimd():
+    print("Testing backoff with Retry-After and the AIMD window...")
+    clock = FakeClock()
+    limiter = make_limiter(clock, max_concurrency=8, base_delay=1, max_delay=4)
+    errors = [FakeHttpError(429, headers={"retry-after": "10"}), FakeHttpError(503), FakeHttpError(503),
+              FakeHttpError(503), FakeHttpError(429)]
+
+    def flaky():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert limiter.call(flaky) == "ok"
+    # Retry-After wins over the first backoff; then 2s, 4s, capped at 4s
+    assert clock.sleeps == [10, 2, 4, 4, 4]
+    assert limiter.stats["throttles"] == 2 and limiter.stats["retries"] == 5
+    assert limiter.stats["concurrency"] == 2  # Halved twice
+
+    for _ in range(2 + 3):
+        limiter.call(lambda: None)
+    assert limiter.stats["concurrency"] == 4  # +1 after 2 successes, +1 after 3 more
+
+def test_gives_up():
+    print("Testing errors that are not retried...")
+    clock = FakeClock()
+    limiter = make_limiter(clock, max_retries=2, base_delay=1)
+
+    def not_found():
+        raise FakeHttpError(404)
+
+    def unavailable():
+        raise FakeHttpError(503)
+
+    with pytest.raises(FakeHttpError):
+        limiter.call(not_found)
+    assert limiter.stats["retries"] == 0 and limiter.stats["failures"] == 0
+    with pytest.raises(FakeHttpError):
+        limiter.call(unavailable)
+    assert limiter.stats["retries"] == 2 and limiter.stats["failures"] == 1
+    assert limiter.in_flight == 0
+
+def test_bandwidth_cap():
+    print("Testing the bytes-per-second cap and changing it at runtime...")
+    clock = FakeClock()
+    limiter = BandwidthLimiter(1000, clock=clock, sleep=clock.sleep)
+    for _ in range(4):
+        limiter.consume(500)
+    # 2000 bytes charged: the last 500 may go out at 1.5s, paying off by 2s
+    assert clock.now == pytest.approx(1.5)
+
+    limiter.consume(100000)  # A large chunk puts the cap deep in debt...
+    limiter.set_rate(10 ** 6)  # ...but a higher cap set meanwhile applies at once
+    started = clock.now
+    limiter.consume(1000)
+    assert clock.now - started < 0.2
+
+    limiter.set_rate(0)
+    started = clock.now
+    limiter.consume(10 ** 9)
+    assert clock.now == started and limiter.sent == 2000 + 100000 + 1000 + 10 ** 9
@@ -0,0 +1,46 @@
+from src.scheduling import order_files, get_policy, register_policy, sjf_aging
+import src.scheduling
+import os
+
+def test_order_files(tmp_path):
+    print("Testing upload scheduling policies...")
+    paths = []
+    for name, size in (("video1.mp4", 3000), ("image1.cr2", 2000), ("image2.jpg", 100), ("video2.mov", 10)):
+        path = tmp_path / name
+        path.write_bytes(os.urandom(size))
+        paths.append(str(path))
+    names = lambda ordered: [os.path.basename(path) for path in ordered]
+
+    assert names(order_files(paths, "fifo")) == ["video1.mp4", "image1.cr2", "image2.jpg", "video2.mov"]
+    assert names(order_files(paths, "small_first")) == ["video2.mov", "image2.jpg", "image1.cr2", "video1.mp4"]
+    assert names(order_files(paths, "photos_first")) == ["image2.jpg", "image1.cr2", "video2.mov", "video1.mp4"]
+    assert order_files(paths, "no_such_policy") == paths
+
+    register_policy("largest_first", lambda size, file_path, age: -size)
+    try:
+        assert names(order_files(paths, "largest_first"))[0] == "video1.mp4"
+    finally:
+        del src.scheduling.SCHEDULING_POLICIES["largest_first"]
+
+def test_aging():
+    print("Testing that waiting large files are not starved...")
+    key = get_policy("sjf_aging")
+    assert key is sjf_aging
+    video = 8 * 1024 ** 3
+    assert key(video, "video1.mp4", 0) > key(1024 ** 2, "image1.jpg", 0)
+    assert key(video, "video1.mp4", 3600) < key(1024 ** 2, "image1.jpg", 0)
+
+def test_previews_first(tmp_path, monkeypatch):
+    print("Testing that previews upload before originals...")
+    monkeypatch.setattr(src.scheduling.previews.file_manager, "DESTINATION_PATH", str(tmp_path))
+    preview_folder = tmp_path / src.scheduling.previews.file_manager.BACKUP_SUBFOLDER / "previews"
+    preview_folder.mkdir(parents=True)
+    paths = []
+    for path, size in ((tmp_path / "image2.jpg", 100), (preview_folder / "image1.cr2.jpg", 5000),
+                       (tmp_path / "image1.cr2", 2000)):
+        path.write_bytes(os.urandom(size))
+        paths.append(str(path))
+    names = lambda ordered: [os.path.basename(path) for path in ordered]
+
+    assert names(order_files(paths, "small_first")) == ["image1.cr2.jpg", "image2.jpg", "image1.cr2"]
+    assert names(order_files(paths, "fifo")) == ["image1.cr2.jpg", "image2.jpg", "image1.cr2"]
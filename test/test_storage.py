@@ -0,0 +1,272 @@
+from src.storage import StorageBackend, LocalBackend, S3Backend, upload_files, benchmark
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+from xml.sax.saxutils import escape
+import threading
+import types
+import tarfile
+import io
+import hashlib
+import os
+import pytest
+
+def make_files(folder, sizes):
+    paths = []
+    for rel_path, size in sizes.items():
+        path = folder / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(size))
+        paths.append(str(path))
+    return paths
+
+def test_local_backend(tmp_path):
+    print("Testing the local-folder storage backend...")
+    backup = tmp_path / "backup"
+    paths = make_files(backup, {"image1.jpg": 1000, "DCIM/image2.jpg": 2000, "video1.mp4": 3000})
+    backend = LocalBackend(str(tmp_path / "nas"), "Photos_2025", str(backup), mirror=True)
+    assert backend.prepare()
+
+    results = list(upload_files(paths, backend, workers=2))
+    assert all(result and not reused for _, result, reused in results)
+    uploaded = tmp_path / "nas" / "Photos_2025"
+    assert (uploaded / "DCIM" / "image2.jpg").read_bytes() == (backup / "DCIM" / "image2.jpg").read_bytes()
+    assert {link for _, (_, link), _ in results} == {
+        (uploaded / rel_path).as_uri() for rel_path in ("image1.jpg", "DCIM/image2.jpg", "video1.mp4")}
+
+    # Same content again: found by size and MD5, nothing copied
+    backend = LocalBackend(str(tmp_path / "nas"), "Photos_2025", str(backup), mirror=True)
+    assert all(reused for _, _, reused in upload_files(paths, backend))
+
+    # Same name, other content: both are kept
+    (backup / "image1.jpg").write_bytes(os.urandom(1000))
+    _, (file_name, link), reused = next(upload_files([paths[0]], backend))
+    assert not reused and link.endswith("/image1%20%281%29.jpg")
+    assert sorted(os.listdir(uploaded)) == ["DCIM", "image1 (1).jpg", "image1.jpg", "video1.mp4"]
+
+    # A backend missing a required method fails when created, not mid-upload
+    class IncompleteBackend(StorageBackend):
+        def resolve_folder(self, rel_dir=""):
+            return ""
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+def test_reused_files_shared(tmp_path):
+    print("Testing that files found in the storage are shared again...")
+
+    class SharingBackend(LocalBackend):
+        needs_sharing = True
+        shared = []
+
+        def share(self, file_ids):
+            self.shared.extend(file_ids)
+            return set(file_ids) if len(self.shared) == len(file_ids) else set()  # The first share fails
+
+    paths = make_files(tmp_path / "backup", {"image1.jpg": 1000})
+    backend = SharingBackend(str(tmp_path / "nas"), "Photos_2025")
+    assert backend.prepare()
+    [(_, result, _)] = upload_files(paths, backend)
+    assert result is None  # Uploaded, but its link doesn't work
+
+    # The next run finds the file and shares it before sending its link
+    [(_, result, reused)] = upload_files(paths, backend)
+    assert reused and result[1].endswith("/image1.jpg")
+    assert backend.shared == [str(tmp_path / "nas" / "Photos_2025" / "image1.jpg")] * 2
+
+def test_benchmark(tmp_path):
+    print("Testing the offline upload benchmark...")
+    paths = make_files(tmp_path / "backup", {f"image{i}.jpg": 64 * 1024 for i in range(8)})
+    backend = LocalBackend(str(tmp_path / "nas"), "bench")
+    assert backend.prepare()
+    stats = benchmark(paths, backend, workers=4)
+    assert stats["files"] == 8 and stats["failed"] == 0 and stats["bytes"] == 8 * 64 * 1024
+    assert stats["mb_per_s"] > 0
+
+def test_benchmark_fake_drive(tmp_path, monkeypatch):
+    print("Testing the offline upload benchmark against the fake Drive backend...")
+    pytest.importorskip("googleapiclient")
+    import src.storage
+    import src.cloud_uploader
+    monkeypatch.setattr(src.cloud_uploader.drive_index, "DRIVE_INDEX_DB_PATH", str(tmp_path / "drive_index.db"))
+    monkeypatch.setattr(src.cloud_uploader, "RESUMABLE_UPLOAD_MIN_SIZE", 128 * 1024)
+    monkeypatch.setattr(src.cloud_uploader, "UPLOAD_CHUNK_SIZE", 256 * 1024)
+    paths = make_files(tmp_path / "backup", {"image1.jpg": 64 * 1024, "image2.jpg": 64 * 1024,
+                                             "video1.mp4": 600 * 1024})
+    backend = src.storage.open_backend("bench", backend="fake_drive")
+    assert backend is not None and backend.name == "Google Drive"
+    stats = benchmark(paths, backend, workers=2)
+    assert stats["files"] == 3 and stats["failed"] == 0 and stats["bytes"] == 728 * 1024
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    """A MinIO-style stand-in: buckets, objects with metadata, ListObjectsV2 and multipart uploads."""
+    protocol_version = "HTTP/1.1"  # boto3 sends Expect: 100-continue with uploads
+
+    def _reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _target(self):
+        url = urlparse(self.path)
+        bucket, _, key = url.path.lstrip("/").partition("/")
+        return bucket, unquote(key), {name: values[0] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _metadata(self):
+        return {name[len("x-amz-meta-"):]: value for name, value in self.headers.items()
+                if name.lower().startswith("x-amz-meta-")}
+
+    def do_HEAD(self):
+        bucket, key, _ = self._target()
+        server = self.server
+        if bucket not in server.buckets or (key and key not in server.buckets[bucket]):
+            self._reply(404)
+            return
+        if not key:
+            self._reply(200)
+            return
+        data, etag, metadata = server.buckets[bucket][key]
+        server.heads += 1
+        headers = {"ETag": f'"{etag}"', "Last-Modified": "Wed, 01 Jan 2025 00:00:00 GMT"}
+        headers.update({f"x-amz-meta-{name}": value for name, value in metadata.items()})
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+
+    def do_PUT(self):
+        bucket, key, query = self._target()
+        server = self.server
+        body = self._body()
+        if not key:
+            server.buckets[bucket] = {}
+            server.bucket_configs[bucket] = body
+            self._reply(200)
+        elif "uploadId" in query:
+            server.uploads[query["uploadId"]]["parts"][int(query["partNumber"])] = body
+            self._reply(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+        else:
+            etag = hashlib.md5(body).hexdigest()
+            server.buckets[bucket][key] = (body, etag, self._metadata())
+            server.puts.append(key)
+            self._reply(200, headers={"ETag": f'"{etag}"'})
+
+    def do_POST(self):
+        bucket, key, query = self._target()
+        server = self.server
+        self._body()
+        if "uploads" in query:
+            upload_id = str(len(server.uploads) + 1)
+            server.uploads[upload_id] = {"parts": {}, "metadata": self._metadata()}
+            self._reply(200, (f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key>"
+                              f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>").encode())
+        else:
+            upload = server.uploads.pop(query["uploadId"])
+            data = b"".join(upload["parts"][number] for number in sorted(upload["parts"]))
+            etag = f"{hashlib.md5(data).hexdigest()}-{len(upload['parts'])}"
+            server.buckets[bucket][key] = (data, etag, upload["metadata"])
+            server.puts.append(key)
+            self._reply(200, (f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key>"
+                              f"<ETag>\"{etag}\"</ETag></CompleteMultipartUploadResult>").encode())
+
+    def do_GET(self):
+        bucket, key, query = self._target()
+        prefix, delimiter = query.get("prefix", ""), query.get("delimiter")
+        contents = ""
+        for name, (data, etag, _) in sorted(self.server.buckets[bucket].items()):
+            if name.startswith(prefix) and not (delimiter and delimiter in name[len(prefix):]):
+                contents += (f"<Contents><Key>{escape(name)}</Key><LastModified>2025-01-01T00:00:00.000Z</LastModified>"
+                             f"<ETag>\"{etag}\"</ETag><Size>{len(data)}</Size></Contents>")
+        self._reply(200, ('<?xml version="1.0" encoding="UTF-8"?>'
+                          '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                          f"<Name>{bucket}</Name><Prefix>{escape(prefix)}</Prefix><MaxKeys>1000</MaxKeys>"
+                          f"<IsTruncated>false</IsTruncated>{contents}</ListBucketResult>").encode())
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def fake_s3():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeS3Handler)
+    server.buckets = {}
+    server.bucket_configs = {}
+    server.uploads = {}
+    server.puts = []
+    server.heads = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_s3_backend(tmp_path, monkeypatch, fake_s3):
+    print("Testing the S3-compatible storage backend against a local stand-in...")
+    pytest.importorskip("boto3")
+    import src.storage
+    charged = []
+    limiter = types.SimpleNamespace(consume=charged.append)
+    monkeypatch.setattr(src.storage.rate_limiter, "get_bandwidth_limiter", lambda: limiter)
+    backup = tmp_path / "backup"
+    paths = make_files(backup, {"image1.jpg": 1000, "DCIM/image2.jpg": 2000, "video1.mp4": 9 * 1024 * 1024})
+
+    def s3_backend():
+        backend = S3Backend("media", "Photos_2025", str(backup), mirror=True,
+                         endpoint_url=f"http://127.0.0.1:{fake_s3.server_port}", multipart_threshold=64 * 1024,
+                         client_kwargs={"aws_access_key_id": "test", "aws_secret_access_key": "test"})
+        assert backend.prepare()
+        return backend
+
+    backend = s3_backend()
+    assert "media" in fake_s3.buckets
+    results = list(upload_files(paths, backend, workers=2))
+    assert all(result and not reused for _, result, reused in results)
+    objects = fake_s3.buckets["media"]
+    assert sorted(objects) == ["Photos_2025/DCIM/image2.jpg", "Photos_2025/image1.jpg", "Photos_2025/video1.mp4"]
+    assert objects["Photos_2025/video1.mp4"][1].endswith("-2")  # Uploaded in 8 MB parts
+    assert objects["Photos_2025/DCIM/image2.jpg"][0] == (backup / "DCIM" / "image2.jpg").read_bytes()
+    # Charged to the bandwidth cap as it is sent, not all up front
+    assert sum(charged) == 1000 + 2000 + 9 * 1024 * 1024 and max(charged) <= 8 * 1024 * 1024
+    link = dict((os.path.basename(path), result[1]) for path, result, _ in results)["image1.jpg"]
+    assert link.startswith(f"http://127.0.0.1:{fake_s3.server_port}/media/Photos_2025/image1.jpg?")
+    assert "Signature" in link
+
+    # A new run finds every file by its content: single-part objects by ETag, the multipart one by its metadata
+    puts = len(fake_s3.puts)
+    assert all(reused for _, _, reused in upload_files(paths, s3_backend()))
+    assert len(fake_s3.puts) == puts and fake_s3.heads == 1
+
+    # Outside us-east-1 a new bucket names its region
+    backend = S3Backend("media-eu", "Photos_2025", endpoint_url=f"http://127.0.0.1:{fake_s3.server_port}",
+                        region="eu-central-1",
+                        client_kwargs={"aws_access_key_id": "test", "aws_secret_access_key": "test"})
+    assert backend.prepare()
+    assert b"<LocationConstraint>eu-central-1</LocationConstraint>" in fake_s3.bucket_configs["media-eu"]
+    assert fake_s3.bucket_configs["media"] == b""
+
+def test_s3_packed(tmp_path, monkeypatch, fake_s3):
+    print("Testing archives streamed to S3, in one request and in parts...")
+    pytest.importorskip("boto3")
+    import src.storage
+    monkeypatch.setattr(src.storage.packer, "PACK_INDEX_DB_PATH", str(tmp_path / "pack_index.db"))
+    paths = make_files(tmp_path / "backup", {f"image{i}.jpg": 30 * 1024 for i in range(6)})
+    backend = S3Backend("media", "Photos_2025", endpoint_url=f"http://127.0.0.1:{fake_s3.server_port}",
+                        multipart_threshold=100 * 1024,
+                        client_kwargs={"aws_access_key_id": "test", "aws_secret_access_key": "test"})
+    assert backend.prepare()
+    assert all(result for _, result, _ in upload_files(paths[:4], backend, pack=True))
+    results = list(upload_files(paths[4:] + paths[:2], backend, pack=True))
+    assert sorted(path for path, _, reused in results if reused) == paths[:2]
+
+    # Four files over the multipart threshold, then the two new ones in a single request
+    archives = sorted(fake_s3.buckets["media"].values(), key=lambda obj: len(obj[0]))
+    assert [etag.endswith("-1") for _, etag, _ in archives] == [False, True]
+    for data, _, _ in archives:
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            assert tar.extractfile(tar.getnames()[0]).read() == open(
+                paths[int(tar.getnames()[0][5])], "rb").read()
@@ -0,0 +1,179 @@
+import src.upload_queue
+import types
+import time
+import sys
+import os
+import pytest
+
+@pytest.fixture
+def queue_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.upload_queue, "UPLOAD_QUEUE_DB_PATH", str(tmp_path / "upload_queue.db"))
+    monkeypatch.setattr(src.upload_queue.duplicate_checker, "DB_PATH", str(tmp_path / "file_hashes.db"))
+    yield src.upload_queue
+    src.upload_queue.close()
+
+def test_job_states(queue_db, monkeypatch):
+    print("Testing upload job states, attempts and leases...")
+    monkeypatch.setattr(queue_db, "UPLOAD_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(queue_db, "UPLOAD_RETRY_DELAY", 0)
+    ids = queue_db.enqueue(["a.jpg", "b.jpg", "c.jpg"], "Photos_2025")
+    assert queue_db.enqueue(["a.jpg"], "Photos_2025") == [ids[0]]  # Queued once per folder
+
+    jobs = queue_db.claim(2, policy="fifo")
+    assert [job[1] for job in jobs] == ["b.jpg", "c.jpg"]  # a.jpg was queued again, last
+    assert queue_db.counts() == {"pending": 1, "in_flight": 2, "done": 0, "failed": 0}
+    queue_db.complete(ids[2], "c.jpg", "link-c")
+    assert queue_db.fail(ids[1], "Upload failed") == "pending"  # Attempt 1 of 2
+
+    assert sorted(job[1] for job in queue_db.claim(10)) == ["a.jpg", "b.jpg"]
+    assert queue_db.fail(ids[1], "Upload failed") == "failed"  # Attempt 2 of 2
+    assert queue_db.counts() == {"pending": 0, "in_flight": 1, "done": 1, "failed": 1}
+
+    # a.jpg's worker died: once its lease runs out, another worker takes it over
+    assert queue_db.claim(10) == []
+    monkeypatch.setattr(queue_db, "UPLOAD_LEASE_SECONDS", -1)
+    queue_db.renew([ids[0]])
+    assert [job[1] for job in queue_db.claim(10)] == ["a.jpg"]
+
+def test_retry_backoff(queue_db, monkeypatch):
+    print("Testing retry delays of failed uploads...")
+    monkeypatch.setattr(queue_db, "UPLOAD_RETRY_DELAY", 60)
+    job_id = queue_db.enqueue(["a.jpg"], "Photos_2025", claim=True)[0]
+    queue_db.fail(job_id, "Upload failed")
+    assert queue_db.claim(10) == []  # Not due for a minute
+    assert queue_db.next_due() == pytest.approx(time.time() + 60, abs=5)
+
+def test_shared_connection(queue_db, monkeypatch):
+    print("Testing one queue connection per process...")
+    opened = []
+    real_connect = src.upload_queue.sqlite3.connect
+    monkeypatch.setattr(src.upload_queue.sqlite3, "connect", lambda *args, **kwargs: opened.append(args) or real_connect(*args, **kwargs))
+    ids = queue_db.enqueue(["a.jpg", "b.jpg"], "Photos_2025")
+    for _ in range(50):
+        queue_db.counts()
+    queue_db.claim(1)
+    queue_db.complete(ids[0], "a.jpg", "link-a")
+    assert len(opened) == 1  # Schema set up once, no connection per call
+
+    # A failed call rolls back and leaves the connection usable
+    with pytest.raises(ZeroDivisionError):
+        with queue_db._connect() as conn:
+            conn.execute("DELETE FROM upload_jobs")
+            1 / 0
+    assert queue_db.counts() == {"pending": 1, "in_flight": 0, "done": 1, "failed": 0}
+
+def test_worker_survives_restart(tmp_path, queue_db, monkeypatch):
+    print("Testing the background worker draining the queue across restarts...")
+    monkeypatch.setattr(queue_db, "UPLOAD_RETRY_DELAY", 0.2)
+    monkeypatch.setattr(queue_db.storage, "STORAGE_BACKEND", "local")
+    monkeypatch.setattr(queue_db.storage, "LOCAL_STORAGE_PATH", str(tmp_path / "uploaded"))
+    paths = [str(tmp_path / name) for name in ("image1.jpg", "image2.jpg", "video1.mp4")]
+    for path in paths[:2]:
+        with open(path, "wb") as f:
+            f.write(os.urandom(1024))
+    queue_db.enqueue(paths, "Photos_2025")
+
+    # The tool was closed with everything still queued: a later worker uploads it all.
+    # video1.mp4 can't be read at first, so it waits for a retry.
+    result = queue_db.run_worker(wait_for_retries=False)
+    assert result["done"] == 2 and result["pending"] == 1
+    with open(paths[2], "wb") as f:
+        f.write(os.urandom(2048))
+    result = queue_db.run_worker()  # Waits for the retry of video1.mp4
+    assert result == {"pending": 0, "in_flight": 0, "done": 3, "failed": 0}
+    assert sorted(os.listdir(tmp_path / "uploaded" / "Photos_2025")) == ["image1.jpg", "image2.jpg", "video1.mp4"]
+
+def test_worker_emails_links(tmp_path, queue_db, monkeypatch):
+    print("Testing links emailed by the background worker...")
+    monkeypatch.setattr(queue_db, "UPLOAD_MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(queue_db.storage, "STORAGE_BACKEND", "local")
+    monkeypatch.setattr(queue_db.storage, "LOCAL_STORAGE_PATH", str(tmp_path / "uploaded"))
+    monkeypatch.setattr(queue_db.previews.file_manager, "DESTINATION_PATH", str(tmp_path / "backup"))
+    sent = []
+    fake_sender = types.SimpleNamespace(send_links=lambda *args: sent.append(args) or (True, "sent"))
+    monkeypatch.setitem(sys.modules, "email_sender", fake_sender)
+
+    base_folder = queue_db.previews.file_manager.backup_folder()
+    image = os.path.join(base_folder, "image1.jpg")
+    preview = queue_db.previews.derivative_paths(image)[0]
+    video = os.path.join(base_folder, "video1.mp4")  # Can't be read: its upload fails
+    for path in (image, preview):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(os.urandom(1024))
+    started = time.time()
+    queue_db.enqueue([preview, image, video], "card", base_folder, source_folder="F:/card")
+    assert queue_db.waiting("F:/card", started) == 3
+    assert queue_db.request_email("F:/card", "friend@example.com", started) == 3
+
+    queue_db.run_worker(wait_for_retries=False)
+    uploaded = tmp_path / "uploaded" / "card"
+    assert sent == [([("image1.jpg", (uploaded / "image1.jpg").as_uri(),
+                       (uploaded / "previews" / "image1.jpg.jpg").as_uri())], "F:/card", "friend@example.com")]
+    [(file_path, state, attempts, last_error)] = queue_db.failures()
+    assert file_path == video and state == "failed" and "No such file" in last_error
+
+    queue_db.run_worker(wait_for_retries=False)
+    assert len(sent) == 1  # Emailed once
+
+def test_scheduling_policies(tmp_path, queue_db):
+    print("Testing size-aware claim order...")
+    sizes = {"video1.mp4": 300, "image1.jpg": 200, "image2.jpg": 100}
+    paths = {}
+    for name, size in sizes.items():
+        paths[name] = tmp_path / name
+        paths[name].write_bytes(b"x" * size)
+    queue_db.enqueue([str(paths[name]) for name in sizes], "Photos_2025")
+
+    def claim_order(policy):
+        names = [os.path.basename(job[1]) for job in queue_db.claim(10, ("Photos_2025", None), policy)]
+        queue_db.enqueue([str(paths[name]) for name in sizes], "Photos_2025")  # Back to pending
+        return names
+
+    assert claim_order("fifo") == ["video1.mp4", "image1.jpg", "image2.jpg"]
+    assert claim_order("small_first") == ["image2.jpg", "image1.jpg", "video1.mp4"]
+    assert claim_order(lambda size, file_path, age: -size) == ["video1.mp4", "image1.jpg", "image2.jpg"]
+    assert queue_db.claim(10, ("Other_folder", None)) == []
+
+    # sjf_aging: the video has waited long enough to go before the photos queued just now
+    with queue_db._connect() as conn:
+        conn.execute("UPDATE upload_jobs SET enqueued_at = enqueued_at - 3600 WHERE file_path LIKE '%.mp4'")
+        conn.commit()
+    assert claim_order("sjf_aging")[0] == "video1.mp4"
+    assert claim_order("small_first")[0] == "image2.jpg"
+
+def test_bandwidth_setting(queue_db, monkeypatch):
+    print("Testing the shared bandwidth cap setting...")
+    limiter = src.upload_queue.cloud_uploader.rate_limiter.BandwidthLimiter()
+    monkeypatch.setattr(src.upload_queue.cloud_uploader.rate_limiter, "_bandwidth_limiter", limiter)
+    assert queue_db.get_bandwidth_limit() is None
+    queue_db.set_bandwidth_limit(512 * 1024)
+    assert queue_db.get_bandwidth_limit() == 512 * 1024 and limiter.rate == 512 * 1024
+    queue_db.set_bandwidth_limit(0)
+    assert limiter.rate == 0
+
+def test_worker_verifies_hashes(tmp_path, queue_db, monkeypatch):
+    print("Testing full hashes filled in by an idle worker...")
+    duplicate_checker = queue_db.duplicate_checker
+    monkeypatch.setattr(duplicate_checker.hash_cache, "HASH_CACHE_ENABLED", False)
+    path = tmp_path / "image1.jpg"
+    path.write_bytes(os.urandom(1024))
+    assert list(duplicate_checker.iter_check_duplicates([str(path)])) == [(str(path), False)]
+    assert duplicate_checker.count_unverified() == 1  # Tiered check: signature only
+
+    queue_db.run_worker(wait_for_retries=False)  # Nothing to upload
+    assert duplicate_checker.count_unverified() == 0
+    assert duplicate_checker.hash_exists(duplicate_checker.compute_file_hash(str(path)))
+
+def test_claim_cost(tmp_path, queue_db, monkeypatch):
+    print("Testing that claims on a large queue sort in SQLite...")
+    queue_db.enqueue([str(tmp_path / f"image{i}.jpg") for i in range(5000)], "Photos_2025")
+    calls = []
+    monkeypatch.setattr(queue_db.previews, "is_derivative", lambda file_path: calls.append(file_path) or False)
+
+    started = time.perf_counter()
+    for policy in ("sjf_aging", "small_first", "fifo", "photos_first"):
+        for _ in range(25):
+            assert len(queue_db.claim(1, ("Photos_2025", None), policy)) == 1
+    assert calls == []  # No Python call per waiting job
+    assert time.perf_counter() - started < 2.0  # Was ~80 ms per claim, 8 s for these 100